@@ -1,17 +1,16 @@
-from fastapi import APIRouter, Response, HTTPException, Request
+from fastapi import APIRouter, Depends, Response, HTTPException, Request
 from services.user_service import UserService
-from services.session_service import SessionService
 from models.requests import UserRegister, UserLogin
 from utils.responses import success_response
+from dependencies import rate_limit_by_ip, session_service, set_session_cookie
 from config import settings
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
 # Initialize services
 user_service = UserService(settings.database_dsn)
-session_service = SessionService(redis_url=settings.redis_url, expire_minutes=settings.session_expire_minutes)
 
-@router.post("/register")
+@router.post("/register", dependencies=[Depends(rate_limit_by_ip("register"))])
 async def register(user_data: UserRegister):
     
     try:
@@ -29,14 +28,7 @@ async def login(response: Response, user_data: UserLogin):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
     session_id = await session_service.create_session(user_id=user["id"])
-    response.set_cookie(
-        key="session_id",
-        value=session_id,
-        httponly=True,
-        secure=False,  # Change to True in production
-        samesite="lax",
-        max_age=1440*60
-    )
+    set_session_cookie(response, session_id)
     return success_response(message="Login successful")
 
 @router.post("/logout")
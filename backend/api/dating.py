@@ -1,31 +1,58 @@
-from fastapi import APIRouter, Depends, Request, HTTPException
-from dependencies import get_current_user, get_dating_service, get_session_service
+from fastapi import APIRouter, Depends, Query, Request, Response, HTTPException
+import logging
+from dependencies import (
+    get_current_user, get_dating_service, get_session_service, get_recommendation_service, get_unread_service,
+    get_feed_materializer, dating_feed_since, use_primary_for_reads, unit_of_work, release_connections, record_write,
+    rate_limit_by_user, validated_body
+)
+from models.requests import DatingPostCreate, MessageSend
+from api.messages import increment_unread
 from utils.responses import success_response
+from utils.conditional import make_etag, not_modified, set_etag
 
 router = APIRouter(prefix="/dating", tags=["dating"])
+logger = logging.getLogger(__name__)
 
-@router.post("")
+@router.post("", dependencies=[Depends(unit_of_work(transaction=True))])
 async def create_dating_post(
     request: Request, 
+    data: DatingPostCreate = Depends(validated_body(DatingPostCreate)),
     user_id: int = Depends(get_current_user),
-    dating_service = Depends(get_dating_service)
+    dating_service = Depends(get_dating_service),
+    recommendation_service = Depends(get_recommendation_service)
 ):
-    data = await request.json()
     try:
         post = dating_service.create_dating_post(
             user_id=user_id,
-            title=data.get("title"),
-            description=data.get("description"),
-            target_gender=data.get("target_gender"),
-            target_age_min=data.get("target_age_min"),
-            target_age_max=data.get("target_age_max")
+            title=data.title,
+            description=data.description,
+            target_gender=data.target_gender,
+            target_age_min=data.target_age_min,
+            target_age_max=data.target_age_max
         )
+        release_connections()
+        await record_write(request)
+        try:
+            recommendation_service.add_post(post)
+        except Exception as e:
+            logger.warning(f"Failed to add post to recommendations: {e}")
         return success_response({"post": post})
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to create dating post")
 
-@router.get("")
-async def get_dating_posts(request: Request, session_service = Depends(get_session_service), dating_service = Depends(get_dating_service)):
+@router.get("", dependencies=[Depends(unit_of_work())])
+async def get_dating_posts(
+    request: Request,
+    response: Response,
+    target_gender: str | None = Query(None, max_length=10),
+    age: int | None = Query(None, ge=18, le=100),
+    limit: int | None = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    session_service = Depends(get_session_service),
+    dating_service = Depends(get_dating_service),
+    feed_materializer = Depends(get_feed_materializer),
+    use_primary: bool = Depends(use_primary_for_reads)
+):
     try:
         user_id = request.cookies.get("session_id")
         if user_id:
@@ -33,27 +60,76 @@ async def get_dating_posts(request: Request, session_service = Depends(get_sessi
     except:
         user_id = None
     
-    filters = dict(request.query_params)
+    # Normalize so "female", " Female" and "Female" share one index range and one ETag
+    filters = {}
+    if target_gender and target_gender.strip():
+        filters["target_gender"] = target_gender.strip().capitalize()
+    if age is not None:
+        filters["age"] = age
+    since = dating_feed_since()
     try:
-        posts = dating_service.get_dating_posts(filters if filters else None, user_id)
+        version = dating_service.get_versions(["dating_posts"], use_primary)["dating_posts"]
+        etag = make_etag("dating_posts", version, user_id, sorted(filters.items()), since, limit, offset)
+        unchanged = not_modified(request, etag)
+        if unchanged:
+            return unchanged
+
+        release_connections()
+        variant = dict(filters, since=since.isoformat()) if since else filters
+        page = await feed_materializer.get("dating_posts", variant, version)
+        if page and (page["complete"] or (limit and offset + limit <= len(page["rows"]))):
+            rows = page["rows"][offset:offset + limit if limit else None]
+            posts = dating_service.add_viewer_fields(rows, user_id, use_primary)
+        else:
+            posts = dating_service.get_dating_posts(
+                filters if filters else None, user_id, use_primary, since, limit, offset
+            )
+        set_etag(response, etag)
         return success_response({"posts": posts})
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to get dating posts")
 
-@router.post("/{post_id}/message")
+@router.get("/recommendations")
+async def get_recommendations(
+    age: int = Query(ge=18, le=100),
+    gender: str | None = Query(None, max_length=10),
+    limit: int = Query(20, ge=1, le=50),
+    user_id: int = Depends(get_current_user),
+    dating_service = Depends(get_dating_service),
+    recommendation_service = Depends(get_recommendation_service)
+):
+    try:
+        ranked = recommendation_service.recommend(
+            user_id, gender.strip().capitalize() if gender else None, age, limit
+        )
+        posts = {post["id"]: post for post in dating_service.get_dating_posts_by_ids(
+            [item["post_id"] for item in ranked], user_id
+        )}
+        return success_response({"posts": [
+            dict(posts[item["post_id"]], score=item["score"]) for item in ranked if item["post_id"] in posts
+        ]})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Failed to get recommendations")
+
+@router.post("/{post_id}/message", dependencies=[Depends(unit_of_work(transaction=True))])
 async def send_message(
     post_id: int, 
     request: Request, 
+    data: MessageSend = Depends(validated_body(MessageSend)),
     user_id: int = Depends(get_current_user),
-    dating_service = Depends(get_dating_service)
+    rate_limited: None = Depends(rate_limit_by_user("message")),
+    dating_service = Depends(get_dating_service),
+    unread_service = Depends(get_unread_service)
 ):
-    data = await request.json()
     try:
         message = dating_service.send_message(
             sender_id=user_id,
             dating_post_id=post_id,
-            content=data.get("content")
+            content=data.content
         )
+        release_connections()
+        await record_write(request)
+        await increment_unread(unread_service, message['receiver_id'])
         return success_response({"message": message})
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -1,54 +1,126 @@
-from fastapi import APIRouter, Depends, Request, HTTPException
-from dependencies import get_current_user, get_dating_service
+import logging
+from datetime import date, timedelta
+from fastapi import APIRouter, Depends, Request, Response, HTTPException
+from dependencies import (
+    get_current_user, get_dating_service, get_unread_service,
+    use_primary_for_reads, unit_of_work, release_connections, record_write, rate_limit_by_user, validated_body
+)
+from models.requests import MessageSend, MessageReply
 from utils.responses import success_response
+from utils.conditional import make_etag, not_modified, set_etag
+from config import settings
 
 router = APIRouter(prefix="/messages", tags=["messages"])
+logger = logging.getLogger(__name__)
 
-@router.get("")
+async def increment_unread(unread_service, receiver_id: int):
+    # The message is already committed; a missed increment is corrected when the counter expires
+    try:
+        await unread_service.increment(receiver_id)
+    except Exception as e:
+        logger.warning(f"Failed to update unread counter: {e}")
+
+@router.get("", dependencies=[Depends(unit_of_work())])
 async def get_messages(
+    request: Request,
+    response: Response,
     user_id: int = Depends(get_current_user),
-    dating_service = Depends(get_dating_service)
+    dating_service = Depends(get_dating_service),
+    use_primary: bool = Depends(use_primary_for_reads)
 ):
     try:
-        messages = dating_service.get_messages(user_id)
+        since = date.today() - timedelta(days=settings.inbox_window_days) if settings.inbox_window_days else None
+        key = f"messages:{user_id}"
+        etag = make_etag(key, dating_service.get_versions([key], use_primary)[key], since)
+        unchanged = not_modified(request, etag)
+        if unchanged:
+            return unchanged
+
+        messages = dating_service.get_messages(user_id, use_primary, since)
+        set_etag(response, etag)
         return success_response({"messages": messages})
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to get messages")
 
-@router.post("/{message_id}/reply")
+@router.get("/unread_count")
+async def get_unread_count(
+    user_id: int = Depends(get_current_user),
+    dating_service = Depends(get_dating_service),
+    unread_service = Depends(get_unread_service)
+):
+    try:
+        try:
+            unread = await unread_service.get(user_id)
+        except Exception as e:
+            logger.warning(f"Unread counter unavailable: {e}")
+            return success_response({"unread": dating_service.count_unread(user_id)})
+        if unread is None:
+            unread = dating_service.count_unread(user_id)
+            await unread_service.prime(user_id, unread)
+        return success_response({"unread": unread})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Failed to get unread count")
+
+@router.post("/read", dependencies=[Depends(unit_of_work(transaction=True))])
+async def mark_messages_read(
+    request: Request,
+    user_id: int = Depends(get_current_user),
+    dating_service = Depends(get_dating_service),
+    unread_service = Depends(get_unread_service)
+):
+    try:
+        marked = dating_service.mark_messages_read(user_id)
+        release_connections()
+        await record_write(request)
+        try:
+            await unread_service.reset(user_id)
+        except Exception as e:
+            logger.warning(f"Failed to reset unread counter: {e}")
+        return success_response({"marked": marked})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Failed to mark messages as read")
+
+@router.post("/{message_id}/reply", dependencies=[Depends(unit_of_work(transaction=True))])
 async def reply_message(
     message_id: int, 
     request: Request, 
+    data: MessageReply = Depends(validated_body(MessageReply)),
     user_id: int = Depends(get_current_user),
-    dating_service = Depends(get_dating_service)
+    rate_limited: None = Depends(rate_limit_by_user("reply")),
+    dating_service = Depends(get_dating_service),
+    unread_service = Depends(get_unread_service)
 ):
-    data = await request.json()
     try:
         message = dating_service.reply_message(
             message_id=message_id,
             user_id=user_id,
-            reply_content=data.get("reply_content")
+            reply_content=data.reply_content
         )
+        release_connections()
+        await record_write(request)
+        await increment_unread(unread_service, message['receiver_id'])
         return success_response({"message": message})
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to reply message")
 
-@router.put("/{message_id}")
+@router.put("/{message_id}", dependencies=[Depends(unit_of_work(transaction=True))])
 async def update_message(
     message_id: int, 
     request: Request, 
+    data: MessageSend = Depends(validated_body(MessageSend)),
     user_id: int = Depends(get_current_user),
     dating_service = Depends(get_dating_service)
 ):
-    data = await request.json()
     try:
         message = dating_service.update_message(
             message_id=message_id,
             user_id=user_id,
-            content=data.get("content")
+            content=data.content
         )
+        release_connections()
+        await record_write(request)
         return success_response({"message": message})
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -1,32 +1,63 @@
-from fastapi import APIRouter, Depends, Request, HTTPException
-from dependencies import get_current_user, get_post_service, get_session_service
+import logging
+from typing import List, Literal
+from fastapi import APIRouter, Depends, Query, Request, Response, HTTPException
+from dependencies import (
+    get_current_user, get_post_service, get_session_service, get_trending_service, get_feed_materializer,
+    use_primary_for_reads, unit_of_work, release_connections, record_write, rate_limit_by_user, validated_body
+)
+from models.requests import CommentPostCreate, PostIdsBatch
+from services.post_service import STATS_DIMENSIONS
 from utils.responses import success_response
+from utils.conditional import make_etag, not_modified, set_etag
 
 router = APIRouter(prefix="/comment_posts", tags=["comment_posts"])
+logger = logging.getLogger(__name__)
 
-@router.post("")
+async def update_trending(trending_service, liked: list[int] | None = None, unliked: dict[int, float] | None = None):
+    # liked: newly liked post ids; unliked: {post_id: when the removed like was made}.
+    # The like is already committed; a Redis hiccup only costs leaderboard accuracy
+    try:
+        for post_id in liked or []:
+            await trending_service.record_like(post_id)
+        for post_id, liked_at in (unliked or {}).items():
+            await trending_service.record_unlike(post_id, liked_at)
+    except Exception as e:
+        logger.warning(f"Failed to update trending scores: {e}")
+
+@router.post("", dependencies=[Depends(unit_of_work(transaction=True))])
 async def create_comment_post(
     request: Request, 
+    data: CommentPostCreate = Depends(validated_body(CommentPostCreate)),
     user_id: int = Depends(get_current_user),
     post_service = Depends(get_post_service)
 ):
-    data = await request.json()
     try:
         post = post_service.create_post(
             user_id=user_id,
-            target_gender=data.get("target_gender"),
-            target_job=data.get("target_job"),
-            target_birth_year=data.get("target_birth_year"),
-            target_height=data.get("target_height"),
-            target_app=data.get("target_app"),
-            comment=data.get("comment")
+            target_gender=data.target_gender,
+            target_job=data.target_job,
+            target_birth_year=data.target_birth_year,
+            target_height=data.target_height,
+            target_app=data.target_app,
+            comment=data.comment
         )
+        release_connections()
+        await record_write(request)
         return success_response({"post": post})
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to create comment post")
 
-@router.get("")
-async def get_comment_posts(request: Request, session_service = Depends(get_session_service), post_service = Depends(get_post_service)):
+@router.get("", dependencies=[Depends(unit_of_work())])
+async def get_comment_posts(
+    request: Request,
+    response: Response,
+    limit: int | None = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    session_service = Depends(get_session_service),
+    post_service = Depends(get_post_service),
+    feed_materializer = Depends(get_feed_materializer),
+    use_primary: bool = Depends(use_primary_for_reads)
+):
     try:
         user_id = request.cookies.get("session_id")
         if user_id:
@@ -34,60 +65,190 @@ async def get_comment_posts(request: Request, session_service = Depends(get_sess
     except:
         user_id = None
     
-    filters = dict(request.query_params)
+    filters = {name: value for name, value in request.query_params.items() if name not in ("limit", "offset")}
     try:
-        posts = post_service.get_posts(filters if filters else None, user_id)
+        # Viewer and filters are part of the tag: user_liked/is_owner differ per viewer
+        version = post_service.get_versions(["comment_posts"], use_primary)["comment_posts"]
+        etag = make_etag("comment_posts", version, user_id, sorted(request.query_params.items()))
+        unchanged = not_modified(request, etag)
+        if unchanged:
+            return unchanged
+
+        release_connections()
+        page = await feed_materializer.get("comment_posts", filters, version)
+        if page and (page["complete"] or (limit and offset + limit <= len(page["rows"]))):
+            rows = page["rows"][offset:offset + limit if limit else None]
+            posts = post_service.add_viewer_fields(rows, user_id, use_primary)
+        else:
+            posts = post_service.get_posts(filters if filters else None, user_id, use_primary, limit, offset)
+        set_etag(response, etag)
         return success_response({"posts": posts})
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to get comment posts")
 
-@router.put("/{post_id}")
+# Fixed paths are declared before the /{post_id} routes so they are not parsed as an id
+@router.get("/trending")
+async def get_trending_comment_posts(
+    limit: int = Query(20, ge=1, le=100),
+    trending_service = Depends(get_trending_service)
+):
+    try:
+        # Ids and scores only; clients hydrate them through /comment_posts/batch
+        trending = await trending_service.get_trending(limit)
+        return success_response({"trending": trending})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Failed to get trending comment posts")
+
+@router.get("/stats", dependencies=[Depends(unit_of_work())])
+async def get_comment_post_stats(
+    request: Request,
+    response: Response,
+    dimension: List[Literal["target_app", "target_job", "target_birth_year"]] | None = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    post_service = Depends(get_post_service),
+    use_primary: bool = Depends(use_primary_for_reads)
+):
+    try:
+        # Served from the comment_post_stats summary rows, which every post and like write maintains
+        dimensions = tuple(dict.fromkeys(dimension)) if dimension else STATS_DIMENSIONS
+        version = post_service.get_versions(["comment_posts"], use_primary)["comment_posts"]
+        etag = make_etag("comment_post_stats", version, dimensions, limit)
+        unchanged = not_modified(request, etag)
+        if unchanged:
+            return unchanged
+
+        stats = post_service.get_stats(dimensions, limit, use_primary)
+        set_etag(response, etag)
+        return success_response({"stats": stats})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Failed to get comment post stats")
+
+@router.get("/batch")
+async def get_comment_posts_batch(
+    request: Request,
+    ids: List[int] = Query(min_length=1, max_length=100),
+    session_service = Depends(get_session_service),
+    post_service = Depends(get_post_service),
+    use_primary: bool = Depends(use_primary_for_reads)
+):
+    try:
+        user_id = request.cookies.get("session_id")
+        if user_id:
+            user_id = await session_service.get_user_id(user_id)
+    except:
+        user_id = None
+
+    try:
+        posts = post_service.get_posts_by_ids(ids, user_id, use_primary)
+        found = {post["id"] for post in posts}
+        return success_response({
+            "posts": posts,
+            "not_found": [post_id for post_id in ids if post_id not in found]
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Failed to get comment posts")
+
+async def batch_size(batch: PostIdsBatch = Depends(validated_body(PostIdsBatch))) -> int:
+    # A batch spends one like token per post, the same as liking the posts one by one
+    return len(batch.post_ids)
+
+@router.post("/batch/like", dependencies=[Depends(unit_of_work(transaction=True))])
+async def like_comment_posts_batch(
+    request: Request,
+    batch: PostIdsBatch = Depends(validated_body(PostIdsBatch)),
+    user_id: int = Depends(get_current_user),
+    rate_limited: None = Depends(rate_limit_by_user("like", cost=batch_size)),
+    post_service = Depends(get_post_service),
+    trending_service = Depends(get_trending_service)
+):
+    try:
+        results = post_service.like_posts(batch.post_ids, user_id)
+        release_connections()
+        await record_write(request)
+        await update_trending(trending_service, liked=[r["post_id"] for r in results if r["liked"]])
+        return success_response({"results": results})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Failed to like comment posts")
+
+@router.post("/batch/unlike", dependencies=[Depends(unit_of_work(transaction=True))])
+async def unlike_comment_posts_batch(
+    request: Request,
+    batch: PostIdsBatch = Depends(validated_body(PostIdsBatch)),
+    user_id: int = Depends(get_current_user),
+    rate_limited: None = Depends(rate_limit_by_user("like", cost=batch_size)),
+    post_service = Depends(get_post_service),
+    trending_service = Depends(get_trending_service)
+):
+    try:
+        results, liked_at = post_service.unlike_posts(batch.post_ids, user_id)
+        release_connections()
+        await record_write(request)
+        await update_trending(trending_service, unliked=liked_at)
+        return success_response({"results": results})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Failed to unlike comment posts")
+
+@router.put("/{post_id}", dependencies=[Depends(unit_of_work(transaction=True))])
 async def update_comment_post(
     post_id: int, 
     request: Request, 
+    data: CommentPostCreate = Depends(validated_body(CommentPostCreate)),
     user_id: int = Depends(get_current_user),
     post_service = Depends(get_post_service)
 ):
-    data = await request.json()
     try:
         post = post_service.update_post(
             post_id=post_id,
             user_id=user_id,
-            target_gender=data.get("target_gender"),
-            target_job=data.get("target_job"),
-            target_birth_year=data.get("target_birth_year"),
-            target_height=data.get("target_height"),
-            target_app=data.get("target_app"),
-            comment=data.get("comment")
+            target_gender=data.target_gender,
+            target_job=data.target_job,
+            target_birth_year=data.target_birth_year,
+            target_height=data.target_height,
+            target_app=data.target_app,
+            comment=data.comment
         )
         if not post:
             raise HTTPException(status_code=404, detail="Comment post not found or not authorized")
+        release_connections()
+        await record_write(request)
         return success_response({"post": post})
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to update comment post")
 
-@router.post("/{post_id}/like")
+@router.post("/{post_id}/like", dependencies=[Depends(rate_limit_by_user("like")), Depends(unit_of_work(transaction=True))])
 async def like_comment_post(
     post_id: int, 
+    request: Request,
     user_id: int = Depends(get_current_user),
-    post_service = Depends(get_post_service)
+    post_service = Depends(get_post_service),
+    trending_service = Depends(get_trending_service)
 ):
     try:
         success = post_service.like_post(post_id, user_id)
+        release_connections()
+        await record_write(request)
+        if success:
+            await update_trending(trending_service, liked=[post_id])
         return success_response({"liked": success})
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to like comment post")
 
-@router.delete("/{post_id}/like")
+@router.delete("/{post_id}/like", dependencies=[Depends(rate_limit_by_user("like")), Depends(unit_of_work(transaction=True))])
 async def unlike_comment_post(
     post_id: int, 
+    request: Request,
     user_id: int = Depends(get_current_user),
-    post_service = Depends(get_post_service)
+    post_service = Depends(get_post_service),
+    trending_service = Depends(get_trending_service)
 ):
     try:
-        success = post_service.unlike_post(post_id, user_id)
-        return success_response({"unliked": success})
+        liked_at = post_service.unlike_post(post_id, user_id)
+        release_connections()
+        await record_write(request)
+        if liked_at is not None:
+            await update_trending(trending_service, unliked={post_id: liked_at})
+        return success_response({"unliked": liked_at is not None})
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to unlike comment post")
\ No newline at end of file
@@ -1,25 +1,84 @@
-from fastapi import APIRouter, Depends, HTTPException
-from dependencies import get_current_user, get_user_service, get_post_service, get_dating_service
-from utils.responses import success_response
+from fastapi import APIRouter, Depends, Request, Response, HTTPException
+from fastapi.responses import StreamingResponse
+from dependencies import (
+    get_current_user, get_user_service, get_post_service, get_dating_service,
+    use_primary_for_reads, unit_of_work, release_connections, record_write, rate_limit_by_user, validated_body
+)
+from models.requests import UsernameUpdate
+from utils.responses import success_response, ndjson_line
+from utils.conditional import make_etag, not_modified, set_etag
+from config import settings
 
 router = APIRouter(prefix="/users", tags=["users"])
 
-@router.get("/profile")
+@router.get("/profile", dependencies=[Depends(unit_of_work())])
 async def profile(
+    request: Request,
+    response: Response,
     user_id: int = Depends(get_current_user),
     user_service = Depends(get_user_service),
     post_service = Depends(get_post_service),
-    dating_service = Depends(get_dating_service)
+    dating_service = Depends(get_dating_service),
+    use_primary: bool = Depends(use_primary_for_reads)
 ):
     try:
+        key = f"profile:{user_id}"
+        etag = make_etag(key, post_service.get_versions([key], use_primary)[key])
+        unchanged = not_modified(request, etag)
+        if unchanged:
+            return unchanged
+
         user = user_service.get_user_by_id(user_id)
-        user_posts = post_service.get_user_posts(user_id)
-        user_dating_posts = dating_service.get_user_dating_posts(user_id)
-        return success_response({
+        user_posts = post_service.get_user_posts(user_id, use_primary)
+        user_dating_posts = dating_service.get_user_dating_posts(user_id, use_primary)
+        result = success_response({
             "user_id": user_id, 
             "user": user,
             "comment_posts": user_posts,
             "dating_posts": user_dating_posts
         })
+        set_etag(response, etag)
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Failed to get profile")
+
+@router.put("/username", dependencies=[Depends(unit_of_work(transaction=True))])
+async def update_username(
+    request: Request,
+    data: UsernameUpdate = Depends(validated_body(UsernameUpdate)),
+    user_id: int = Depends(get_current_user),
+    user_service = Depends(get_user_service)
+):
+    try:
+        user = user_service.update_username(user_id, data.username)
+        release_connections()
+        await record_write(request)
+        return success_response({"user": user})
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail="Failed to get profile")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to update username")
+
+@router.get("/export", dependencies=[Depends(rate_limit_by_user("export"))])
+async def export_history(
+    user_id: int = Depends(get_current_user),
+    post_service = Depends(get_post_service),
+    dating_service = Depends(get_dating_service)
+):
+    # Sync generator: Starlette iterates it in the threadpool, one cursor batch at a time
+    def records():
+        batch_size = settings.export_batch_size
+        sections = [
+            ("comment_post", post_service.iter_user_posts),
+            ("dating_post", dating_service.iter_user_dating_posts),
+            ("message", dating_service.iter_user_messages),
+        ]
+        for record_type, iter_rows in sections:
+            for row in iter_rows(user_id, batch_size):
+                yield ndjson_line(record_type, row)
+
+    return StreamingResponse(
+        records(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="o2gethem-export-{user_id}.ndjson"'}
+    )
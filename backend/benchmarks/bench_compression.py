@@ -0,0 +1,68 @@
+"""CPU-vs-bytes tradeoff of feed compression levels.
+
+Builds a synthetic /comment_posts payload shaped like PostService.get_posts rows and
+reports compressed size and time per response for each gzip level and brotli quality.
+
+    python -m benchmarks.bench_compression --posts 2000
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JOBS = ["Engineer", "Designer", "Teacher", "Nurse", "Doctor", "Lawyer", "Student"]
+APPS = ["Tinder", "Bumble", "Pairs", "Omi", "CoffeeMeetsBagel"]
+
+def build_feed(count: int) -> bytes:
+    rng = random.Random(42)
+    posts = [
+        {
+            "id": i,
+            "user_id": rng.randint(1, 500),
+            "target_gender": rng.choice(["Male", "Female"]),
+            "target_job": rng.choice(JOBS),
+            "target_birth_year": rng.randint(1980, 2004),
+            "target_height": rng.randint(150, 195),
+            "target_app": rng.choice(APPS),
+            "comment": " ".join(rng.choice(JOBS + APPS) for _ in range(rng.randint(5, 40))),
+            "created_at": f"2025-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}T12:00:00",
+            "likes_count": rng.randint(0, 200),
+            "user_liked": rng.random() < 0.1,
+            "is_owner": False,
+        }
+        for i in range(count)
+    ]
+    return json.dumps({"status": "ok", "message": "Success", "posts": posts}).encode()
+
+def measure(name: str, compress, body: bytes, rounds: int):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        compressed = compress(body)
+    elapsed_ms = (time.perf_counter() - start) / rounds * 1000
+    print(f"{name:<12} {len(compressed):>10} {len(body) / len(compressed):>7.1f}x {elapsed_ms:>9.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    body = build_feed(args.posts)
+    print(f"payload: {len(body)} bytes ({args.posts} posts)")
+    print(f"{'encoding':<12} {'bytes':>10} {'ratio':>8} {'cpu/resp':>12}")
+    for level in (1, 3, 5, 6, 9):
+        measure(f"gzip-{level}", lambda b: gzip.compress(b, compresslevel=level), body, args.rounds)
+    if brotli is None:
+        print("brotli not installed; skipping br")
+        return
+    for quality in (1, 4, 6, 9, 11):
+        measure(f"br-{quality}", lambda b: brotli.compress(b, quality=quality), body, args.rounds)
+
+if __name__ == "__main__":
+    main()
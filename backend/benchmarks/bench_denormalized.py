@@ -0,0 +1,112 @@
+"""Per-call cost of the dating feed and inbox with users joins vs copied usernames.
+
+The "join" variants are the queries as they were before usernames were denormalized onto
+dating_posts and dating_messages. Runs against the database in DATABASE_DSN (read-only
+queries, no data is written):
+
+    python -m benchmarks.bench_denormalized --calls 500 --user-id 1
+"""
+import argparse
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from config import settings
+from services.statements import PreparedConnection
+from services.dating_service import GET_MESSAGES
+from benchmarks.bench_prepared import measure
+
+FEED_JOIN = """
+    SELECT dp.*, u.username,
+           CASE WHEN dp.user_id = %s THEN true ELSE false END as is_owner,
+           CASE WHEN EXISTS(
+               SELECT 1 FROM dating_messages dm
+               WHERE dm.dating_post_id = dp.id AND dm.sender_id = %s AND dm.reply_to_message_id IS NULL
+                 AND dm.created_at >= dp.created_at
+           ) THEN true ELSE false END as already_messaged
+    FROM dating_posts dp
+    JOIN users u ON dp.user_id = u.id
+    ORDER BY dp.created_at DESC
+"""
+
+FEED_COLUMN = """
+    SELECT dp.*,
+           CASE WHEN dp.user_id = %s THEN true ELSE false END as is_owner,
+           CASE WHEN EXISTS(
+               SELECT 1 FROM dating_messages dm
+               WHERE dm.dating_post_id = dp.id AND dm.sender_id = %s AND dm.reply_to_message_id IS NULL
+                 AND dm.created_at >= dp.created_at
+           ) THEN true ELSE false END as already_messaged
+    FROM dating_posts dp
+    ORDER BY dp.created_at DESC
+"""
+
+INBOX_JOIN = """
+    SELECT dm.*,
+           s.username as sender_username,
+           r.username as receiver_username,
+           dp.title as dating_post_title,
+           orig.content as original_message_content,
+           orig_sender.username as original_sender_username,
+           CASE WHEN dm.sender_id = %s THEN true ELSE false END as sender_id,
+           CASE WHEN dm.receiver_id = %s THEN true ELSE false END as receiver_id,
+           CASE WHEN EXISTS(
+               SELECT 1 FROM dating_messages reply
+               WHERE reply.reply_to_message_id = dm.id AND reply.sender_id = %s
+                 AND reply.created_at >= dm.created_at
+           ) THEN true ELSE false END as already_replied
+    FROM dating_messages dm
+    JOIN users s ON dm.sender_id = s.id
+    JOIN users r ON dm.receiver_id = r.id
+    LEFT JOIN dating_posts dp ON dm.dating_post_id = dp.id AND dp.created_at <= dm.created_at
+    LEFT JOIN dating_messages orig ON dm.reply_to_message_id = orig.id AND orig.created_at <= dm.created_at
+    LEFT JOIN users orig_sender ON orig.sender_id = orig_sender.id
+    WHERE (dm.sender_id = %s OR dm.receiver_id = %s)
+      AND dm.created_at >= %s
+    ORDER BY dm.created_at DESC
+"""
+
+INBOX_COLUMN = """
+    SELECT dm.*,
+           dp.title as dating_post_title,
+           orig.content as original_message_content,
+           orig.sender_username as original_sender_username,
+           CASE WHEN dm.sender_id = %s THEN true ELSE false END as sender_id,
+           CASE WHEN dm.receiver_id = %s THEN true ELSE false END as receiver_id,
+           CASE WHEN EXISTS(
+               SELECT 1 FROM dating_messages reply
+               WHERE reply.reply_to_message_id = dm.id AND reply.sender_id = %s
+                 AND reply.created_at >= dm.created_at
+           ) THEN true ELSE false END as already_replied
+    FROM dating_messages dm
+    LEFT JOIN dating_posts dp ON dm.dating_post_id = dp.id AND dp.created_at <= dm.created_at
+    LEFT JOIN dating_messages orig ON dm.reply_to_message_id = orig.id AND orig.created_at <= dm.created_at
+    WHERE (dm.sender_id = %s OR dm.receiver_id = %s)
+      AND dm.created_at >= %s
+    ORDER BY dm.created_at DESC
+"""
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--user-id", type=int, default=1)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(settings.database_dsn, cursor_factory=RealDictCursor,
+                            connection_factory=PreparedConnection)
+    conn.autocommit = True
+    uid = args.user_id
+    inbox_params = (uid, uid, uid, uid, uid, "0001-01-01")
+    cases = [
+        ("feed join", FEED_JOIN, (uid, uid)),
+        ("feed column", FEED_COLUMN, (uid, uid)),
+        ("inbox join", INBOX_JOIN, inbox_params),
+        ("inbox column", INBOX_COLUMN, inbox_params),
+    ]
+    with conn.cursor() as cur:
+        for name, sql, params in cases:
+            measure(name, lambda: (cur.execute(sql, params), cur.fetchall()), args.calls)
+        # The inbox as the service actually runs it
+        measure("inbox prepared", lambda: (GET_MESSAGES.execute(cur, inbox_params), cur.fetchall()), args.calls)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Per-call cost of plain vs prepared execution of the hot fixed queries.
+
+Runs against the database in DATABASE_DSN (read-only queries, no data is written):
+
+    python -m benchmarks.bench_prepared --calls 2000 --user-id 1
+"""
+import argparse
+import time
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from config import settings
+from services.statements import PreparedConnection
+from services.user_service import GET_USER_BY_ID
+from services.post_service import LIKE_EXISTS, get_posts_statement
+from services.dating_service import GET_MESSAGES
+
+def measure(name: str, run, calls: int):
+    run()  # warm up: prepares the statement and primes caches
+    start = time.perf_counter()
+    for _ in range(calls):
+        run()
+    per_call_us = (time.perf_counter() - start) / calls * 1_000_000
+    print(f"{name:<32} {per_call_us:>10.1f} us/call")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--user-id", type=int, default=1)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(settings.database_dsn, cursor_factory=RealDictCursor,
+                            connection_factory=PreparedConnection)
+    conn.autocommit = True
+    uid = args.user_id
+    cases = [
+        ("get_user_by_id", GET_USER_BY_ID, (uid,)),
+        ("like_exists", LIKE_EXISTS, (1, uid)),
+        ("get_posts (no filters)", get_posts_statement(()), (uid, uid, uid, 50, 0)),
+        ("get_posts (gender)", get_posts_statement(("target_gender",)), (uid, uid, uid, "Female", 50, 0)),
+        ("get_messages", GET_MESSAGES, (uid, uid, uid, uid, uid, "0001-01-01")),
+    ]
+    with conn.cursor() as cur:
+        for name, statement, params in cases:
+            measure(f"{name} plain", lambda: (cur.execute(statement.sql, params), cur.fetchall()), args.calls)
+            measure(f"{name} prepared", lambda: (statement.execute(cur, params), cur.fetchall()), args.calls)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
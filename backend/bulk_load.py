@@ -0,0 +1,50 @@
+"""Bulk-load CSV or NDJSON files with COPY.
+
+    python bulk_load.py --users users.csv --comment-posts posts.ndjson \\
+        --comment-post-likes likes.csv --dating-posts dating.csv --dating-messages messages.ndjson
+
+Each file holds one record per row (CSV with a header, or one JSON object per line) with the
+table's column names; ids are optional but needed whenever other files reference the rows.
+Users may carry a plaintext `password`, which is bcrypt-hashed across --hash-workers processes.
+"""
+import argparse
+import logging
+from config import settings
+from services.user_service import UserService
+from services.post_service import PostService
+from services.dating_service import DatingService
+from services.bulk_loader import BulkLoader
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-load data with COPY")
+    parser.add_argument("--users")
+    parser.add_argument("--comment-posts")
+    parser.add_argument("--comment-post-likes")
+    parser.add_argument("--dating-posts")
+    parser.add_argument("--dating-messages")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Rows per COPY batch")
+    parser.add_argument("--hash-workers", type=int, help="Password hashing processes (default: CPU count)")
+    parser.add_argument("--keep-indexes", action="store_true", help="Load with secondary indexes in place")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    user_service = UserService(settings.database_dsn)
+    post_service = PostService(settings.database_dsn)
+    dating_service = DatingService(settings.database_dsn, message_shard_dsns=settings.message_shard_dsns)
+    user_service.init_db()
+    post_service.init_db()
+    dating_service.init_db()
+
+    sources = {
+        table: path for table, path in {
+            "users": args.users,
+            "comment_posts": args.comment_posts,
+            "comment_post_likes": args.comment_post_likes,
+            "dating_posts": args.dating_posts,
+            "dating_messages": args.dating_messages,
+        }.items() if path
+    }
+    if not sources:
+        parser.error("nothing to load")
+    loader = BulkLoader(settings.database_dsn, dating_service, args.chunk_size, args.hash_workers)
+    loader.load(sources, defer_indexes=not args.keep_indexes)
@@ -1,15 +1,103 @@
-from fastapi import HTTPException, Request
+import logging
+from datetime import date, timedelta
+from functools import lru_cache
+from fastapi import Depends, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
 from services.session_service import SessionService
+from services.signed_session_service import SignedSessionService
+from services.rate_limit_service import RateLimitService
+from services.trending_service import TrendingService
+from services.recommendation_service import RecommendationService
+from services.job_queue import JobQueue
+from services.unread_service import UnreadService
+from services.feed_materializer import FeedMaterializer
+from services.idempotency_service import IdempotencyService
+from services.invalidation import InvalidationListener
+from services.database import version_cache, current_unit_of_work, UnitOfWork
+from utils.profiling import LoopLagMonitor
 from services.user_service import UserService
 from services.post_service import PostService
 from services.dating_service import DatingService
 from config import settings
 
+logger = logging.getLogger(__name__)
+
 # Initialize services once
-session_service = SessionService(redis_url=settings.redis_url, expire_minutes=settings.session_expire_minutes)
-user_service = UserService(settings.database_dsn)
-post_service = PostService(settings.database_dsn)
-dating_service = DatingService(settings.database_dsn)
+if settings.session_mode == "signed":
+    session_service = SignedSessionService(
+        secret=settings.session_secret,
+        redis_url=settings.redis_url,
+        ttl_seconds=settings.signed_session_ttl_seconds,
+        read_your_writes_seconds=settings.read_your_writes_seconds
+    )
+else:
+    session_service = SessionService(
+        redis_url=settings.redis_url,
+        expire_minutes=settings.session_expire_minutes,
+        read_your_writes_seconds=settings.read_your_writes_seconds
+    )
+job_queue = JobQueue(
+    redis_url=settings.redis_url,
+    stream=settings.job_stream,
+    max_attempts=settings.job_max_attempts,
+    retry_delay_seconds=settings.job_retry_delay_seconds,
+    maxlen=settings.job_stream_maxlen
+)
+user_service = UserService(settings.database_dsn, settings.database_replica_dsns, job_queue)
+post_service = PostService(settings.database_dsn, settings.database_replica_dsns, job_queue)
+dating_service = DatingService(
+    settings.database_dsn, settings.database_replica_dsns, job_queue, settings.message_shard_dsns
+)
+rate_limit_service = RateLimitService(redis_url=settings.redis_url)
+trending_service = TrendingService(
+    redis_url=settings.redis_url,
+    half_life_hours=settings.trending_half_life_hours,
+    max_posts=settings.trending_max_posts
+)
+recommendation_service = RecommendationService(
+    top_k=settings.recommendation_top_k,
+    cache_size=settings.recommendation_cache_size
+)
+unread_service = UnreadService(redis_url=settings.redis_url, ttl_seconds=settings.unread_counter_ttl_seconds)
+feed_materializer = FeedMaterializer(redis_url=settings.redis_url, page_size=settings.feed_page_size)
+idempotency_service = IdempotencyService(
+    redis_url=settings.redis_url,
+    ttl_seconds=settings.idempotency_ttl_seconds,
+    lock_seconds=settings.idempotency_lock_seconds
+)
+invalidation_listener = InvalidationListener(settings.database_dsn)
+invalidation_listener.attach(version_cache)
+loop_monitor = LoopLagMonitor(
+    interval=settings.loop_lag_interval_ms / 1000,
+    threshold=settings.loop_lag_threshold_ms / 1000
+)
+
+def dating_feed_since() -> date | None:
+    # Only show dating posts newer than the feed window; the bound also prunes partitions
+    if not settings.dating_feed_window_days:
+        return None
+    return date.today() - timedelta(days=settings.dating_feed_window_days)
+
+def gender_feed_variants(**common) -> list[dict]:
+    return [common] + [dict(common, target_gender=gender) for gender in settings.feed_materialized_genders]
+
+def dating_feed_variants() -> list[dict]:
+    since = dating_feed_since()
+    return gender_feed_variants(**({"since": since.isoformat()} if since else {}))
+
+feed_materializer.register("comment_posts", post_service.get_feed_page, gender_feed_variants)
+feed_materializer.register("dating_posts", dating_service.get_feed_page, dating_feed_variants)
+
+def set_session_cookie(response: Response, session_id: str):
+    response.set_cookie(
+        key="session_id",
+        value=session_id,
+        httponly=True,
+        secure=False,  # Change to True in production
+        samesite="lax",
+        max_age=session_service.cookie_max_age
+    )
 
 async def get_current_user(request: Request):
     session_id = request.cookies.get("session_id")
@@ -20,9 +108,126 @@ async def get_current_user(request: Request):
         user_id = await session_service.get_user_id(session_id)
         if not user_id:
             raise HTTPException(status_code=401, detail="Session expired or invalid")
-        return user_id
     except Exception:
         raise HTTPException(status_code=401, detail="Authentication failed")
+    # Sliding expiry for signed sessions: hand out a fresh token once the current one is half used.
+    # SessionRefreshMiddleware sets the cookie, so it also reaches 304s and streamed responses
+    refreshed = session_service.refresh(session_id)
+    if refreshed:
+        request.state.refreshed_session_id = refreshed
+    return user_id
+
+async def is_admin_session(session_id: str | None) -> bool:
+    if not session_id or not settings.admin_user_ids:
+        return False
+    return await session_service.get_user_id(session_id) in settings.admin_user_ids
+
+async def use_primary_for_reads(request: Request) -> bool:
+    """Send reads to the primary while the session is inside its read-your-writes window"""
+    if not settings.database_replica_dsns:
+        return False
+    session_id = request.cookies.get("session_id")
+    if not session_id:
+        return False
+    try:
+        return await session_service.has_recent_write(session_id)
+    except Exception:
+        return True
+
+async def record_write(request: Request):
+    """Start the read-your-writes window after a successful write"""
+    session_id = request.cookies.get("session_id")
+    if not settings.database_replica_dsns or not session_id:
+        return
+    try:
+        await session_service.mark_write(session_id)
+    except Exception:
+        pass
+
+def unit_of_work(transaction: bool = False):
+    """Dependency that lends every service call in the request one connection per database.
+
+    With transaction=True the calls also share one transaction, committed after the route
+    returns and rolled back if it raises. Must stay async: the context variable it sets has to
+    be visible to the route, which a threadpool dependency's would not be.
+    """
+    async def scope():
+        work = UnitOfWork(transaction)
+        token = current_unit_of_work.set(work)
+        committed = False
+        try:
+            yield work
+            committed = True
+        finally:
+            current_unit_of_work.reset(token)
+            work.close(commit=committed)
+    return scope
+
+def release_connections():
+    """Commit the request's unit of work (if transactional) and hand its connections back.
+
+    Call it before awaiting Redis or anything else that is not the database; later service
+    calls in the request check out again.
+    """
+    work = current_unit_of_work.get()
+    if work is not None:
+        work.release()
+
+def get_client_ip(request: Request) -> str:
+    # nginx sets X-Real-IP when proxying /api to the backend
+    return request.headers.get("x-real-ip") or (request.client.host if request.client else "unknown")
+
+async def enforce_rate_limit(route: str, identity: str, cost: int = 1):
+    if route not in settings.rate_limits:
+        return
+    capacity, period = settings.rate_limits[route]
+    if cost > capacity:
+        # The bucket never holds that many tokens, so retrying cannot help
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {capacity} {route} actions are allowed per {period} seconds"
+        )
+    try:
+        allowed, retry_after = await rate_limit_service.acquire(route, identity, capacity, period, cost)
+    except Exception as e:
+        # Fail open: a Redis outage should not take the write paths down with it
+        logger.warning(f"Rate limiter unavailable: {e}")
+        return
+    if not allowed:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(max(retry_after, 1))}
+        )
+
+def one_token() -> int:
+    return 1
+
+def rate_limit_by_user(route: str, cost=one_token):
+    """cost is a dependency returning how many tokens the request takes, e.g. one per item of a batch"""
+    async def check(user_id: int = Depends(get_current_user), tokens: int = Depends(cost)):
+        await enforce_rate_limit(route, f"user:{user_id}", tokens)
+    return check
+
+def rate_limit_by_ip(route: str):
+    async def check(request: Request):
+        await enforce_rate_limit(route, f"ip:{get_client_ip(request)}")
+    return check
+
+@lru_cache
+def validated_body(model: type[BaseModel]):
+    """Dependency that parses the JSON body straight into model.
+
+    Declare it as a parameter ahead of the auth and rate-limit parameters (route-level
+    dependencies run before all of them), so malformed bodies are rejected before any
+    Redis or database work.
+    """
+    async def parse(request: Request):
+        try:
+            return model.model_validate_json(await request.body())
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+    return parse
 
 # Service dependencies
 def get_user_service():
@@ -35,4 +240,16 @@ def get_dating_service():
     return dating_service
 
 def get_session_service():
-    return session_service
\ No newline at end of file
+    return session_service
+
+def get_trending_service():
+    return trending_service
+
+def get_recommendation_service():
+    return recommendation_service
+
+def get_unread_service():
+    return unread_service
+
+def get_feed_materializer():
+    return feed_materializer
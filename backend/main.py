@@ -1,13 +1,23 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends, Request, Response, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from services.user_service import UserService
-from services.session_service import SessionService
 from services.post_service import PostService
 from services.dating_service import DatingService
-from api import auth, users, posts, dating, messages
-from dependencies import get_current_user
+from api import auth, users, posts, dating, messages, metrics
+from dependencies import (
+    get_current_user, session_service, trending_service, recommendation_service, invalidation_listener,
+    loop_monitor, is_admin_session, feed_materializer, idempotency_service, set_session_cookie
+)
 from middleware.exception_handler import global_exception_handler, http_exception_handler, validation_exception_handler
+from middleware.admission import ConcurrencyLimitMiddleware
+from middleware.compression import CompressionMiddleware
+from middleware.deadline import DeadlineMiddleware
+from middleware.profiling import ProfilingMiddleware
+from middleware.idempotency import IdempotencyMiddleware
+from middleware.session_refresh import SessionRefreshMiddleware
 import uvicorn
 
 from config import settings
@@ -21,7 +31,30 @@ origins = [
     "https://127.0.0.1:5173"
     ]
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fill the feed pages before taking traffic, so a deploy or Redis flush is not a thundering herd
+    await feed_materializer.warm()
+    background_tasks = [
+        asyncio.create_task(loop_monitor.run()),
+        asyncio.create_task(trending_service.run_decay_loop(settings.trending_decay_interval_seconds)),
+        asyncio.create_task(recommendation_service.run_refresh_loop(
+            dating_service,
+            settings.recommendation_window_days,
+            settings.recommendation_refresh_seconds
+        )),
+    ]
+    if settings.local_cache_ttl_seconds > 0:
+        background_tasks.append(asyncio.create_task(invalidation_listener.run()))
+    if settings.session_mode == "signed":
+        background_tasks.append(asyncio.create_task(
+            session_service.run_revocation_sync_loop(settings.revocation_sync_seconds)
+        ))
+    yield
+    for task in background_tasks:
+        task.cancel()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add exception handlers
 app.add_exception_handler(Exception, global_exception_handler)
@@ -34,10 +67,52 @@ app.include_router(users.router)
 app.include_router(posts.router)
 app.include_router(dating.router)
 app.include_router(messages.router)
+app.include_router(metrics.router)
 user_service = UserService(DATABASE_DSN)
 post_service = PostService(DATABASE_DSN)
-dating_service = DatingService(DATABASE_DSN)
-session_service = SessionService(redis_url=settings.redis_url, expire_minutes=settings.session_expire_minutes)
+dating_service = DatingService(DATABASE_DSN, message_shard_dsns=settings.message_shard_dsns)
+
+# Innermost, so stored responses are uncompressed and replays are encoded for each retry's Accept-Encoding
+app.add_middleware(
+    IdempotencyMiddleware,
+    idempotency_service=idempotency_service,
+    identify=session_service.get_user_id,
+    paths=[r"/comment_posts", r"/dating", r"/dating/\d+/message", r"/messages/\d+/reply"]
+)
+
+app.add_middleware(SessionRefreshMiddleware, set_cookie=set_session_cookie)
+
+app.add_middleware(
+    CompressionMiddleware,
+    paths=["/comment_posts", "/dating", "/messages", "/users/profile"],
+    minimum_size=settings.compression_min_size,
+    gzip_level=settings.gzip_level,
+    brotli_quality=settings.brotli_quality
+)
+
+# Inside admission control, so a profile covers the handler and compression but not queueing for a slot
+app.add_middleware(
+    ProfilingMiddleware,
+    is_admin=is_admin_session,
+    output_dir=settings.profile_dir,
+    sample_interval=settings.profile_sample_interval_ms / 1000
+)
+
+# Added before CORS so shed requests still carry CORS headers. This is also where requests wait for
+# database connections: a request holds at most two of a pool at once (a streamed export counts
+# messages beside its cursor), so admitted requests never find a pool exhausted
+app.add_middleware(
+    ConcurrencyLimitMiddleware,
+    max_concurrent=min(settings.max_concurrent_requests, settings.db_pool_size // 2),
+    queue_timeout=settings.admission_queue_timeout_ms / 1000
+)
+
+# Outside admission control so time spent queueing for a slot comes out of the request's budget
+app.add_middleware(
+    DeadlineMiddleware,
+    timeout_seconds=settings.request_timeout_ms / 1000,
+    exempt_paths=["/users/export"]
+)
 
 app.add_middleware(
     CORSMiddleware,
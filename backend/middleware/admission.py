@@ -0,0 +1,36 @@
+import asyncio
+from fastapi.responses import JSONResponse
+from utils.responses import error_response
+
+class ConcurrencyLimitMiddleware:
+    """Sheds load with 503 once a worker is already serving max_concurrent requests.
+
+    Requests wait at most queue_timeout seconds for a slot, so an overloaded worker
+    answers quickly instead of queueing work behind the connection pools.
+    """
+
+    def __init__(self, app, max_concurrent: int, queue_timeout: float):
+        self.app = app
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.queue_timeout = queue_timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            response = JSONResponse(
+                status_code=503,
+                content=error_response("Server is busy, please retry"),
+                headers={"Retry-After": "1"}
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.semaphore.release()
@@ -0,0 +1,24 @@
+from utils.deadline import request_deadline, set_deadline
+
+class DeadlineMiddleware:
+    """Gives every request a time budget that backend calls turn into their own timeouts.
+
+    Postgres statements get the remaining budget as statement_timeout and Redis commands
+    as their operation timeout. Paths in exempt_paths (long-lived streams) get no deadline.
+    """
+
+    def __init__(self, app, timeout_seconds: float, exempt_paths: list[str] | None = None):
+        self.app = app
+        self.timeout_seconds = timeout_seconds
+        self.exempt_paths = exempt_paths or []
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        token = set_deadline(self.timeout_seconds)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_deadline.reset(token)
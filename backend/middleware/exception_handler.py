@@ -17,7 +17,8 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     """Handler for HTTP exceptions"""
     return JSONResponse(
         status_code=exc.status_code,
-        content=error_response(exc.detail)
+        content=error_response(exc.detail),
+        headers=getattr(exc, "headers", None)
     )
 
 async def validation_exception_handler(request: Request, exc: Exception):
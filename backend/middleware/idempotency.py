@@ -0,0 +1,140 @@
+import base64
+import hashlib
+import logging
+import re
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.requests import HTTPConnection
+from utils.responses import error_response
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+MAX_KEY_LENGTH = 255
+# Rate limiting and auth failures say nothing about the request itself, so a retry runs again
+UNSTORED_STATUSES = {401, 429}
+
+class IdempotencyMiddleware:
+    """Replays the first response to a POST that carries an Idempotency-Key header.
+
+    Keys are scoped to the session's user, and the first response to each is kept by
+    IdempotencyService. A retry of the same request gets that response back with
+    "Idempotent-Replayed: true" without reaching the handler; a concurrent duplicate waits
+    for the first to finish; reusing a key for a different body is a 422. 5xx responses are
+    not stored so the client's next retry runs again. Requests without the header, without a
+    session or outside paths are passed through, as is everything when Redis is unavailable.
+    """
+
+    def __init__(self, app, idempotency_service, identify, paths: list[str]):
+        self.app = app
+        self.idempotency_service = idempotency_service
+        self.identify = identify
+        self.paths = [re.compile(path) for path in paths]
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] != "POST"
+                or not any(path.fullmatch(scope["path"]) for path in self.paths)):
+            await self.app(scope, receive, send)
+            return
+        idempotency_key = Headers(scope=scope).get(IDEMPOTENCY_HEADER)
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            await self.send_error(scope, receive, send, 400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+            return
+        session_id = HTTPConnection(scope).cookies.get("session_id")
+        try:
+            user_id = await self.identify(session_id) if session_id else None
+        except Exception:
+            user_id = None
+        if not user_id:
+            # The handler rejects it as unauthenticated
+            await self.app(scope, receive, send)
+            return
+
+        body = await self.read_body(receive)
+        fingerprint = hashlib.sha256(scope["path"].encode() + b"\n" + body).hexdigest()
+        key = f"idempotency:{user_id}:{hashlib.sha256(idempotency_key.encode()).hexdigest()}"
+        replay_receive = self.replay_body(body, receive)
+        try:
+            stored, token = await self.idempotency_service.begin(key)
+        except Exception as e:
+            logger.warning(f"Idempotency store unavailable, running {scope['path']} unguarded: {e}")
+            await self.app(scope, replay_receive, send)
+            return
+
+        if stored is not None:
+            if stored["fingerprint"] != fingerprint:
+                await self.send_error(scope, receive, send, 422, "Idempotency-Key was already used for a different request")
+                return
+            await self.replay(send, stored)
+            return
+        if token is None:
+            await self.send_error(scope, receive, send, 409, "A request with this Idempotency-Key is still in progress",
+                                  {"Retry-After": "1"})
+            return
+
+        response = {}
+        chunks = []
+
+        async def send_and_capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        record = None
+        try:
+            await self.app(scope, replay_receive, send_and_capture)
+            status = response.get("status", 500)
+            if status < 500 and status not in UNSTORED_STATUSES:
+                record = {
+                    "fingerprint": fingerprint,
+                    "status": status,
+                    # Cookies were meant for the first response only
+                    "headers": [
+                        [name.decode("latin-1"), value.decode("latin-1")]
+                        for name, value in response["headers"] if name.lower() != b"set-cookie"
+                    ],
+                    "body": base64.b64encode(b"".join(chunks)).decode(),
+                }
+        finally:
+            try:
+                await self.idempotency_service.complete(key, token, record)
+            except Exception as e:
+                logger.warning(f"Failed to store idempotent response for {scope['path']}: {e}")
+
+    async def read_body(self, receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        return b"".join(chunks)
+
+    def replay_body(self, body: bytes, receive):
+        sent = False
+
+        async def replay_receive():
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return replay_receive
+
+    async def replay(self, send, stored: dict):
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in stored["headers"]]
+        headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": stored["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": base64.b64decode(stored["body"])})
+
+    async def send_error(self, scope, receive, send, status: int, message: str, headers: dict | None = None):
+        response = JSONResponse(status_code=status, content=error_response(message), headers=headers)
+        await response(scope, receive, send)
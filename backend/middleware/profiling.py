@@ -0,0 +1,96 @@
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import uuid
+from collections import Counter
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import HTTPConnection
+from utils.profiling import StackSampler
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-profile"
+PROFILE_MODES = ("cprofile", "sample")
+
+class ProfilingMiddleware:
+    """Profiles a single request when an admin sends "X-Profile: cprofile" or "X-Profile: sample".
+
+    The profile is written to output_dir (pstats .prof for cprofile, collapsed stacks .txt
+    for sample, ready for flamegraph.pl or speedscope), its file name is returned in
+    X-Profile-File and the top entries are logged. Both profilers watch the event loop
+    thread, so they also pick up whatever other requests the loop runs meanwhile; only one
+    request per worker is profiled at a time and the header is ignored for everyone else.
+    """
+
+    def __init__(self, app, is_admin, output_dir: str, sample_interval: float = 0.005):
+        self.app = app
+        self.is_admin = is_admin
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.busy = asyncio.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        mode = Headers(scope=scope).get(PROFILE_HEADER, "").lower()
+        if mode not in PROFILE_MODES or self.busy.locked():
+            await self.app(scope, receive, send)
+            return
+        try:
+            allowed = await self.is_admin(HTTPConnection(scope).cookies.get("session_id"))
+        except Exception:
+            allowed = False
+        if not allowed:
+            await self.app(scope, receive, send)
+            return
+
+        async with self.busy:
+            await self.profile(mode, scope, receive, send)
+
+    async def profile(self, mode, scope, receive, send):
+        name = f"{uuid.uuid4().hex}.{'prof' if mode == 'cprofile' else 'txt'}"
+
+        async def send_with_header(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("X-Profile-File", name)
+            await send(message)
+
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_with_header)
+            finally:
+                profiler.disable()
+            await asyncio.to_thread(self.write_cprofile, profiler, name, scope["path"])
+        else:
+            sampler = StackSampler(threading.get_ident(), self.sample_interval)
+            sampler.start()
+            try:
+                await self.app(scope, receive, send_with_header)
+            finally:
+                samples = sampler.stop()
+            await asyncio.to_thread(self.write_samples, samples, name, scope["path"])
+
+    def write_cprofile(self, profiler: cProfile.Profile, name: str, path: str):
+        os.makedirs(self.output_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(self.output_dir, name))
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(15)
+        logger.info(f"cProfile of {path} saved as {name}:\n{summary.getvalue()}")
+
+    def write_samples(self, samples, name: str, path: str):
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, name), "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        leaves = Counter()
+        for stack, count in samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        top = "\n".join(f"{count:6d} {leaf}" for leaf, count in leaves.most_common(15))
+        logger.info(f"{sum(samples.values())} stack samples of {path} saved as {name}, hottest leaves:\n{top}")
@@ -0,0 +1,33 @@
+from starlette.datastructures import MutableHeaders
+from starlette.responses import Response
+
+# Set on request.state by get_current_user when a signed session token was renewed
+REFRESHED_SESSION_KEY = "refreshed_session_id"
+
+class SessionRefreshMiddleware:
+    """Sends the session cookie renewed by get_current_user on whatever response the route returns.
+
+    Setting it on the injected Response only reaches routes that return a plain value; this
+    also covers responses routes build themselves, like 304s and the /users/export stream,
+    so clients that mostly poll with conditional GETs keep their session alive.
+    """
+
+    def __init__(self, app, set_cookie):
+        self.app = app
+        self.set_cookie = set_cookie
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        state = scope.setdefault("state", {})
+
+        async def send_with_cookie(message):
+            refreshed = state.get(REFRESHED_SESSION_KEY)
+            if message["type"] == "http.response.start" and refreshed:
+                cookie = Response()
+                self.set_cookie(cookie, refreshed)
+                MutableHeaders(scope=message).append("set-cookie", cookie.headers["set-cookie"])
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
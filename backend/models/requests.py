@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field, model_validator
+from typing import List, Optional
 
 class UserRegister(BaseModel):
     username: str
@@ -10,23 +10,36 @@ class UserLogin(BaseModel):
     username: str
     password: str
 
+class UsernameUpdate(BaseModel):
+    username: str = Field(min_length=1, max_length=50)
+
+# Length limits mirror the column sizes in the services' init_db
 class CommentPostCreate(BaseModel):
-    target_gender: str
-    target_job: str
-    target_birth_year: int
-    target_height: int
-    target_app: str
-    comment: str
+    target_gender: str = Field(min_length=1, max_length=10)
+    target_job: str = Field(min_length=1, max_length=100)
+    target_birth_year: int = Field(ge=1900, le=2100)
+    target_height: int = Field(ge=100, le=250)
+    target_app: str = Field(min_length=1, max_length=50)
+    comment: str = Field(min_length=1, max_length=2000)
 
 class DatingPostCreate(BaseModel):
-    title: str
-    description: str
-    target_gender: str
-    target_age_min: int
-    target_age_max: int
+    title: str = Field(min_length=1, max_length=200)
+    description: str = Field(min_length=1, max_length=2000)
+    target_gender: str = Field(min_length=1, max_length=10)
+    target_age_min: int = Field(ge=18, le=100)
+    target_age_max: int = Field(ge=18, le=100)
+
+    @model_validator(mode="after")
+    def check_age_range(self):
+        if self.target_age_min > self.target_age_max:
+            raise ValueError("target_age_min must not exceed target_age_max")
+        return self
 
 class MessageSend(BaseModel):
-    content: str
+    content: str = Field(min_length=1, max_length=2000)
 
 class MessageReply(BaseModel):
-    reply_content: str
\ No newline at end of file
+    reply_content: str = Field(min_length=1, max_length=2000)
+
+class PostIdsBatch(BaseModel):
+    post_ids: List[int] = Field(min_length=1, max_length=100)
\ No newline at end of file
@@ -0,0 +1,29 @@
+"""Move dating messages onto the shard their conversation belongs to.
+
+    MESSAGE_SHARD_DSNS=postgresql://.../messages_0,postgresql://.../messages_1 \\
+        python rebalance_messages.py --source "$DATABASE_DSN"
+
+Run it after appending a DSN to MESSAGE_SHARD_DSNS, after enabling sharding (with the main
+database as --source), or with a retired shard as --source once it has been removed from
+the list. Safe to interrupt and re-run.
+"""
+import argparse
+import logging
+from config import settings
+from services.dating_service import DatingService
+from services.message_rebalancer import MessageRebalancer
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebalance dating_messages across MESSAGE_SHARD_DSNS")
+    parser.add_argument("--source", action="append", default=[],
+                        help="Extra database to drain messages from (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows moved per round trip")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the messages that would move")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    dating_service = DatingService(settings.database_dsn, message_shard_dsns=settings.message_shard_dsns)
+    dating_service.init_db()
+    rebalancer = MessageRebalancer(dating_service, args.source, args.batch_size)
+    moved = rebalancer.run(dry_run=args.dry_run)
+    logging.info(f"{'Would move' if args.dry_run else 'Moved'} {moved} messages in total")
@@ -0,0 +1,318 @@
+import csv
+import io
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from services.database import DatabaseService
+from services.dating_service import DatingService, PARTITIONED_TABLES, month_start
+from services.invalidation import CHANNELS, EVERYTHING
+from services.post_service import rebuild_stats
+from services.user_service import pwd_context
+
+logger = logging.getLogger(__name__)
+
+# Loadable columns per table, in foreign-key order. users.hearts and the usernames copied
+# onto dating rows are not loadable: they are recomputed once everything is in.
+TABLE_COLUMNS = {
+    "users": ["id", "username", "email", "password_hash"],
+    "comment_posts": [
+        "id", "user_id", "target_gender", "target_job", "target_birth_year",
+        "target_height", "target_app", "comment", "created_at"
+    ],
+    "comment_post_likes": ["post_id", "user_id", "created_at"],
+    "dating_posts": [
+        "id", "user_id", "title", "description", "target_gender",
+        "target_age_min", "target_age_max", "created_at"
+    ],
+    "dating_messages": [
+        "id", "sender_id", "receiver_id", "dating_post_id", "content",
+        "reply_to_message_id", "created_at", "updated_at", "read_at"
+    ],
+}
+
+ID_SEQUENCES = {
+    "users": "users_id_seq",
+    "comment_posts": "comment_posts_id_seq",
+    "dating_posts": "dating_posts_id_seq",
+    "dating_messages": "dating_messages_id_seq",
+}
+
+def hash_password(password: str) -> str:
+    # Module-level so ProcessPoolExecutor can pickle it
+    return pwd_context.hash(password)
+
+def read_records(path: str):
+    """Yield dicts from a CSV file with a header row, or from NDJSON (.ndjson/.jsonl)"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".ndjson", ".jsonl")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for row in csv.DictReader(f):
+                # CSV has no NULL; treat empty fields as missing values
+                yield {key: (value if value != "" else None) for key, value in row.items()}
+
+def chunked(records, size: int):
+    records = iter(records)
+    while chunk := list(islice(records, size)):
+        yield chunk
+
+class BulkLoader(DatabaseService):
+    """Load exported or fixture data with COPY instead of per-row INSERT ... RETURNING.
+
+    Each table is loaded in one transaction, streamed in chunks so memory stays bounded.
+    Non-unique secondary indexes are dropped first and rebuilt once at the end, and the
+    derived state (heart_history, users.hearts, dating usernames, comment post stats, id
+    sequences, content versions) is recomputed afterwards.
+    """
+
+    def __init__(self, dsn: str, dating_service: DatingService, chunk_size: int = 5000,
+                 hash_workers: int | None = None):
+        super().__init__(dsn)
+        # Creates monthly partitions for historical rows inside the loader's transaction
+        self.dating_service = dating_service
+        self.chunk_size = chunk_size
+        self.hash_workers = hash_workers
+
+    def load(self, sources: dict[str, str], defer_indexes: bool = True):
+        """sources maps table name to an input path; tables are loaded in foreign-key order"""
+        unknown = set(sources) - set(TABLE_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown tables: {', '.join(sorted(unknown))}")
+        tables = [table for table in TABLE_COLUMNS if table in sources]
+        deferred = self.drop_secondary_indexes(tables) if defer_indexes else []
+        try:
+            with ProcessPoolExecutor(self.hash_workers) as executor:
+                for table in tables:
+                    start = time.perf_counter()
+                    count = self.copy_table(table, read_records(sources[table]), executor)
+                    logger.info(f"Loaded {count} rows into {table} in {time.perf_counter() - start:.1f}s")
+        finally:
+            self.rebuild_indexes(deferred)
+        self.recompute_derived(tables)
+
+    def copy_table(self, table: str, records, executor) -> int:
+        if table == "dating_messages" and self.dating_service.messages.shards != [self.dating_service]:
+            return self.copy_sharded_messages(records)
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                count = 0
+                columns = None
+                for chunk in chunked(records, self.chunk_size):
+                    if table == "users":
+                        self.hash_chunk(chunk, executor)
+                    if columns is None:
+                        columns = [column for column in TABLE_COLUMNS[table] if column in chunk[0]]
+                    self.copy_chunk(cur, table, columns, chunk)
+                    count += len(chunk)
+                conn.commit()
+                return count
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            self.put_connection(conn)
+
+    def copy_sharded_messages(self, records) -> int:
+        """COPY each message onto the shard that owns its conversation, as send_message would.
+
+        Missing ids are allocated from this database's sequence and usernames are copied in
+        here, since shards have no users table. Every shard loads in one transaction, and
+        they commit together at the end. Shard indexes are left in place.
+        """
+        shards = self.dating_service.messages
+        conn = self.get_connection()
+        shard_conns = {}
+        try:
+            with conn.cursor() as cur:
+                count = 0
+                columns = None
+                for chunk in chunked(records, self.chunk_size):
+                    if columns is None:
+                        columns = [
+                            column for column in TABLE_COLUMNS["dating_messages"] if column in chunk[0] or column == "id"
+                        ] + ["sender_username", "receiver_username"]
+                    unnumbered = [row for row in chunk if row.get("id") is None]
+                    if unnumbered:
+                        cur.execute(
+                            "SELECT nextval('dating_messages_id_seq') AS id FROM generate_series(1, %s)",
+                            (len(unnumbered),)
+                        )
+                        for row, allocated in zip(unnumbered, cur.fetchall()):
+                            row["id"] = allocated['id']
+                    user_ids = {int(row[key]) for row in chunk for key in ("sender_id", "receiver_id")}
+                    cur.execute("SELECT id, username FROM users WHERE id = ANY(%s)", (list(user_ids),))
+                    usernames = {user['id']: user['username'] for user in cur.fetchall()}
+                    routed = {}
+                    for row in chunk:
+                        row["sender_username"] = usernames.get(int(row["sender_id"]))
+                        row["receiver_username"] = usernames.get(int(row["receiver_id"]))
+                        dating_post_id = row.get("dating_post_id")
+                        shard = shards.for_conversation(
+                            int(dating_post_id) if dating_post_id is not None else None,
+                            int(row["sender_id"]), int(row["receiver_id"])
+                        )
+                        routed.setdefault(shard, []).append(row)
+                    for shard, rows in routed.items():
+                        if shard not in shard_conns:
+                            shard_conns[shard] = shard.get_connection()
+                        with shard_conns[shard].cursor() as shard_cur:
+                            self.copy_chunk(shard_cur, "dating_messages", columns, rows)
+                    count += len(chunk)
+                for shard_conn in shard_conns.values():
+                    with shard_conn.cursor() as shard_cur:
+                        shard_cur.execute("ANALYZE dating_messages")
+                    shard_conn.commit()
+                conn.commit()
+                return count
+        except Exception as e:
+            for shard_conn in shard_conns.values():
+                shard_conn.rollback()
+            conn.rollback()
+            raise e
+        finally:
+            for shard, shard_conn in shard_conns.items():
+                shard.put_connection(shard_conn)
+            self.put_connection(conn)
+
+    def copy_chunk(self, cur, table: str, columns: list[str], chunk: list[dict]):
+        if table in PARTITIONED_TABLES:
+            months = {
+                month_start(datetime.fromisoformat(str(row["created_at"])).date())
+                for row in chunk if row.get("created_at")
+            }
+            self.dating_service.create_month_partitions(cur, table, months)
+        buffer = io.StringIO()
+        # QUOTE_NOTNULL: None is written unquoted (NULL to COPY), "" stays an empty string
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NOTNULL)
+        writer.writerows([row.get(column) for column in columns] for row in chunk)
+        buffer.seek(0)
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    def hash_chunk(self, chunk: list[dict], executor):
+        """Replace plaintext password fields with bcrypt hashes, hashing across worker processes"""
+        pending = [row for row in chunk if row.get("password") and not row.get("password_hash")]
+        if pending:
+            chunksize = max(1, len(pending) // ((self.hash_workers or 4) * 4))
+            hashes = executor.map(hash_password, [row["password"] for row in pending], chunksize=chunksize)
+            for row, hashed in zip(pending, hashes):
+                row["password_hash"] = hashed
+        for row in chunk:
+            row.pop("password", None)
+
+    def drop_secondary_indexes(self, tables: list[str]) -> list[tuple[str, str]]:
+        """Drop non-unique indexes on tables; returns (name, definition) pairs to rebuild"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT i.indexrelid::regclass::text AS name, pg_get_indexdef(i.indexrelid) AS definition
+                    FROM pg_index i
+                    WHERE i.indrelid = ANY(%s::regclass[]) AND NOT i.indisunique
+                    """,
+                    (tables,)
+                )
+                indexes = [(row['name'], row['definition']) for row in cur.fetchall()]
+                for name, _ in indexes:
+                    # On a partitioned table this also drops the per-partition indexes
+                    cur.execute(f"DROP INDEX IF EXISTS {name}")
+                conn.commit()
+                return indexes
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            self.put_connection(conn)
+
+    def rebuild_indexes(self, indexes: list[tuple[str, str]]):
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                for name, definition in indexes:
+                    start = time.perf_counter()
+                    # Partitioned parents report ON ONLY, which would skip the partitions
+                    cur.execute(definition.replace(" ON ONLY ", " ON ", 1))
+                    logger.info(f"Rebuilt index {name} in {time.perf_counter() - start:.1f}s")
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            self.put_connection(conn)
+
+    def max_shard_message_id(self) -> int:
+        """Highest message id on the shards; message ids come from this database's sequence"""
+        highest = 0
+        for shard in self.dating_service.messages.shards:
+            conn = shard.get_connection()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT COALESCE(MAX(id), 0) AS id FROM dating_messages")
+                    highest = max(highest, cur.fetchone()['id'])
+            finally:
+                shard.put_connection(conn)
+        return highest
+
+    def recompute_derived(self, tables: list[str]):
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                if "comment_post_likes" in tables:
+                    # A like awards a heart the first time; loaded likes count as first likes
+                    cur.execute(
+                        """
+                        INSERT INTO heart_history (post_id, user_id, created_at)
+                        SELECT post_id, user_id, created_at FROM comment_post_likes
+                        ON CONFLICT DO NOTHING
+                        """
+                    )
+                cur.execute(
+                    """
+                    UPDATE users u SET hearts = COALESCE(h.hearts, 0)
+                    FROM users x
+                    LEFT JOIN (
+                        SELECT p.user_id, COUNT(*) AS hearts
+                        FROM heart_history hh JOIN comment_posts p ON p.id = hh.post_id
+                        GROUP BY p.user_id
+                    ) h ON h.user_id = x.id
+                    WHERE x.id = u.id AND u.hearts IS DISTINCT FROM COALESCE(h.hearts, 0)
+                    """
+                )
+                if {"users", "dating_posts", "dating_messages"} & set(tables):
+                    self.dating_service.backfill_usernames(cur)
+                if {"comment_posts", "comment_post_likes"} & set(tables):
+                    rebuild_stats(cur)
+                for table in tables:
+                    if table in ID_SEQUENCES:
+                        cur.execute(
+                            f"SELECT setval(%s, GREATEST(COALESCE((SELECT MAX(id) FROM {table}), 0), %s) + 1, false)",
+                            (ID_SEQUENCES[table], self.max_shard_message_id() if table == "dating_messages" else 0)
+                        )
+                # Invalidate every cached feed, inbox and profile ETag
+                cur.execute(
+                    """
+                    INSERT INTO content_versions (key, version)
+                    SELECT key, 1 FROM (
+                        SELECT unnest(ARRAY['comment_posts', 'dating_posts']) AS key
+                        UNION ALL SELECT 'profile:' || id FROM users
+                        UNION ALL SELECT 'messages:' || id FROM users
+                    ) keys
+                    ON CONFLICT (key) DO UPDATE SET version = content_versions.version + 1
+                    """
+                )
+                for channel in CHANNELS:
+                    cur.execute("SELECT pg_notify(%s, %s)", (channel, EVERYTHING))
+                for table in tables + ["heart_history"]:
+                    cur.execute(f"ANALYZE {table}")
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            self.put_connection(conn)
@@ -0,0 +1,333 @@
+import itertools
+import logging
+import math
+import threading
+import uuid
+from contextvars import ContextVar
+import psycopg2
+import psycopg2.errors
+from psycopg2 import pool
+from psycopg2.extras import RealDictCursor
+from services.statements import PreparedConnection, PreparedStatement
+from services.invalidation import LocalCache, encode_keys
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from utils.deadline import remaining_seconds
+from config import settings
+
+# Monotonic version stamps bumped by write paths; conditional GETs compare these instead of
+# re-running feed queries. Keys: comment_posts, dating_posts, messages:<user_id>, profile:<user_id>
+CONTENT_VERSIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS content_versions (
+        key VARCHAR(100) PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    )
+"""
+
+# The pg_notify subquery announces the keys in the same round trip; it is delivered at commit
+BUMP_VERSIONS = PreparedStatement("bump_versions", ["varchar[]", "text", "text"], """
+    INSERT INTO content_versions (key, version)
+    SELECT DISTINCT unnest(%s::varchar[]), 1
+    FROM (SELECT pg_notify(%s, %s)) notified
+    ON CONFLICT (key) DO UPDATE SET version = content_versions.version + 1
+""")
+
+logger = logging.getLogger(__name__)
+
+# Version stamps of this process, kept until a notification says they changed
+version_cache = LocalCache(settings.local_cache_ttl_seconds)
+
+# Unit of work of the current request; None outside one (scripts, the worker, background loops)
+current_unit_of_work: ContextVar["UnitOfWork | None"] = ContextVar("current_unit_of_work", default=None)
+
+# One breaker per database server, shared by every service's pool for it
+_breakers = {}
+
+def circuit_breaker_for(dsn: str) -> CircuitBreaker:
+    if dsn not in _breakers:
+        _breakers[dsn] = CircuitBreaker(
+            f"postgres:{psycopg2.extensions.parse_dsn(dsn).get('host', 'local')}",
+            settings.circuit_failure_threshold,
+            settings.circuit_reset_seconds
+        )
+    return _breakers[dsn]
+
+# OperationalErrors caused by the statement itself rather than the server: its own
+# statement_timeout or lock_timeout, or a deadlock / serialization conflict with another client
+CLIENT_CAUSED_ERRORS = (
+    psycopg2.errors.QueryCanceled, psycopg2.errors.LockNotAvailable, psycopg2.extensions.TransactionRollbackError
+)
+
+class GuardedCursor(RealDictCursor):
+    """RealDictCursor that reports statement outcomes to its connection's circuit breaker.
+
+    Only OperationalErrors that point at the server (lost connections, shutdowns, the server
+    refusing work) count as failures. One client's slow queries hitting statement_timeout must
+    not fail everyone else's requests, and other errors (constraint violations and the like)
+    say nothing about backend health either.
+    """
+
+    def execute(self, query, vars=None):
+        breaker = self.connection.circuit_breaker
+        try:
+            result = super().execute(query, vars)
+        except CLIENT_CAUSED_ERRORS:
+            raise
+        except psycopg2.OperationalError:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return result
+
+class UnitOfWork:
+    """Lends one connection per database to every service call made inside it.
+
+    Services keep their get_connection / put_connection pattern; while a unit of work is
+    current, the first checkout for a database is kept and handed to later calls, and
+    put_connection leaves it alone until release(). Reads reuse a held primary connection, so
+    a request that touches one database costs one pooled connection however many services
+    it calls. Service commits still take effect immediately unless transaction is set: then
+    they are deferred, everything commits in release() (later checkouts first, like the message
+    shards), and jobs enqueued meanwhile are only sent after that commit. Routes release before
+    awaiting Redis, so no connection sits checked out (or idle in a transaction) meanwhile.
+    """
+
+    def __init__(self, transaction: bool = False):
+        self.transaction = transaction
+        # (dsn, primary?) -> (service that checked it out, connection), in checkout order
+        self.held = {}
+        self.held_ids = set()
+        self.after_commit = []
+        # dsn -> pool this request reads from, so reads after a release stay on the same replica
+        self.read_pools = {}
+        # Shard fan-outs check out from worker threads that share this unit of work
+        self.lock = threading.Lock()
+
+    def holds(self, conn) -> bool:
+        return id(conn) in self.held_ids
+
+    def lend(self, service, primary: bool):
+        with self.lock:
+            held = self.held.get((service.dsn, True))
+            if held is None and not primary:
+                held = self.held.get((service.dsn, False))
+        if held is not None:
+            # The previous statement_timeout lapsed with the last commit, or reflects an older budget
+            service._apply_deadline(held[1])
+            return held[1]
+        if primary or self.transaction:
+            conn = service._checkout(service.pool)
+            primary = True
+        else:
+            conn = service._checkout_read(replica_pool=self.read_pools.get(service.dsn))
+            with self.lock:
+                self.read_pools.setdefault(service.dsn, service._borrowed.get(id(conn), service.pool))
+        conn.defer_commit = self.transaction
+        with self.lock:
+            winner = self.held.setdefault((service.dsn, primary), (service, conn))[1]
+            self.held_ids.add(id(winner))
+        if winner is not conn:
+            # Another thread of this request checked one out first
+            conn.defer_commit = False
+            service._put(conn)
+        return winner
+
+    def release(self, commit: bool = True):
+        """Commit (in transaction mode) and return every held connection to its pool.
+
+        The unit stays current: later calls check connections out again.
+        """
+        error = None
+        for service, conn in reversed(list(self.held.values())):
+            conn.defer_commit = False
+            try:
+                if self.transaction and commit and error is None:
+                    conn.commit()
+            except Exception as e:
+                error = e
+            finally:
+                # The pool rolls back whatever was left uncommitted
+                service._put(conn)
+        self.held.clear()
+        self.held_ids.clear()
+        callbacks, self.after_commit = self.after_commit, []
+        if error is not None:
+            raise error
+        if commit:
+            for callback in callbacks:
+                callback()
+
+    def close(self, commit: bool = True):
+        self.release(commit)
+
+class DatabaseService:
+    """Shared connection handling: one primary pool for writes plus optional read replicas"""
+
+    # Upper bound for opening a new connection. An exhausted pool is never waited on here: checkouts
+    # run on the event loop thread, so requests queue in admission control instead
+    acquire_timeout: float = settings.pool_acquire_timeout_ms / 1000
+
+    def __init__(self, dsn: str, replica_dsns: list[str] | None = None, job_queue=None):
+        self.dsn = dsn
+        connect_timeout = max(1, math.ceil(self.acquire_timeout))
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            1, settings.db_pool_size, dsn, cursor_factory=GuardedCursor, connection_factory=PreparedConnection,
+            connect_timeout=connect_timeout
+        )
+        self.pool.circuit_breaker = circuit_breaker_for(dsn)
+        self.replica_pools = []
+        for replica_dsn in replica_dsns or []:
+            replica_pool = psycopg2.pool.ThreadedConnectionPool(
+                1, settings.db_pool_size, replica_dsn, cursor_factory=GuardedCursor, connection_factory=PreparedConnection,
+                connect_timeout=connect_timeout
+            )
+            replica_pool.circuit_breaker = circuit_breaker_for(replica_dsn)
+            self.replica_pools.append(replica_pool)
+        self._replica_cycle = itertools.cycle(self.replica_pools)
+        # Connections borrowed from a replica, so put_connection returns them to the right pool
+        self._borrowed = {}
+        self.job_queue = job_queue
+
+    def stream_query(self, query: str, params, batch_size: int = 500, use_primary: bool = False):
+        """Yield rows of query through a named server-side cursor, batch_size rows per round trip.
+
+        Only one batch is held in memory at a time. The connection stays checked out until the
+        generator is exhausted or closed, so consume it promptly.
+        """
+        # Outlives the request, so it never borrows the unit of work's connection
+        conn = self._checkout_read(use_primary)
+        try:
+            with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cur:
+                cur.itersize = batch_size
+                cur.execute(query, params)
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+        finally:
+            # Named cursors live inside a transaction; end it before returning the connection
+            conn.rollback()
+            self._put(conn)
+
+    def _checkout(self, connection_pool):
+        """Borrow a connection within the request deadline, bounded by statement_timeout.
+
+        Fails fast with CircuitOpenError while the server's breaker is open, with
+        DeadlineExceeded once the request has no time left, and with PoolError if the pool
+        is exhausted.
+        """
+        breaker = connection_pool.circuit_breaker
+        breaker.allow()
+        try:
+            conn = connection_pool.getconn()
+        except psycopg2.OperationalError:
+            # A fresh connection could not be opened
+            breaker.record_failure()
+            raise
+        conn.circuit_breaker = breaker
+        try:
+            self._apply_deadline(conn)
+        except Exception:
+            connection_pool.putconn(conn)
+            raise
+        return conn
+
+    def _apply_deadline(self, conn):
+        budget = remaining_seconds()
+        if budget is not None:
+            # Transaction-local: lapses at commit/rollback, including the pool's rollback on put.
+            # Plain cursor, so this bookkeeping statement never counts as a breaker success
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute(
+                    "SELECT set_config('statement_timeout', %s, true)",
+                    (f"{max(1, int(budget * 1000))}ms",)
+                )
+
+    def get_connection(self):
+        unit_of_work = current_unit_of_work.get()
+        if unit_of_work is not None:
+            return unit_of_work.lend(self, primary=True)
+        return self._checkout(self.pool)
+
+    def get_read_connection(self, use_primary: bool = False):
+        """Connection for read-only queries; round-robins replicas unless the caller needs the primary"""
+        unit_of_work = current_unit_of_work.get()
+        if unit_of_work is not None:
+            return unit_of_work.lend(self, primary=use_primary or not self.replica_pools)
+        return self._checkout_read(use_primary)
+
+    def _checkout_read(self, use_primary: bool = False, replica_pool=None):
+        if use_primary or not self.replica_pools:
+            return self._checkout(self.pool)
+        replica_pool = replica_pool or next(self._replica_cycle)
+        try:
+            conn = self._checkout(replica_pool)
+        except (psycopg2.Error, CircuitOpenError):
+            # Replica unreachable or tripped: serve the read from the primary instead of failing
+            return self._checkout(self.pool)
+        self._borrowed[id(conn)] = replica_pool
+        return conn
+
+    def put_connection(self, conn):
+        unit_of_work = current_unit_of_work.get()
+        if unit_of_work is not None and unit_of_work.holds(conn):
+            return
+        self._put(conn)
+
+    def _put(self, conn):
+        self._borrowed.pop(id(conn), self.pool).putconn(conn)
+
+    def bump_versions(self, cur, keys: list[str], channel: str):
+        """Bump version stamps inside the caller's write transaction and announce them on channel"""
+        BUMP_VERSIONS.execute(cur, (keys, channel, encode_keys(keys)))
+
+    def enqueue(self, job_type: str, payload: dict):
+        """Hand a side effect to the background workers; call only after conn.commit()"""
+        if self.job_queue is None:
+            return
+        unit_of_work = current_unit_of_work.get()
+        if unit_of_work is not None and unit_of_work.transaction:
+            # conn.commit() was deferred; the job must not run before the data exists
+            unit_of_work.after_commit.append(lambda: self._send_job(job_type, payload))
+            return
+        self._send_job(job_type, payload)
+
+    def _send_job(self, job_type: str, payload: dict):
+        try:
+            self.job_queue.enqueue(job_type, payload)
+        except Exception as e:
+            # The write is already committed; jobs are idempotent, so the next one catches up
+            logger.warning(f"Failed to enqueue {job_type} job: {e}")
+
+    def get_versions(self, keys: list[str], use_primary: bool = False) -> dict[str, int]:
+        """Version stamps as seen by the connection the request's body reads will use.
+
+        With replicas, the stamps are read from the replica the body is read from (the unit of
+        work keeps the request on one replica), so a lagging replica never serves an old body
+        under a newer version's ETag. The per-worker cache holds primary stamps, so it is only used
+        when reads go to the primary anyway.
+        """
+        cacheable = version_cache.enabled and not self.replica_pools
+        # Read-your-writes requests skip the cache: it trails each commit by one notification
+        if cacheable and not use_primary:
+            cached = {key: version_cache.get(key) for key in keys}
+            if None not in cached.values():
+                return cached
+        generation = version_cache.generation
+        conn = self.get_read_connection(use_primary)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT key, version FROM content_versions WHERE key = ANY(%s::varchar[])",
+                    (keys,)
+                )
+                versions = {row['key']: row['version'] for row in cur.fetchall()}
+                versions = {key: versions.get(key, 0) for key in keys}
+                if cacheable:
+                    for key, version in versions.items():
+                        version_cache.set(key, version, generation)
+                return versions
+        except Exception as e:
+            raise e
+        finally:
+            self.put_connection(conn)
@@ -1,16 +1,213 @@
-import psycopg2
-from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
-
-class DatingService:
-    def __init__(self, dsn: str):
-        self.pool = psycopg2.pool.SimpleConnectionPool(1, 20, dsn, cursor_factory=RealDictCursor)
-    
-    def get_connection(self):
-        return self.pool.getconn()
-    
-    def put_connection(self, conn):
-        self.pool.putconn(conn)
+import heapq
+import logging
+import re
+from contextlib import contextmanager
+from datetime import date, datetime
+from services.database import DatabaseService, CONTENT_VERSIONS_DDL
+from services.message_shards import MessageShards
+from services.invalidation import MESSAGE_SENT, POST_CHANGED, USER_UPDATED
+from services.statements import PreparedStatement
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Both tables are range-partitioned by month on created_at. Partitioned tables need the
+# partition key in every unique constraint, so the primary keys are (id, created_at) and
+# dating_post_id / reply_to_message_id are checked by the service instead of foreign keys.
+# Usernames are copied in at write time so the feed and inbox never join users; renames are
+# propagated by the propagate_username job. dating_messages may live in separate shard
+# databases (see MessageShards), so no query joins it with dating_posts or users.
+PARTITIONED_TABLES = {
+    "dating_posts": """
+        CREATE TABLE dating_posts (
+            id INTEGER NOT NULL DEFAULT nextval('dating_posts_id_seq'),
+            user_id INTEGER REFERENCES users(id),
+            title VARCHAR(200) NOT NULL,
+            description TEXT NOT NULL,
+            target_gender VARCHAR(10) NOT NULL,
+            target_age_min INTEGER NOT NULL,
+            target_age_max INTEGER NOT NULL,
+            username VARCHAR(50),
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """,
+    "dating_messages": """
+        CREATE TABLE dating_messages (
+            id INTEGER NOT NULL DEFAULT nextval('dating_messages_id_seq'),
+            sender_id INTEGER REFERENCES users(id),
+            receiver_id INTEGER REFERENCES users(id),
+            dating_post_id INTEGER,
+            content TEXT NOT NULL,
+            reply_to_message_id INTEGER,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            read_at TIMESTAMP,
+            sender_username VARCHAR(50),
+            receiver_username VARCHAR(50),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """,
+}
+
+PARTITION_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_dating_posts_created_at ON dating_posts (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_dating_posts_user_created ON dating_posts (user_id, created_at)",
+    # Gender equality first, then the age bounds, so gender + viewer-age filters are one index range scan
+    "CREATE INDEX IF NOT EXISTS idx_dating_posts_gender_age ON dating_posts (target_gender, target_age_min, target_age_max)",
+    "CREATE INDEX IF NOT EXISTS idx_dating_messages_sender ON dating_messages (sender_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_dating_messages_receiver ON dating_messages (receiver_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_dating_messages_post ON dating_messages (dating_post_id, sender_id)",
+    "CREATE INDEX IF NOT EXISTS idx_dating_messages_reply_to ON dating_messages (reply_to_message_id)",
+    # Unread badge recounts and mark-as-read only touch the receiver's unread rows
+    "CREATE INDEX IF NOT EXISTS idx_dating_messages_unread ON dating_messages (receiver_id) WHERE read_at IS NULL",
+]
+
+# Shard databases have no users table; ids still come from the main database's sequence
+# Advisory lock key, so concurrent workers take turns maintaining a database's partitions
+PARTITION_MAINTENANCE_LOCK = 7412
+SHARD_MESSAGES_DDL = PARTITIONED_TABLES["dating_messages"].replace(" REFERENCES users(id)", "")
+MESSAGE_INDEXES = [statement for statement in PARTITION_INDEXES if " ON dating_messages " in statement]
+
+DATING_POST_OWNER = PreparedStatement(
+    "dating_post_owner", ["integer"], "SELECT user_id FROM dating_posts WHERE id = %s"
+)
+INITIAL_MESSAGE_EXISTS = PreparedStatement(
+    "initial_message_exists", ["integer", "integer"],
+    "SELECT id FROM dating_messages WHERE sender_id = %s AND dating_post_id = %s AND reply_to_message_id IS NULL"
+)
+# Runs in the main database: a globally unique id plus the usernames to copy onto the message
+ALLOCATE_MESSAGE = PreparedStatement("allocate_message", ["integer", "integer"], """
+    SELECT nextval('dating_messages_id_seq') AS id,
+           (SELECT username FROM users WHERE id = %s) AS sender_username,
+           (SELECT username FROM users WHERE id = %s) AS receiver_username
+""")
+INSERT_MESSAGE = PreparedStatement("insert_message", ["integer"] * 4 + ["text", "integer", "varchar", "varchar"], """
+    INSERT INTO dating_messages (id, sender_id, receiver_id, dating_post_id, content, reply_to_message_id,
+                                 sender_username, receiver_username)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    RETURNING *
+""")
+# Per shard; dating_post_title is filled in from the main database afterwards
+GET_MESSAGES = PreparedStatement("get_messages", ["integer"] * 5 + ["timestamp"], """
+    SELECT dm.*, 
+           orig.content as original_message_content,
+           orig.sender_username as original_sender_username,
+           CASE WHEN dm.sender_id = %s THEN true ELSE false END as sender_id,
+           CASE WHEN dm.receiver_id = %s THEN true ELSE false END as receiver_id,
+           CASE WHEN EXISTS(
+               SELECT 1 FROM dating_messages reply 
+               WHERE reply.reply_to_message_id = dm.id AND reply.sender_id = %s
+                 AND reply.created_at >= dm.created_at
+           ) THEN true ELSE false END as already_replied
+    FROM dating_messages dm
+    LEFT JOIN dating_messages orig ON dm.reply_to_message_id = orig.id AND orig.created_at <= dm.created_at
+    WHERE (dm.sender_id = %s OR dm.receiver_id = %s)
+      AND dm.created_at >= %s
+    ORDER BY dm.created_at DESC
+""")
+
+PARTITION_BOUND = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+# message_count is added per shard with POST_MESSAGE_COUNTS
+USER_DATING_POSTS_QUERY = """
+    SELECT dp.*
+    FROM dating_posts dp
+    WHERE dp.user_id = %s
+    ORDER BY dp.created_at DESC
+"""
+
+POST_MESSAGE_COUNTS = """
+    SELECT dating_post_id, COUNT(*) AS message_count
+    FROM dating_messages
+    WHERE dating_post_id = ANY(%s::int[]) AND reply_to_message_id IS NULL
+    GROUP BY dating_post_id
+"""
+
+MESSAGED_POST_IDS = PreparedStatement("messaged_post_ids", ["integer"], """
+    SELECT DISTINCT dating_post_id FROM dating_messages WHERE sender_id = %s AND reply_to_message_id IS NULL
+""")
+
+# Raw message rows for export; unlike GET_MESSAGES, sender_id/receiver_id stay ids
+EXPORT_MESSAGES_QUERY = """
+    SELECT dm.*
+    FROM dating_messages dm
+    WHERE dm.sender_id = %s OR dm.receiver_id = %s
+    ORDER BY dm.created_at
+"""
+
+def month_start(value: date, offset: int = 0) -> date:
+    month_index = value.year * 12 + value.month - 1 + offset
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+def parse_bound(value: str) -> datetime | None:
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+class DatingService(DatabaseService):
+    def __init__(self, dsn: str, replica_dsns: list[str] | None = None, job_queue=None,
+                 message_shard_dsns: list[str] | None = None):
+        super().__init__(dsn, replica_dsns, job_queue)
+        # Without shard DSNs, messages stay in this database
+        self.messages = MessageShards(
+            [DatabaseService(shard_dsn) for shard_dsn in message_shard_dsns] if message_shard_dsns else [self]
+        )
+
+    @contextmanager
+    def message_cursor(self, shard, conn):
+        """Cursor for writing messages on shard, alongside conn's transaction in this database.
+
+        When messages live in this database it is a cursor on conn itself, so both commit
+        together. Otherwise the shard commits first when the block exits, and the caller
+        commits conn (version bumps and their notifications) only after that.
+        """
+        if shard is self:
+            with conn.cursor() as cur:
+                yield cur
+            return
+        shard_conn = shard.get_connection()
+        try:
+            with shard_conn.cursor() as cur:
+                yield cur
+            shard_conn.commit()
+        except Exception:
+            shard_conn.rollback()
+            raise
+        finally:
+            shard.put_connection(shard_conn)
+
+    def _shard_query(self, shard, query, params, use_primary: bool = False):
+        conn = shard.get_read_connection(use_primary)
+        try:
+            with conn.cursor() as cur:
+                if isinstance(query, PreparedStatement):
+                    query.execute(cur, params)
+                else:
+                    cur.execute(query, params)
+                return cur.fetchall()
+        finally:
+            shard.put_connection(conn)
+
+    def find_message(self, message_id: int):
+        """The message with message_id from whichever shard holds it"""
+        found = self.messages.fan_out(
+            lambda shard: self._shard_query(shard, "SELECT * FROM dating_messages WHERE id = %s", (message_id,), True)
+        )
+        return next((rows[0] for rows in found if rows), None)
+
+    def messaged_post_ids(self, user_id, use_primary: bool = False) -> set[int]:
+        """Posts user_id has sent a first message to, for already_messaged"""
+        if user_id is None:
+            return set()
+        found = self.messages.fan_out(lambda shard: self._shard_query(shard, MESSAGED_POST_IDS, (user_id,), use_primary))
+        return {row['dating_post_id'] for rows in found for row in rows}
+
+    def _mark_messaged(self, posts, user_id, use_primary: bool = False):
+        messaged = self.messaged_post_ids(user_id, use_primary)
+        for post in posts:
+            post['already_messaged'] = post['id'] in messaged
+        return posts
 
     def create_dating_post(self, user_id: int, title: str, description: str, 
                           target_gender: str, target_age_min: int, target_age_max: int):
@@ -21,7 +218,7 @@ class DatingService:
                 cur.execute(
                     """
                     SELECT id FROM dating_posts 
-                    WHERE user_id = %s AND DATE(created_at) = CURRENT_DATE
+                    WHERE user_id = %s AND created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + 1
                     """,
                     (user_id,)
                 )
@@ -31,15 +228,17 @@ class DatingService:
                 cur.execute(
                     """
                     INSERT INTO dating_posts (user_id, title, description, target_gender, 
-                                            target_age_min, target_age_max)
-                    VALUES (%s, %s, %s, %s, %s, %s)
+                                            target_age_min, target_age_max, username)
+                    VALUES (%s, %s, %s, %s, %s, %s, (SELECT username FROM users WHERE id = %s))
                     RETURNING id, user_id, title, description, target_gender, 
-                             target_age_min, target_age_max, created_at
+                             target_age_min, target_age_max, username, created_at
                     """,
-                    (user_id, title, description, target_gender, target_age_min, target_age_max),
+                    (user_id, title, description, target_gender, target_age_min, target_age_max, user_id),
                 )
                 post = cur.fetchone()
+                self.bump_versions(cur, ["dating_posts", f"profile:{user_id}"], POST_CHANGED)
                 conn.commit()
+                self.enqueue("refresh_feed", {"feed": "dating_posts"})
                 return post
         except Exception as e:
             conn.rollback()
@@ -47,42 +246,79 @@ class DatingService:
         finally:
             self.put_connection(conn)
 
-    def get_dating_posts(self, filters=None, user_id=None):
+    def get_feed_page(self, limit: int, target_gender: str | None = None, since: str | None = None):
+        """(dating_posts version, first limit posts) for FeedMaterializer, without per-viewer columns"""
         conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT version FROM content_versions WHERE key = 'dating_posts'")
+                version = cur.fetchone()
+                query = "SELECT dp.* FROM dating_posts dp WHERE 1=1"
+                params = []
+                if since:
+                    query += " AND dp.created_at >= %s"
+                    params.append(since)
+                if target_gender:
+                    query += " AND dp.target_gender = %s"
+                    params.append(target_gender)
+                query += " ORDER BY dp.created_at DESC LIMIT %s"
+                cur.execute(query, params + [limit])
+                return (version['version'] if version else 0), cur.fetchall()
+        except Exception as e:
+            raise e
+        finally:
+            self.put_connection(conn)
+
+    def add_viewer_fields(self, posts, user_id=None, use_primary: bool = False):
+        """is_owner and already_messaged for materialized feed rows, as get_dating_posts computes them"""
+        for post in posts:
+            post['is_owner'] = post['user_id'] == user_id
+        return self._mark_messaged(posts, user_id, use_primary)
+
+    def get_dating_posts(self, filters=None, user_id=None, use_primary: bool = False, since: date | None = None,
+                         limit: int | None = None, offset: int = 0):
+        conn = self.get_read_connection(use_primary)
         try:
             with conn.cursor() as cur:
                 query = """
-                    SELECT dp.*, u.username,
-                           CASE WHEN dp.user_id = %s THEN true ELSE false END as is_owner,
-                           CASE WHEN EXISTS(
-                               SELECT 1 FROM dating_messages dm 
-                               WHERE dm.dating_post_id = dp.id AND dm.sender_id = %s AND dm.reply_to_message_id IS NULL
-                           ) THEN true ELSE false END as already_messaged
+                    SELECT dp.*,
+                           CASE WHEN dp.user_id = %s THEN true ELSE false END as is_owner
                     FROM dating_posts dp
-                    JOIN users u ON dp.user_id = u.id
                     WHERE 1=1
                 """
-                params = [user_id, user_id]
+                params = [user_id]
+
+                # A lower bound on created_at lets the planner skip older partitions
+                if since:
+                    query += " AND dp.created_at >= %s"
+                    params.append(since)
                 
                 if filters:
                     if filters.get('target_gender'):
-                        query += " AND target_gender = %s"
+                        query += " AND dp.target_gender = %s"
                         params.append(filters['target_gender'])
+                    if filters.get('age'):
+                        # Posts whose wanted age range contains the viewer's age
+                        query += " AND dp.target_age_min <= %s AND dp.target_age_max >= %s"
+                        params.extend([filters['age'], filters['age']])
                 
-                query += " ORDER BY dp.created_at DESC"
+                # LIMIT NULL returns every row
+                query += " ORDER BY dp.created_at DESC LIMIT %s OFFSET %s"
+                params.extend([limit, offset])
                 cur.execute(query, params)
-                return cur.fetchall()
+                posts = cur.fetchall()
         except Exception as e:
             raise e
         finally:
             self.put_connection(conn)
+        return self._mark_messaged(posts, user_id, use_primary)
 
     def send_message(self, sender_id: int, dating_post_id: int, content: str):
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
                 # Get receiver_id from dating post
-                cur.execute("SELECT user_id FROM dating_posts WHERE id = %s", (dating_post_id,))
+                DATING_POST_OWNER.execute(cur, (dating_post_id,))
                 post = cur.fetchone()
                 if not post:
                     raise ValueError("Dating post not found")
@@ -91,23 +327,24 @@ class DatingService:
                 if sender_id == receiver_id:
                     raise ValueError("Cannot send message to yourself")
                 
-                # Check if already sent message to this post (only initial messages, not replies)
-                cur.execute(
-                    "SELECT id FROM dating_messages WHERE sender_id = %s AND dating_post_id = %s AND reply_to_message_id IS NULL",
-                    (sender_id, dating_post_id)
-                )
-                if cur.fetchone():
-                    raise ValueError("Already sent message to this post")
-                
-                cur.execute(
-                    """
-                    INSERT INTO dating_messages (sender_id, receiver_id, dating_post_id, content)
-                    VALUES (%s, %s, %s, %s)
-                    RETURNING id, sender_id, receiver_id, dating_post_id, content, created_at, updated_at
-                    """,
-                    (sender_id, receiver_id, dating_post_id, content),
-                )
-                message = cur.fetchone()
+                shard = self.messages.for_conversation(dating_post_id, sender_id, receiver_id)
+                with self.message_cursor(shard, conn) as shard_cur:
+                    # Check if already sent message to this post (only initial messages, not replies)
+                    INITIAL_MESSAGE_EXISTS.execute(shard_cur, (sender_id, dating_post_id))
+                    if shard_cur.fetchone():
+                        raise ValueError("Already sent message to this post")
+
+                    ALLOCATE_MESSAGE.execute(cur, (sender_id, receiver_id))
+                    allocated = cur.fetchone()
+                    INSERT_MESSAGE.execute(shard_cur, (
+                        allocated['id'], sender_id, receiver_id, dating_post_id, content, None,
+                        allocated['sender_username'], allocated['receiver_username']
+                    ))
+                    message = shard_cur.fetchone()
+                # already_messaged in the feed and message_count on the poster's profile both change
+                self.bump_versions(cur, [
+                    "dating_posts", f"messages:{sender_id}", f"messages:{receiver_id}", f"profile:{receiver_id}"
+                ], MESSAGE_SENT)
                 conn.commit()
                 return message
         except Exception as e:
@@ -116,174 +353,498 @@ class DatingService:
         finally:
             self.put_connection(conn)
 
-    def get_messages(self, user_id: int):
+    def get_messages(self, user_id: int, use_primary: bool = False, since: date | None = None):
+        params = (user_id, user_id, user_id, user_id, user_id, since or date.min)
+        found = self.messages.fan_out(lambda shard: self._shard_query(shard, GET_MESSAGES, params, use_primary))
+        # A conversation being moved by the rebalancer can briefly exist on two shards
+        messages = list({message['id']: message for rows in found for message in rows}.values())
+        messages.sort(key=lambda message: message['created_at'], reverse=True)
+        post_ids = list({message['dating_post_id'] for message in messages if message['dating_post_id']})
+        if post_ids:
+            titles = {
+                row['id']: row['title'] for row in self._shard_query(
+                    self, "SELECT id, title FROM dating_posts WHERE id = ANY(%s::int[])", (post_ids,), use_primary
+                )
+            }
+            for message in messages:
+                message['dating_post_title'] = titles.get(message['dating_post_id'])
+        return messages
+
+    def reply_message(self, message_id: int, user_id: int, reply_content: str):
+        original_message = self.find_message(message_id)
+        if not original_message:
+            raise ValueError("Original message not found")
+        
+        # Check if user is receiver
+        if original_message['receiver_id'] != user_id:
+            raise ValueError("Cannot reply to this message")
+
+        sender_id = original_message['sender_id']
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT dm.*, 
-                           s.username as sender_username,
-                           r.username as receiver_username,
-                           dp.title as dating_post_title,
-                           orig.content as original_message_content,
-                           orig_sender.username as original_sender_username,
-                           CASE WHEN dm.sender_id = %s THEN true ELSE false END as sender_id,
-                           CASE WHEN dm.receiver_id = %s THEN true ELSE false END as receiver_id,
-                           CASE WHEN EXISTS(
-                               SELECT 1 FROM dating_messages reply 
-                               WHERE reply.reply_to_message_id = dm.id AND reply.sender_id = %s
-                           ) THEN true ELSE false END as already_replied
-                    FROM dating_messages dm
-                    JOIN users s ON dm.sender_id = s.id
-                    JOIN users r ON dm.receiver_id = r.id
-                    JOIN dating_posts dp ON dm.dating_post_id = dp.id
-                    LEFT JOIN dating_messages orig ON dm.reply_to_message_id = orig.id
-                    LEFT JOIN users orig_sender ON orig.sender_id = orig_sender.id
-                    WHERE dm.sender_id = %s OR dm.receiver_id = %s
-                    ORDER BY dm.created_at DESC
-                    """,
-                    (user_id, user_id, user_id, user_id, user_id)
-                )
-                return cur.fetchall()
+                shard = self.messages.for_conversation(original_message['dating_post_id'], user_id, sender_id)
+                with self.message_cursor(shard, conn) as shard_cur:
+                    # Check if already replied to this specific message
+                    shard_cur.execute(
+                        "SELECT id FROM dating_messages WHERE reply_to_message_id = %s AND sender_id = %s",
+                        (message_id, user_id)
+                    )
+                    if shard_cur.fetchone():
+                        raise ValueError("Already replied to this message")
+
+                    # Create new message as reply
+                    ALLOCATE_MESSAGE.execute(cur, (user_id, sender_id))
+                    allocated = cur.fetchone()
+                    INSERT_MESSAGE.execute(shard_cur, (
+                        allocated['id'], user_id, sender_id, original_message['dating_post_id'], reply_content,
+                        message_id, allocated['sender_username'], allocated['receiver_username']
+                    ))
+                    reply_message = shard_cur.fetchone()
+                self.bump_versions(cur, [f"messages:{user_id}", f"messages:{sender_id}"], MESSAGE_SENT)
+                conn.commit()
+                return reply_message
         except Exception as e:
+            conn.rollback()
             raise e
         finally:
             self.put_connection(conn)
 
-    def reply_message(self, message_id: int, user_id: int, reply_content: str):
+    def update_message(self, message_id: int, user_id: int, content: str):
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
-                # Get original message
-                cur.execute(
-                    "SELECT * FROM dating_messages WHERE id = %s",
-                    (message_id,)
-                )
-                original_message = cur.fetchone()
-                if not original_message:
-                    raise ValueError("Original message not found")
-                
-                # Check if user is receiver
-                if original_message['receiver_id'] != user_id:
-                    raise ValueError("Cannot reply to this message")
-                
-                # Check if already replied to this specific message
-                cur.execute(
-                    "SELECT id FROM dating_messages WHERE reply_to_message_id = %s AND sender_id = %s",
-                    (message_id, user_id)
-                )
-                if cur.fetchone():
-                    raise ValueError("Already replied to this message")
-                
-                # Create new message as reply
-                cur.execute(
-                    """
-                    INSERT INTO dating_messages (sender_id, receiver_id, dating_post_id, content, reply_to_message_id)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING *
-                    """,
-                    (user_id, original_message['sender_id'], original_message['dating_post_id'], reply_content, message_id)
-                )
-                reply_message = cur.fetchone()
+                message = None
+                # Every shard, so a copy left by an interrupted rebalance stays in sync
+                for shard in self.messages.shards:
+                    with self.message_cursor(shard, conn) as shard_cur:
+                        shard_cur.execute(
+                            """
+                            UPDATE dating_messages 
+                            SET content = %s, updated_at = CURRENT_TIMESTAMP
+                            WHERE id = %s AND sender_id = %s
+                            RETURNING *
+                            """,
+                            (content, message_id, user_id)
+                        )
+                        message = shard_cur.fetchone() or message
+                if not message:
+                    raise ValueError("Cannot update this message")
+                self.bump_versions(cur, [f"messages:{user_id}", f"messages:{message['receiver_id']}"], MESSAGE_SENT)
                 conn.commit()
-                return reply_message
+                return message
         except Exception as e:
             conn.rollback()
             raise e
         finally:
             self.put_connection(conn)
 
-    def update_message(self, message_id: int, user_id: int, content: str):
+    def mark_messages_read(self, user_id: int) -> int:
+        """Stamp read_at on every unread message received by user_id; returns how many were marked"""
         conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                marked = 0
+                for shard in self.messages.shards:
+                    with self.message_cursor(shard, conn) as shard_cur:
+                        shard_cur.execute(
+                            """
+                            UPDATE dating_messages SET read_at = CURRENT_TIMESTAMP
+                            WHERE receiver_id = %s AND read_at IS NULL
+                            """,
+                            (user_id,)
+                        )
+                        marked += shard_cur.rowcount
+                if marked:
+                    self.bump_versions(cur, [f"messages:{user_id}"], MESSAGE_SENT)
+                conn.commit()
+                return marked
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            self.put_connection(conn)
+
+    def count_unread(self, user_id: int) -> int:
+        found = self.messages.fan_out(lambda shard: self._shard_query(
+            shard,
+            "SELECT COUNT(*) AS unread FROM dating_messages WHERE receiver_id = %s AND read_at IS NULL",
+            (user_id,),
+            True
+        ))
+        return sum(rows[0]['unread'] for rows in found)
+
+    def get_recommendation_candidates(self, window_days: int):
+        """Compact candidate rows for RecommendationService, including the poster's hearts"""
+        conn = self.get_read_connection()
         try:
             with conn.cursor() as cur:
                 cur.execute(
                     """
-                    UPDATE dating_messages 
-                    SET content = %s, updated_at = CURRENT_TIMESTAMP
-                    WHERE id = %s AND sender_id = %s
-                    RETURNING *
+                    SELECT dp.id, dp.user_id, dp.target_gender, dp.target_age_min, dp.target_age_max,
+                           dp.created_at, u.hearts
+                    FROM dating_posts dp
+                    JOIN users u ON dp.user_id = u.id
+                    WHERE dp.created_at >= CURRENT_DATE - %s
                     """,
-                    (content, message_id, user_id)
+                    (window_days,)
                 )
-                message = cur.fetchone()
-                if not message:
-                    raise ValueError("Cannot update this message")
-                conn.commit()
-                return message
+                return cur.fetchall()
         except Exception as e:
-            conn.rollback()
             raise e
         finally:
             self.put_connection(conn)
 
-    def can_post_today(self, user_id: int):
-        conn = self.get_connection()
+    def get_dating_posts_by_ids(self, post_ids: list[int], user_id=None, use_primary: bool = False):
+        conn = self.get_read_connection(use_primary)
         try:
             with conn.cursor() as cur:
                 cur.execute(
                     """
-                    SELECT id FROM dating_posts 
-                    WHERE user_id = %s AND DATE(created_at) = CURRENT_DATE
+                    SELECT dp.*,
+                           CASE WHEN dp.user_id = %s THEN true ELSE false END as is_owner
+                    FROM dating_posts dp
+                    WHERE dp.id = ANY(%s::int[])
                     """,
-                    (user_id,)
+                    (user_id, post_ids)
                 )
-                return cur.fetchone() is None
+                posts = cur.fetchall()
         except Exception as e:
             raise e
         finally:
             self.put_connection(conn)
+        return self._mark_messaged(posts, user_id, use_primary)
 
-    def get_user_dating_posts(self, user_id: int):
+    def can_post_today(self, user_id: int):
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
                 cur.execute(
                     """
-                    SELECT dp.*, COUNT(dm.id) as message_count
-                    FROM dating_posts dp
-                    LEFT JOIN dating_messages dm ON dp.id = dm.dating_post_id AND dm.reply_to_message_id IS NULL
-                    WHERE dp.user_id = %s
-                    GROUP BY dp.id
-                    ORDER BY dp.created_at DESC
+                    SELECT id FROM dating_posts 
+                    WHERE user_id = %s AND created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + 1
                     """,
                     (user_id,)
                 )
-                return cur.fetchall()
+                return cur.fetchone() is None
+        except Exception as e:
+            raise e
+        finally:
+            self.put_connection(conn)
+
+    def get_user_dating_posts(self, user_id: int, use_primary: bool = False):
+        conn = self.get_read_connection(use_primary)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(USER_DATING_POSTS_QUERY, (user_id,))
+                posts = cur.fetchall()
         except Exception as e:
             raise e
         finally:
             self.put_connection(conn)
+        return self._add_message_counts(posts, use_primary)
+
+    def _add_message_counts(self, posts, use_primary: bool = False):
+        post_ids = [post['id'] for post in posts]
+        counts = {}
+        if post_ids:
+            found = self.messages.fan_out(
+                lambda shard: self._shard_query(shard, POST_MESSAGE_COUNTS, (post_ids,), use_primary)
+            )
+            for rows in found:
+                for row in rows:
+                    counts[row['dating_post_id']] = counts.get(row['dating_post_id'], 0) + row['message_count']
+        for post in posts:
+            post['message_count'] = counts.get(post['id'], 0)
+        return posts
+
+    def iter_user_dating_posts(self, user_id: int, batch_size: int = 500):
+        posts = []
+        for post in self.stream_query(USER_DATING_POSTS_QUERY, (user_id,), batch_size):
+            posts.append(post)
+            if len(posts) == batch_size:
+                yield from self._add_message_counts(posts)
+                posts = []
+        yield from self._add_message_counts(posts)
+
+    def iter_user_messages(self, user_id: int, batch_size: int = 500):
+        # Each shard streams in created_at order; merge them into one ordered stream
+        streams = [
+            shard.stream_query(EXPORT_MESSAGES_QUERY, (user_id, user_id), batch_size)
+            for shard in self.messages.shards
+        ]
+        return heapq.merge(*streams, key=lambda message: message['created_at'])
 
     def init_db(self):
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS dating_posts (
-                        id SERIAL PRIMARY KEY,
-                        user_id INTEGER REFERENCES users(id),
-                        title VARCHAR(200) NOT NULL,
-                        description TEXT NOT NULL,
-                        target_gender VARCHAR(10) NOT NULL,
-                        target_age_min INTEGER NOT NULL,
-                        target_age_max INTEGER NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS dating_messages (
-                        id SERIAL PRIMARY KEY,
-                        sender_id INTEGER REFERENCES users(id),
-                        receiver_id INTEGER REFERENCES users(id),
-                        dating_post_id INTEGER REFERENCES dating_posts(id),
-                        content TEXT NOT NULL,
-                        reply_to_message_id INTEGER REFERENCES dating_messages(id),
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                cur.execute(CONTENT_VERSIONS_DDL)
+                cur.execute("CREATE SEQUENCE IF NOT EXISTS dating_posts_id_seq")
+                cur.execute("CREATE SEQUENCE IF NOT EXISTS dating_messages_id_seq")
+                # Added before any conversion so a legacy heap attaches with the same columns
+                cur.execute("ALTER TABLE IF EXISTS dating_messages ADD COLUMN IF NOT EXISTS read_at TIMESTAMP")
+                cur.execute("ALTER TABLE IF EXISTS dating_posts ADD COLUMN IF NOT EXISTS username VARCHAR(50)")
+                cur.execute("ALTER TABLE IF EXISTS dating_messages ADD COLUMN IF NOT EXISTS sender_username VARCHAR(50)")
+                cur.execute("ALTER TABLE IF EXISTS dating_messages ADD COLUMN IF NOT EXISTS receiver_username VARCHAR(50)")
+                # Messages first: their foreign keys point at the dating_posts heap
+                for table in ("dating_messages", "dating_posts"):
+                    cur.execute(
+                        "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)",
+                        (table,)
                     )
-                """)
+                    existing = cur.fetchone()
+                    if existing is None:
+                        cur.execute(PARTITIONED_TABLES[table])
+                    elif existing['relkind'] == 'r':
+                        self._convert_to_partitioned(cur, table)
+                for statement in PARTITION_INDEXES:
+                    cur.execute(statement)
+                self.backfill_usernames(cur)
                 conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            self.put_connection(conn)
+        for shard in self.messages.shards:
+            if shard is not self:
+                self._init_shard(shard)
+        self.ensure_partitions()
+
+    def _init_shard(self, shard):
+        conn = shard.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("CREATE SEQUENCE IF NOT EXISTS dating_messages_id_seq")
+                cur.execute("SELECT to_regclass('dating_messages') AS existing")
+                if cur.fetchone()['existing'] is None:
+                    cur.execute(SHARD_MESSAGES_DDL)
+                for statement in MESSAGE_INDEXES:
+                    cur.execute(statement)
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
         finally:
-            self.put_connection(conn)
\ No newline at end of file
+            shard.put_connection(conn)
+
+    def _partition_owners(self):
+        """(database, tables) pairs whose monthly partitions are maintained here"""
+        owners = [(self, list(PARTITIONED_TABLES))]
+        owners += [(shard, ["dating_messages"]) for shard in self.messages.shards if shard is not self]
+        return owners
+
+    def _convert_to_partitioned(self, cur, table: str):
+        """Turn a pre-partitioning heap table into the first partition of a partitioned table"""
+        legacy = f"{table}_legacy"
+        cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_dating_post_id_fkey")
+        cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_reply_to_message_id_fkey")
+        # The partitioned parent's (id, created_at) key replaces the old id-only key on attach
+        cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT {table}_pkey")
+        cur.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        # The SERIAL sequence now feeds the partitioned table and must outlive the legacy partition
+        cur.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE")
+        cur.execute(f"UPDATE {legacy} SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+        cur.execute(f"ALTER TABLE {legacy} ALTER COLUMN created_at SET NOT NULL")
+        cur.execute(PARTITIONED_TABLES[table])
+        cur.execute(
+            f"SELECT date_trunc('month', COALESCE(MAX(created_at), CURRENT_TIMESTAMP)) + interval '1 month' AS upper FROM {legacy}"
+        )
+        upper = cur.fetchone()['upper']
+        cur.execute(
+            f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO (%s)",
+            (upper,)
+        )
+
+    def _partition_bounds(self, cur, table: str):
+        cur.execute(
+            """
+            SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            """,
+            (table,)
+        )
+        bounds = []
+        for row in cur.fetchall():
+            match = PARTITION_BOUND.search(row['bound'])
+            if match:
+                bounds.append((row['name'], parse_bound(match.group(1)), parse_bound(match.group(2))))
+        return bounds
+
+    def _begin_maintenance(self, cur) -> bool:
+        """Bound how long partition DDL waits behind other transactions' locks (every query on
+        the table would queue behind it), and let one process at a time maintain a database"""
+        cur.execute("SELECT set_config('lock_timeout', %s, true)", (f"{settings.partition_lock_timeout_ms}ms",))
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s) AS acquired", (PARTITION_MAINTENANCE_LOCK,))
+        return cur.fetchone()['acquired']
+
+    def _create_month_partition(self, cur, table: str, start: datetime, end: datetime):
+        """Add the [start, end) partition, taking over rows of that range from the DEFAULT partition.
+
+        The partition is built as a plain table and attached, which only needs SHARE UPDATE
+        EXCLUSIVE on the parent, so reads and writes carry on meanwhile.
+        """
+        name = f"{table}_p{start:%Y%m}"
+        cur.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)")
+        cur.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {table}_default WHERE created_at >= %s AND created_at < %s RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+            """,
+            (start, end)
+        )
+        cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (start, end))
+
+    def ensure_partitions(self, months_ahead: int = 2):
+        """Create monthly partitions from the current month through months_ahead.
+
+        Rows dated outside every monthly partition land in the table's DEFAULT partition
+        instead of failing, and move to their month once it is created.
+        """
+        today = date.today()
+        for database, tables in self._partition_owners():
+            conn = database.get_connection()
+            try:
+                with conn.cursor() as cur:
+                    if not self._begin_maintenance(cur):
+                        continue
+                    for table in tables:
+                        cur.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT")
+                        covered_until = max(
+                            (upper for _, _, upper in self._partition_bounds(cur, table) if upper),
+                            default=None
+                        )
+                        for offset in range(months_ahead + 1):
+                            lower = datetime.combine(month_start(today, offset), datetime.min.time())
+                            if covered_until and lower < covered_until:
+                                continue
+                            upper = datetime.combine(month_start(today, offset + 1), datetime.min.time())
+                            self._create_month_partition(cur, table, lower, upper)
+                    conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise e
+            finally:
+                database.put_connection(conn)
+
+    def backfill_usernames(self, cur):
+        """Copy usernames onto rows written before the columns existed (or bulk-loaded without them).
+
+        Only covers this database: rows reach other shards through send_message or the
+        rebalancer, both of which carry the usernames along.
+        """
+        cur.execute(
+            """
+            UPDATE dating_posts dp SET username = u.username
+            FROM users u WHERE u.id = dp.user_id AND dp.username IS NULL
+            """
+        )
+        cur.execute(
+            """
+            UPDATE dating_messages dm SET sender_username = s.username, receiver_username = r.username
+            FROM users s, users r
+            WHERE s.id = dm.sender_id AND r.id = dm.receiver_id
+              AND (dm.sender_username IS NULL OR dm.receiver_username IS NULL)
+            """
+        )
+
+    def propagate_username(self, user_id: int):
+        """Rewrite a renamed user's copied username; reads the current name, so retries and
+        out-of-order jobs always converge on the latest one"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT username FROM users WHERE id = %s", (user_id,))
+                user = cur.fetchone()
+                if not user:
+                    return
+                username = user['username']
+                cur.execute(
+                    "UPDATE dating_posts SET username = %s WHERE user_id = %s AND username IS DISTINCT FROM %s",
+                    (username, user_id, username)
+                )
+                renamed_posts = cur.rowcount
+                # Every inbox that shows this user's name changes
+                participants = {user_id}
+                for shard in self.messages.shards:
+                    with self.message_cursor(shard, conn) as shard_cur:
+                        shard_cur.execute(
+                            """
+                            UPDATE dating_messages SET
+                                sender_username = CASE WHEN sender_id = %s THEN %s ELSE sender_username END,
+                                receiver_username = CASE WHEN receiver_id = %s THEN %s ELSE receiver_username END
+                            WHERE (sender_id = %s AND sender_username IS DISTINCT FROM %s)
+                               OR (receiver_id = %s AND receiver_username IS DISTINCT FROM %s)
+                            RETURNING sender_id, receiver_id
+                            """,
+                            (user_id, username, user_id, username, user_id, username, user_id, username)
+                        )
+                        for row in shard_cur.fetchall():
+                            participants.update((row['sender_id'], row['receiver_id']))
+                keys = [f"messages:{participant}" for participant in participants]
+                if renamed_posts:
+                    keys += ["dating_posts", f"profile:{user_id}"]
+                self.bump_versions(cur, keys, USER_UPDATED)
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            self.put_connection(conn)
+
+    def create_month_partitions(self, cur, table: str, months: set[date]):
+        """Create partitions for the given month starts unless an existing partition overlaps them.
+
+        Runs in the caller's transaction; used when loading rows with historical created_at values.
+        """
+        bounds = [(lower, upper) for _, lower, upper in self._partition_bounds(cur, table)]
+        for lower in sorted(months):
+            start = datetime.combine(lower, datetime.min.time())
+            end = datetime.combine(month_start(lower, 1), datetime.min.time())
+            if any((low is None or low < end) and (high is None or start < high) for low, high in bounds):
+                continue
+            self._create_month_partition(cur, table, start, end)
+            bounds.append((start, end))
+
+    def apply_retention(self, retention_months: int, mode: str = "detach"):
+        """Detach (or drop) partitions whose rows are all older than retention_months.
+
+        Detached partitions stay in the database as plain tables so they can be archived
+        with pg_dump -t and dropped afterwards.
+        """
+        if retention_months <= 0:
+            return []
+        cutoff = datetime.combine(month_start(date.today(), -retention_months), datetime.min.time())
+        removed = []
+        for database, tables in self._partition_owners():
+            conn = database.get_connection()
+            try:
+                with conn.cursor() as cur:
+                    if not self._begin_maintenance(cur):
+                        continue
+                    for table in tables:
+                        for name, _, upper in self._partition_bounds(cur, table):
+                            if upper is None or upper > cutoff:
+                                continue
+                            cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                            if mode == "drop":
+                                cur.execute(f"DROP TABLE {name}")
+                            removed.append(name)
+                    conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise e
+            finally:
+                database.put_connection(conn)
+        return removed
+
+    def maintain_partitions(self, retention_months: int, retention_mode: str):
+        """Upcoming partitions plus retention; run from worker.py, never on the API's event loop"""
+        self.ensure_partitions()
+        removed = self.apply_retention(retention_months, retention_mode)
+        if removed:
+            logger.info(f"Retention ({retention_mode}) removed partitions: {', '.join(removed)}")
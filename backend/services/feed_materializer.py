@@ -0,0 +1,118 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from services.redis_client import create_redis
+from utils.deadline import remaining_seconds
+from utils.responses import to_json
+
+logger = logging.getLogger(__name__)
+
+# Delete the rebuild lock only if this caller still holds it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class FeedMaterializer:
+    """First page of the common feed variants, precomputed in Redis.
+
+    Each feed registers a builder returning (content version, rows) for a variant, plus the
+    list of variants worth keeping (unfiltered and one per common target_gender). A page is
+    served while its version is at least the one the reader got from content_versions, so
+    any write that bumps the feed makes it stale. Rebuilds are single-flight: one caller takes
+    a short Redis lock and queries Postgres, while concurrent misses wait for its page instead
+    of all running the same query. Pages hold viewer-independent columns only; routes add
+    is_owner and friends per request.
+    """
+
+    # Pages of variants nobody asks for anymore eventually go away
+    page_ttl_seconds = 86400
+
+    def __init__(self, redis_url: str = "redis://redis:6379", page_size: int = 50,
+                 lock_seconds: float = 5, wait_seconds: float = 1):
+        self.redis = create_redis(redis_url)
+        self.page_size = page_size
+        self.lock_seconds = lock_seconds
+        self.wait_seconds = wait_seconds
+        self.release_script = self.redis.register_script(RELEASE_SCRIPT)
+        # feed -> (build(limit, **variant) -> (version, rows), variants() -> list[dict])
+        self.feeds = {}
+
+    def register(self, feed: str, build, variants):
+        self.feeds[feed] = (build, variants)
+
+    def key(self, feed: str, variant: dict) -> str:
+        label = ",".join(f"{name}={value}" for name, value in sorted(variant.items()))
+        return f"feed:{feed}:{label or 'all'}"
+
+    def is_materialized(self, feed: str, variant: dict) -> bool:
+        return feed in self.feeds and variant in self.feeds[feed][1]()
+
+    async def get(self, feed: str, variant: dict, version: int) -> dict | None:
+        """{"version", "complete", "rows"} no older than version, or None when the caller
+        should query Postgres itself (variant not materialized, Redis down, rebuild too slow).
+        complete means rows is the whole feed rather than its first page_size items.
+        """
+        if not self.is_materialized(feed, variant):
+            return None
+        key = self.key(feed, variant)
+        try:
+            page = await self.load(key)
+            if page is not None and page["version"] >= version:
+                return page
+            return await self.rebuild(feed, variant, version)
+        except Exception as e:
+            logger.warning(f"Feed page {key} unavailable: {e}")
+            return None
+
+    async def load(self, key: str) -> dict | None:
+        cached = await self.redis.get(key)
+        return json.loads(cached) if cached else None
+
+    async def rebuild(self, feed: str, variant: dict, version: int = 0, wait: bool = True) -> dict | None:
+        key = self.key(feed, variant)
+        lock_key = f"{key}:lock"
+        token = uuid.uuid4().hex
+        if await self.redis.set(lock_key, token, nx=True, px=int(self.lock_seconds * 1000)):
+            try:
+                build = self.feeds[feed][0]
+                built_version, rows = build(self.page_size + 1, **variant)
+                page = {
+                    "version": built_version,
+                    "complete": len(rows) <= self.page_size,
+                    "rows": rows[:self.page_size],
+                }
+                # Round-trip through JSON so the builder and the waiters hand out identical rows
+                payload = to_json(page)
+                await self.redis.set(key, payload, ex=self.page_ttl_seconds)
+                return json.loads(payload)
+            finally:
+                await self.release_script(keys=[lock_key], args=[token])
+        if not wait:
+            return None
+        # Someone else is rebuilding: poll for their page rather than hitting Postgres too
+        give_up_at = time.monotonic() + remaining_seconds(self.wait_seconds)
+        while time.monotonic() < give_up_at:
+            await asyncio.sleep(0.02)
+            page = await self.load(key)
+            if page is not None and page["version"] >= version:
+                return page
+        return None
+
+    async def refresh(self, feed: str):
+        """Rebuild every variant of feed after a write; variants already being rebuilt are skipped"""
+        for variant in self.feeds[feed][1]():
+            try:
+                await self.rebuild(feed, variant, wait=False)
+            except Exception as e:
+                # The write is committed; readers rebuild the stale page themselves
+                logger.warning(f"Failed to refresh {self.key(feed, variant)}: {e}")
+
+    async def warm(self):
+        """Build every page at startup so the first visitors after a deploy or flush hit Redis"""
+        for feed in self.feeds:
+            await self.refresh(feed)
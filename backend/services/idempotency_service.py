@@ -0,0 +1,64 @@
+import asyncio
+import json
+import time
+import uuid
+from services.redis_client import create_redis
+from utils.deadline import remaining_seconds
+
+# Delete the in-flight lock only if this request still holds it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class IdempotencyService:
+    """First responses to requests carrying an Idempotency-Key, kept for ttl_seconds.
+
+    A request claims its key with a short lock before it runs; a duplicate arriving while
+    the first is still running waits for that lock and then replays the stored response.
+    The lock expires after lock_seconds in case the worker dies mid-request.
+    """
+
+    def __init__(self, redis_url: str = "redis://redis:6379", ttl_seconds: int = 86400,
+                 lock_seconds: float = 10):
+        self.redis = create_redis(redis_url)
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.release_script = self.redis.register_script(RELEASE_SCRIPT)
+
+    async def get(self, key: str) -> dict | None:
+        stored = await self.redis.get(key)
+        return json.loads(stored) if stored else None
+
+    async def begin(self, key: str) -> tuple[dict | None, str | None]:
+        """(stored response, None) for a duplicate, (None, lock token) when this request
+        should run, or (None, None) if the first request is still running after waiting"""
+        give_up_at = time.monotonic() + remaining_seconds(self.lock_seconds)
+        while True:
+            stored = await self.get(key)
+            if stored is not None:
+                return stored, None
+            token = uuid.uuid4().hex
+            if await self.redis.set(f"{key}:lock", token, nx=True, px=int(self.lock_seconds * 1000)):
+                # The first request may have stored its response and unlocked since the read above
+                stored = await self.get(key)
+                if stored is not None:
+                    await self.release(key, token)
+                    return stored, None
+                return None, token
+            if time.monotonic() >= give_up_at:
+                return None, None
+            await asyncio.sleep(0.05)
+
+    async def complete(self, key: str, token: str, record: dict | None):
+        """Store record (None: nothing worth replaying) and let waiting duplicates through"""
+        try:
+            if record is not None:
+                await self.redis.set(key, json.dumps(record), ex=self.ttl_seconds)
+        finally:
+            await self.release(key, token)
+
+    async def release(self, key: str, token: str):
+        await self.release_script(keys=[f"{key}:lock"], args=[token])
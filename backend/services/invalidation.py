@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+# Typed invalidation channels. Write paths announce the content_versions keys they bumped on
+# one of these; NOTIFY is transactional, so listeners only hear about committed writes
+POST_CHANGED = "post_changed"
+LIKE_CHANGED = "like_changed"
+MESSAGE_SENT = "message_sent"
+USER_UPDATED = "user_updated"
+CHANNELS = (POST_CHANGED, LIKE_CHANGED, MESSAGE_SENT, USER_UPDATED)
+
+# Postgres rejects payloads of 8000 bytes or more; larger key sets invalidate everything
+MAX_PAYLOAD_BYTES = 7900
+EVERYTHING = "*"
+
+def encode_keys(keys: list[str]) -> str:
+    payload = json.dumps(sorted(set(keys)))
+    return payload if len(payload.encode()) <= MAX_PAYLOAD_BYTES else EVERYTHING
+
+def decode_keys(payload: str) -> list[str] | None:
+    """Keys announced in a notification, or None for "everything" """
+    if payload == EVERYTHING:
+        return None
+    try:
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+class LocalCache:
+    """Per-process cache whose entries are evicted by invalidation notifications.
+
+    It only serves entries while an InvalidationListener it is attached to is connected.
+    Entries also expire after ttl_seconds, which bounds staleness if a notification is lost.
+    Every eviction advances generation: a value read from the database before an eviction
+    may already be stale, so set() drops it.
+    """
+
+    def __init__(self, ttl_seconds: float = 300, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = {}
+        self.generation = 0
+        self.active = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.active and self.ttl_seconds > 0
+
+    def get(self, key: str):
+        if not self.enabled:
+            return None
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires <= time.monotonic():
+            self.entries.pop(key, None)
+            return None
+        return value
+
+    def set(self, key: str, value, generation: int):
+        if not self.enabled or generation != self.generation:
+            return
+        if len(self.entries) >= self.max_entries and key not in self.entries:
+            # Dicts keep insertion order, so this drops the oldest entry
+            self.entries.pop(next(iter(self.entries)), None)
+        self.entries[key] = (value, time.monotonic() + self.ttl_seconds)
+
+    def invalidate(self, keys: list[str] | None):
+        self.generation += 1
+        if keys is None:
+            self.entries.clear()
+            return
+        for key in keys:
+            self.entries.pop(key, None)
+
+class InvalidationListener:
+    """LISTENs on the invalidation channels and hands announced keys to subscribers.
+
+    Runs as a task on the worker's event loop over one dedicated autocommit connection.
+    Notifications sent while it is disconnected are lost, so every (re)connect also tells
+    subscribers to drop everything, and attached caches stay off until it is listening.
+    """
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.handlers = defaultdict(list)
+        self.caches = []
+
+    def attach(self, cache: LocalCache, channels=CHANNELS):
+        """Evict cache on channels, and let it serve entries only while listening"""
+        self.caches.append(cache)
+        for channel in channels:
+            self.subscribe(channel, cache.invalidate)
+
+    def subscribe(self, channel: str, handler):
+        """Call handler(keys) for each notification on channel; keys is None for "everything" """
+        self.handlers[channel].append(handler)
+
+    def dispatch(self, channel: str, keys: list[str] | None):
+        for handler in self.handlers.get(channel, []):
+            try:
+                handler(keys)
+            except Exception as e:
+                logger.warning(f"Invalidation handler for {channel} failed: {e}")
+
+    def dispatch_all(self):
+        for channel in list(self.handlers):
+            self.dispatch(channel, None)
+
+    def set_listening(self, listening: bool):
+        for cache in self.caches:
+            cache.active = listening
+            cache.invalidate(None)
+
+    async def run(self, reconnect_seconds: float = 1.0):
+        loop = asyncio.get_running_loop()
+        while True:
+            conn = None
+            try:
+                conn = await asyncio.to_thread(
+                    psycopg2.connect, self.dsn, connect_timeout=5, keepalives=1, keepalives_idle=30
+                )
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    for channel in self.handlers:
+                        cur.execute(f"LISTEN {channel}")
+                self.dispatch_all()
+                self.set_listening(True)
+                ready = asyncio.Event()
+                loop.add_reader(conn.fileno(), ready.set)
+                try:
+                    while True:
+                        await ready.wait()
+                        ready.clear()
+                        # Raises OperationalError once the server closes the connection
+                        conn.poll()
+                        while conn.notifies:
+                            notification = conn.notifies.pop(0)
+                            self.dispatch(notification.channel, decode_keys(notification.payload))
+                finally:
+                    loop.remove_reader(conn.fileno())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Invalidation listener disconnected: {e}")
+            finally:
+                self.set_listening(False)
+                if conn is not None:
+                    conn.close()
+            await asyncio.sleep(reconnect_seconds)
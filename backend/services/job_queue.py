@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import socket
+import time
+import redis
+from services.redis_client import create_sync_redis
+
+logger = logging.getLogger(__name__)
+
+class JobQueue:
+    """Durable background jobs on a Redis Stream consumed by a consumer group.
+
+    Services enqueue after their transaction commits; workers read new entries with
+    XREADGROUP and XACK them once the handler returns. A failed job stays pending and is
+    reclaimed with XAUTOCLAIM after retry_delay_seconds; once it has been delivered
+    max_attempts times it is moved to the dead-letter stream instead. Handlers therefore
+    run at least once and must be idempotent.
+    """
+
+    def __init__(self, redis_url: str = "redis://redis:6379", stream: str = "jobs",
+                 group: str = "workers", max_attempts: int = 5, retry_delay_seconds: int = 30,
+                 maxlen: int = 100000):
+        # Worker side: XREADGROUP blocks for up to block_ms, so no socket timeout
+        self.redis = redis.from_url(redis_url, decode_responses=True)
+        # Enqueues run inline on the API's event loop, so they get timeouts and the Redis breaker
+        self.producer = create_sync_redis(redis_url)
+        self.stream = stream
+        self.dead_letter_stream = f"{stream}:dead"
+        self.group = group
+        self.max_attempts = max_attempts
+        self.retry_delay_ms = retry_delay_seconds * 1000
+        self.maxlen = maxlen
+        self.handlers = {}
+
+    def enqueue(self, job_type: str, payload: dict) -> str:
+        return self.producer.xadd(
+            self.stream,
+            {"type": job_type, "payload": json.dumps(payload), "enqueued_at": time.time()},
+            maxlen=self.maxlen,
+            approximate=True
+        )
+
+    def register(self, job_type: str, handler):
+        """Handle jobs of job_type with handler(payload) in this process's workers"""
+        self.handlers[job_type] = handler
+
+    def ensure_group(self):
+        try:
+            self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def process(self, message_id: str, fields: dict, attempts: int):
+        job_type = fields.get("type")
+        handler = self.handlers.get(job_type)
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job type {job_type!r}")
+            handler(json.loads(fields["payload"]))
+        except Exception as e:
+            if handler is not None and attempts < self.max_attempts:
+                # Left pending; reclaim() retries it once retry_delay has passed
+                logger.warning(f"Job {message_id} ({job_type}) failed on attempt {attempts}: {e}")
+                return
+            self.dead_letter(message_id, fields, attempts, e)
+            return
+        self.redis.xack(self.stream, self.group, message_id)
+
+    def dead_letter(self, message_id: str, fields: dict, attempts: int, error: Exception):
+        logger.error(f"Job {message_id} ({fields.get('type')}) dead-lettered after {attempts} attempts: {error}")
+        pipe = self.redis.pipeline()
+        pipe.xadd(self.dead_letter_stream, {
+            **fields, "message_id": message_id, "attempts": attempts, "error": str(error)
+        })
+        pipe.xack(self.stream, self.group, message_id)
+        pipe.execute()
+
+    def reclaim(self, consumer: str, count: int = 10):
+        """Take over jobs that failed or whose worker died, and run them again"""
+        messages = self.redis.xautoclaim(
+            self.stream, self.group, consumer, min_idle_time=self.retry_delay_ms, start_id="0-0", count=count
+        )[1]
+        for message_id, fields in messages:
+            if not fields:
+                # Trimmed from the stream while pending; nothing left to run
+                self.redis.xack(self.stream, self.group, message_id)
+                continue
+            pending = self.redis.xpending_range(self.stream, self.group, message_id, message_id, 1)
+            attempts = pending[0]["times_delivered"] if pending else self.max_attempts
+            self.process(message_id, fields, attempts)
+
+    def run_worker(self, consumer: str | None = None, count: int = 10, block_ms: int = 2000):
+        consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.ensure_group()
+        logger.info(f"Job worker {consumer} consuming {self.stream} as {self.group}")
+        while True:
+            try:
+                self.reclaim(consumer, count)
+                entries = self.redis.xreadgroup(
+                    self.group, consumer, {self.stream: ">"}, count=count, block=block_ms
+                )
+                for _, messages in entries or []:
+                    for message_id, fields in messages:
+                        self.process(message_id, fields, attempts=1)
+            except (redis.ConnectionError, redis.TimeoutError) as e:
+                logger.warning(f"Job worker lost Redis connection: {e}")
+                time.sleep(1)
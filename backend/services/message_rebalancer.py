@@ -0,0 +1,111 @@
+import logging
+from collections import defaultdict
+from psycopg2.extensions import parse_dsn
+from psycopg2.extras import execute_values
+from services.database import DatabaseService
+from services.dating_service import DatingService, month_start
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_COLUMNS = [
+    "id", "sender_id", "receiver_id", "dating_post_id", "content", "reply_to_message_id",
+    "created_at", "updated_at", "read_at", "sender_username", "receiver_username"
+]
+
+class MessageRebalancer:
+    """Move dating_messages rows to the shard their conversation hashes to.
+
+    Scans every configured shard, plus extra source databases (the main database from
+    before sharding, or a retired shard), in id order. Misplaced rows are copied to their
+    shard with ON CONFLICT DO NOTHING and committed there before being deleted from the
+    source, so an interrupted run leaves only duplicates, which readers ignore and the next
+    run removes. Edits landing on a row between its copy and delete are lost, so run it
+    while traffic is low.
+    """
+
+    def __init__(self, dating_service: DatingService, source_dsns: list[str] | None = None,
+                 batch_size: int = 1000):
+        self.dating_service = dating_service
+        self.shards = dating_service.messages
+        shard_dsns = {shard.dsn for shard in self.shards.shards}
+        self.sources = list(self.shards.shards) + [
+            DatabaseService(dsn) for dsn in dict.fromkeys(source_dsns or []) if dsn not in shard_dsns
+        ]
+        self.batch_size = batch_size
+
+    def run(self, dry_run: bool = False) -> int:
+        moved = 0
+        for source in self.sources:
+            count = self.rebalance_source(source, dry_run)
+            logger.info(f"{'Would move' if dry_run else 'Moved'} {count} messages out of shard {self.label(source)}")
+            moved += count
+        return moved
+
+    def label(self, database) -> str:
+        # Never log the password part of a DSN
+        return parse_dsn(database.dsn).get("dbname", "?")
+
+    def rebalance_source(self, source, dry_run: bool = False) -> int:
+        moved, last_id = 0, 0
+        while True:
+            rows = self.fetch_batch(source, last_id)
+            if not rows:
+                return moved
+            last_id = rows[-1]['id']
+            by_target = defaultdict(list)
+            for row in rows:
+                target = self.shards.for_conversation(row['dating_post_id'], row['sender_id'], row['receiver_id'])
+                if target.dsn != source.dsn:
+                    by_target[target].append(row)
+            if dry_run:
+                moved += sum(len(batch) for batch in by_target.values())
+                continue
+            for target, batch in by_target.items():
+                self.copy_rows(target, batch)
+            moved_ids = [row['id'] for batch in by_target.values() for row in batch]
+            if moved_ids:
+                self.delete_rows(source, moved_ids)
+            moved += len(moved_ids)
+
+    def fetch_batch(self, source, after_id: int):
+        conn = source.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM dating_messages WHERE id > %s ORDER BY id LIMIT %s",
+                    (after_id, self.batch_size)
+                )
+                return cur.fetchall()
+        finally:
+            conn.rollback()
+            source.put_connection(conn)
+
+    def copy_rows(self, target, rows):
+        conn = target.get_connection()
+        try:
+            with conn.cursor() as cur:
+                months = {month_start(row['created_at'].date()) for row in rows}
+                self.dating_service.create_month_partitions(cur, "dating_messages", months)
+                execute_values(
+                    cur,
+                    f"INSERT INTO dating_messages ({', '.join(MESSAGE_COLUMNS)}) VALUES %s ON CONFLICT DO NOTHING",
+                    [tuple(row[column] for column in MESSAGE_COLUMNS) for row in rows]
+                )
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            target.put_connection(conn)
+
+    def delete_rows(self, source, ids: list[int]):
+        conn = source.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM dating_messages WHERE id = ANY(%s::int[])", (ids,))
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            source.put_connection(conn)
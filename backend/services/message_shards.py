@@ -0,0 +1,48 @@
+import contextvars
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared by every fan-out; each call occupies one thread per shard for one query
+_fan_out_executor = ThreadPoolExecutor(thread_name_prefix="message-shards")
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping & Veach): going from n to n + 1 buckets only moves
+    the keys that land in the new bucket, about 1/(n + 1) of them"""
+    bucket, next_bucket = -1, 0
+    while next_bucket < buckets:
+        bucket = next_bucket
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        next_bucket = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+def conversation_key(dating_post_id: int, user_a: int, user_b: int) -> int:
+    """Stable 64-bit key of the conversation between two users about one dating post"""
+    low, high = sorted((user_a, user_b))
+    digest = hashlib.blake2b(f"{dating_post_id}:{low}:{high}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+class MessageShards:
+    """The databases holding dating_messages, and which one each conversation lives in.
+
+    A conversation (the first message on a dating post plus every reply between the same
+    two users) is kept on one shard, so reply lookups and already_replied checks never cross
+    databases. Shards are services with their own pools; shards[i] owns the conversations
+    whose key jump-hashes to i, so new DSNs must be appended, and rebalance_messages.py
+    moves the conversations that change shard.
+    """
+
+    def __init__(self, shards: list):
+        self.shards = shards
+
+    def for_conversation(self, dating_post_id: int, user_a: int, user_b: int):
+        return self.shards[jump_hash(conversation_key(dating_post_id, user_a, user_b), len(self.shards))]
+
+    def fan_out(self, call) -> list:
+        """call(shard) on every shard concurrently; results come back in shard order"""
+        if len(self.shards) == 1:
+            return [call(self.shards[0])]
+        # copy_context carries the request deadline into the worker threads
+        futures = [
+            _fan_out_executor.submit(contextvars.copy_context().run, call, shard) for shard in self.shards
+        ]
+        return [future.result() for future in futures]
@@ -1,17 +1,144 @@
-import psycopg2
-from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
-
-class PostService:
-    def __init__(self, dsn: str):
-        self.pool = psycopg2.pool.SimpleConnectionPool(1, 20, dsn, cursor_factory=RealDictCursor)
-    
-    def get_connection(self):
-        return self.pool.getconn()
-    
-    def put_connection(self, conn):
-        self.pool.putconn(conn)
+from services.database import DatabaseService, CONTENT_VERSIONS_DDL
+from services.invalidation import LIKE_CHANGED, POST_CHANGED
+from services.statements import PreparedStatement
 
+# Hot fixed-shape statements of like_post, prepared once per connection
+LIKE_EXISTS = PreparedStatement(
+    "like_exists", ["integer", "integer"],
+    "SELECT 1 FROM comment_post_likes WHERE post_id = %s AND user_id = %s"
+)
+POST_OWNER = PreparedStatement("post_owner", ["integer"], "SELECT user_id FROM comment_posts WHERE id = %s")
+INSERT_LIKE = PreparedStatement(
+    "insert_like", ["integer", "integer"],
+    "INSERT INTO comment_post_likes (post_id, user_id) VALUES (%s, %s)"
+)
+HEART_EXISTS = PreparedStatement(
+    "heart_exists", ["integer", "integer"],
+    "SELECT 1 FROM heart_history WHERE post_id = %s AND user_id = %s"
+)
+INSERT_HEART = PreparedStatement(
+    "insert_heart", ["integer", "integer"],
+    "INSERT INTO heart_history (post_id, user_id) VALUES (%s, %s)"
+)
+
+# Incrementally maintained post and like counts per target_app, target_job and
+# target_birth_year, so dashboards never scan comment_posts
+STATS_DDL = """
+    CREATE TABLE IF NOT EXISTS comment_post_stats (
+        dimension VARCHAR(20) NOT NULL,
+        value VARCHAR(100) NOT NULL,
+        posts INTEGER NOT NULL DEFAULT 0,
+        likes INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dimension, value)
+    )
+"""
+STATS_DIMENSIONS = ("target_app", "target_job", "target_birth_year")
+# Every stats row of a post, as (dimension, value)
+POST_DIMENSIONS = """
+    CROSS JOIN LATERAL (VALUES
+        ('target_app', p.target_app),
+        ('target_job', p.target_job),
+        ('target_birth_year', p.target_birth_year::text)
+    ) d(dimension, value)
+"""
+
+# Adds post_sign posts (and post_sign times their like count) plus like_delta likes to the
+# stats rows of the given posts. KEY SHARE waits out an update_post in progress, so a like
+# counts towards the post's new values; stats rows are locked in key order, so concurrent
+# writers touching the same rows queue up instead of deadlocking
+APPLY_STATS = PreparedStatement("apply_post_stats", ["int[]", "integer", "integer", "integer"], f"""
+    WITH locked AS (
+        SELECT id, target_app, target_job, target_birth_year FROM comment_posts
+        WHERE id = ANY(%s) FOR KEY SHARE
+    )
+    INSERT INTO comment_post_stats (dimension, value, posts, likes)
+    SELECT d.dimension, d.value, SUM(%s), SUM(%s * l.likes + %s)
+    FROM locked p
+    CROSS JOIN LATERAL (SELECT COUNT(*) AS likes FROM comment_post_likes WHERE post_id = p.id) l
+    {POST_DIMENSIONS}
+    GROUP BY d.dimension, d.value
+    ORDER BY d.dimension, d.value
+    ON CONFLICT (dimension, value) DO UPDATE
+    SET posts = comment_post_stats.posts + EXCLUDED.posts, likes = comment_post_stats.likes + EXCLUDED.likes
+""")
+
+REBUILD_STATS = f"""
+    INSERT INTO comment_post_stats (dimension, value, posts, likes)
+    SELECT d.dimension, d.value, COUNT(*) AS posts, COALESCE(SUM(l.likes), 0) AS likes
+    FROM comment_posts p
+    LEFT JOIN (SELECT post_id, COUNT(*) AS likes FROM comment_post_likes GROUP BY post_id) l ON l.post_id = p.id
+    {POST_DIMENSIONS}
+    GROUP BY d.dimension, d.value
+"""
+
+def rebuild_stats(cur):
+    """Recount comment_post_stats from scratch, for new installs and bulk loads"""
+    # Writers block until the recount commits, so no delta lands on a row about to be replaced
+    cur.execute("LOCK TABLE comment_post_stats IN EXCLUSIVE MODE")
+    cur.execute("DELETE FROM comment_post_stats")
+    cur.execute(REBUILD_STATS)
+
+USER_POSTS_QUERY = """
+    SELECT p.*, COUNT(pl.user_id) as likes_count
+    FROM comment_posts p
+    LEFT JOIN comment_post_likes pl ON p.id = pl.post_id
+    WHERE p.user_id = %s
+    GROUP BY p.id
+    ORDER BY p.created_at DESC
+"""
+
+# Viewer-independent first page of the feed for FeedMaterializer; likes are counted only for
+# the posts on the page instead of aggregating the whole likes table
+FEED_PAGE_QUERY = """
+    SELECT p.*,
+           (SELECT COUNT(*) FROM comment_post_likes pl WHERE pl.post_id = p.id) as likes_count
+    FROM comment_posts p
+    WHERE %s IS NULL OR p.target_gender = %s
+    ORDER BY p.created_at DESC
+    LIMIT %s
+"""
+
+# get_posts filters: (query param, SQL condition, parameter type, value transform)
+POST_FILTERS = [
+    ("target_gender", "target_gender = %s", "varchar", lambda v: v),
+    ("target_job", "target_job ILIKE %s", "text", lambda v: f"%{v}%"),
+    ("target_birth_year", "target_birth_year = %s", "integer", lambda v: v),
+    ("height_min", "target_height >= %s", "integer", lambda v: v),
+    ("height_max", "target_height <= %s", "integer", lambda v: v),
+    ("target_app", "target_app ILIKE %s", "text", lambda v: f"%{v}%"),
+]
+
+# One prepared statement per filter combination, so each shape keeps its own cached plan
+_get_posts_shapes = {}
+
+def get_posts_statement(active_filters: tuple[str, ...]) -> PreparedStatement:
+    statement = _get_posts_shapes.get(active_filters)
+    if statement is None:
+        query = """
+            SELECT p.*, 
+                   COUNT(pl.user_id) as likes_count,
+                   CASE WHEN %s IS NOT NULL AND EXISTS(
+                       SELECT 1 FROM comment_post_likes WHERE post_id = p.id AND user_id = %s
+                   ) THEN true ELSE false END as user_liked,
+                   CASE WHEN p.user_id = %s THEN true ELSE false END as is_owner
+            FROM comment_posts p
+            LEFT JOIN comment_post_likes pl ON p.id = pl.post_id
+            WHERE 1=1
+        """
+        param_types = ["integer", "integer", "integer"]
+        for name, condition, param_type, _ in POST_FILTERS:
+            if name in active_filters:
+                query += f" AND {condition}"
+                param_types.append(param_type)
+        # LIMIT NULL returns every row
+        query += " GROUP BY p.id ORDER BY p.created_at DESC LIMIT %s OFFSET %s"
+        param_types += ["bigint", "bigint"]
+        suffix = "_".join(active_filters) or "all"
+        statement = PreparedStatement(f"get_posts_{suffix}", param_types, query)
+        _get_posts_shapes[active_filters] = statement
+    return statement
+
+class PostService(DatabaseService):
     def create_post(self, user_id: int, target_gender: str, target_job: str, 
                    target_birth_year: int, target_height: int, target_app: str, comment: str):
         conn = self.get_connection()
@@ -28,7 +155,10 @@ class PostService:
                     (user_id, target_gender, target_job, target_birth_year, target_height, target_app, comment),
                 )
                 post = cur.fetchone()
+                self.apply_stats(cur, [post['id']], post_sign=1)
+                self.bump_versions(cur, ["comment_posts", f"profile:{user_id}"], POST_CHANGED)
                 conn.commit()
+                self.enqueue("refresh_feed", {"feed": "comment_posts"})
                 return post
         except Exception as e:
             conn.rollback()
@@ -36,57 +166,77 @@ class PostService:
         finally:
             self.put_connection(conn)
 
-    def get_posts(self, filters=None, user_id=None):
-        conn = self.get_connection()
+    def get_posts(self, filters=None, user_id=None, use_primary: bool = False,
+                  limit: int | None = None, offset: int = 0):
+        conn = self.get_read_connection(use_primary)
         try:
             with conn.cursor() as cur:
-                query = """
-                    SELECT p.*, 
-                           COUNT(pl.user_id) as likes_count,
-                           CASE WHEN %s IS NOT NULL AND EXISTS(
-                               SELECT 1 FROM comment_post_likes WHERE post_id = p.id AND user_id = %s
-                           ) THEN true ELSE false END as user_liked,
-                           CASE WHEN p.user_id = %s THEN true ELSE false END as is_owner
-                    FROM comment_posts p
-                    LEFT JOIN comment_post_likes pl ON p.id = pl.post_id
-                    WHERE 1=1
-                """
+                filters = filters or {}
+                active = tuple(name for name, _, _, _ in POST_FILTERS if filters.get(name))
                 params = [user_id, user_id, user_id]
-                
-                if filters:
-                    if filters.get('target_gender'):
-                        query += " AND target_gender = %s"
-                        params.append(filters['target_gender'])
-                    if filters.get('target_job'):
-                        query += " AND target_job ILIKE %s"
-                        params.append(f"%{filters['target_job']}%")
-                    if filters.get('target_birth_year'):
-                        query += " AND target_birth_year = %s"
-                        params.append(filters['target_birth_year'])
-                    if filters.get('height_min'):
-                        query += " AND target_height >= %s"
-                        params.append(filters['height_min'])
-                    if filters.get('height_max'):
-                        query += " AND target_height <= %s"
-                        params.append(filters['height_max'])
-                    if filters.get('target_app'):
-                        query += " AND target_app ILIKE %s"
-                        params.append(f"%{filters['target_app']}%")
-                
-                query += " GROUP BY p.id ORDER BY p.created_at DESC"
-                cur.execute(query, params)
+                params += [transform(filters[name]) for name, _, _, transform in POST_FILTERS if name in active]
+                params += [limit, offset]
+                get_posts_statement(active).execute(cur, params)
                 return cur.fetchall()
         except Exception as e:
             raise e
         finally:
             self.put_connection(conn)
 
+    def get_feed_page(self, limit: int, target_gender: str | None = None):
+        """(comment_posts version, first limit posts), the version read first so it is never newer than the rows"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT version FROM content_versions WHERE key = 'comment_posts'")
+                version = cur.fetchone()
+                cur.execute(FEED_PAGE_QUERY, (target_gender, target_gender, limit))
+                return (version['version'] if version else 0), cur.fetchall()
+        except Exception as e:
+            raise e
+        finally:
+            self.put_connection(conn)
+
+    def add_viewer_fields(self, posts, user_id=None, use_primary: bool = False):
+        """user_liked and is_owner for materialized feed rows, as get_posts computes them"""
+        liked = set()
+        if user_id is not None and posts:
+            conn = self.get_read_connection(use_primary)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT post_id FROM comment_post_likes WHERE user_id = %s AND post_id = ANY(%s::int[])",
+                        (user_id, [post['id'] for post in posts])
+                    )
+                    liked = {row['post_id'] for row in cur.fetchall()}
+            except Exception as e:
+                raise e
+            finally:
+                self.put_connection(conn)
+        for post in posts:
+            post['user_liked'] = post['id'] in liked
+            post['is_owner'] = post['user_id'] == user_id
+        return posts
+
     def update_post(self, post_id: int, user_id: int, target_gender: str, target_job: str,
                    target_birth_year: int, target_height: int, target_app: str, comment: str):
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
-
+                # FOR UPDATE holds off likes and unlikes of this post (both take KEY SHARE), so the
+                # like count moved between stats rows below stays exact
+                cur.execute(
+                    """
+                    SELECT target_app, target_job, target_birth_year FROM comment_posts
+                    WHERE id = %s AND user_id = %s FOR UPDATE
+                    """,
+                    (post_id, user_id)
+                )
+                before = cur.fetchone()
+                moved = before is not None and (before['target_app'], before['target_job'],
+                                                before['target_birth_year']) != (target_app, target_job, target_birth_year)
+                if moved:
+                    self.apply_stats(cur, [post_id], post_sign=-1)
                 cur.execute(
                     """
                     UPDATE comment_posts SET target_gender=%s, target_job=%s, target_birth_year=%s,
@@ -98,7 +248,13 @@ class PostService:
                     (target_gender, target_job, target_birth_year, target_height, target_app, comment, post_id, user_id),
                 )
                 post = cur.fetchone()
+                if moved:
+                    self.apply_stats(cur, [post_id], post_sign=1)
+                if post:
+                    self.bump_versions(cur, ["comment_posts", f"profile:{user_id}"], POST_CHANGED)
                 conn.commit()
+                if post:
+                    self.enqueue("refresh_feed", {"feed": "comment_posts"})
                 return post
         except Exception as e:
             conn.rollback()
@@ -111,42 +267,31 @@ class PostService:
         try:
             with conn.cursor() as cur:
                 # Check if already liked
-                cur.execute(
-                    "SELECT 1 FROM comment_post_likes WHERE post_id = %s AND user_id = %s",
-                    (post_id, user_id)
-                )
+                LIKE_EXISTS.execute(cur, (post_id, user_id))
                 if cur.fetchone():
                     return False  # Already liked
                 
                 # Get post owner
-                cur.execute("SELECT user_id FROM comment_posts WHERE id = %s", (post_id,))
+                POST_OWNER.execute(cur, (post_id,))
                 post = cur.fetchone()
                 if not post:
                     return False
                 
                 # Insert like
-                cur.execute(
-                    "INSERT INTO comment_post_likes (post_id, user_id) VALUES (%s, %s)",
-                    (post_id, user_id)
-                )
+                INSERT_LIKE.execute(cur, (post_id, user_id))
                 
                 # Check if this user has ever given a heart to this post
-                cur.execute(
-                    "SELECT 1 FROM heart_history WHERE post_id = %s AND user_id = %s",
-                    (post_id, user_id)
-                )
-                if not cur.fetchone():
-                    # First time giving heart to this post, increment hearts and record it
-                    cur.execute(
-                        "INSERT INTO heart_history (post_id, user_id) VALUES (%s, %s)",
-                        (post_id, user_id)
-                    )
-                    cur.execute(
-                        "UPDATE users SET hearts = hearts + 1 WHERE id = %s",
-                        (post['user_id'],)
-                    )
+                HEART_EXISTS.execute(cur, (post_id, user_id))
+                hearted = cur.fetchone() is None
+                if hearted:
+                    # First time giving heart to this post; the owner's total is synced in the background
+                    INSERT_HEART.execute(cur, (post_id, user_id))
                 
+                self.apply_stats(cur, [post_id], like_delta=1)
+                self.bump_versions(cur, ["comment_posts", f"profile:{post['user_id']}"], LIKE_CHANGED)
                 conn.commit()
+                if hearted:
+                    self.enqueue("sync_hearts", {"user_ids": [post['user_id']]})
                 return True
         except Exception as e:
             conn.rollback()
@@ -154,36 +299,126 @@ class PostService:
         finally:
             self.put_connection(conn)
 
-    def unlike_post(self, post_id: int, user_id: int):
+    def unlike_post(self, post_id: int, user_id: int) -> float | None:
+        """Remove the like; returns when it was made (Unix time), or None if there was none"""
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
                 cur.execute(
-                    "DELETE FROM comment_post_likes WHERE post_id = %s AND user_id = %s",
+                    """
+                    DELETE FROM comment_post_likes pl USING comment_posts p
+                    WHERE pl.post_id = p.id AND pl.post_id = %s AND pl.user_id = %s
+                    RETURNING p.user_id, EXTRACT(EPOCH FROM COALESCE(pl.created_at::timestamptz, now()))::float8 AS liked_at
+                    """,
                     (post_id, user_id)
                 )
+                post = cur.fetchone()
+                if post:
+                    self.apply_stats(cur, [post_id], like_delta=-1)
+                    self.bump_versions(cur, ["comment_posts", f"profile:{post['user_id']}"], LIKE_CHANGED)
                 conn.commit()
-                return cur.rowcount > 0
+                return post['liked_at'] if post else None
         except Exception as e:
             conn.rollback()
             raise e
         finally:
             self.put_connection(conn)
 
-    def get_user_posts(self, user_id: int):
+    def like_posts(self, post_ids: list[int], user_id: int):
+        """Like many posts in one statement; returns [{post_id, liked}] in request order"""
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
                 cur.execute(
                     """
-                    SELECT p.*, COUNT(pl.user_id) as likes_count
+                    WITH requested AS (
+                        SELECT DISTINCT unnest(%s::int[]) AS post_id
+                    ),
+                    inserted AS (
+                        INSERT INTO comment_post_likes (post_id, user_id)
+                        SELECT p.id, %s FROM comment_posts p JOIN requested r ON r.post_id = p.id
+                        ON CONFLICT DO NOTHING
+                        RETURNING post_id
+                    ),
+                    hearted AS (
+                        -- Hearts are only awarded the first time a user ever likes a post
+                        INSERT INTO heart_history (post_id, user_id)
+                        SELECT post_id, %s FROM inserted
+                        ON CONFLICT DO NOTHING
+                        RETURNING post_id
+                    )
+                    SELECT r.post_id, i.post_id IS NOT NULL AS liked, p.user_id AS owner_id,
+                           h.post_id IS NOT NULL AS hearted
+                    FROM requested r
+                    LEFT JOIN inserted i ON i.post_id = r.post_id
+                    LEFT JOIN hearted h ON h.post_id = r.post_id
+                    LEFT JOIN comment_posts p ON p.id = i.post_id
+                    """,
+                    (post_ids, user_id, user_id)
+                )
+                rows = cur.fetchall()
+                results = {row['post_id']: row['liked'] for row in rows}
+                owners = {row['owner_id'] for row in rows if row['liked']}
+                if owners:
+                    self.apply_stats(cur, [row['post_id'] for row in rows if row['liked']], like_delta=1)
+                    self.bump_versions(cur, ["comment_posts"] + [f"profile:{owner}" for owner in owners], LIKE_CHANGED)
+                conn.commit()
+                hearted_owners = sorted({row['owner_id'] for row in rows if row['hearted']})
+                if hearted_owners:
+                    self.enqueue("sync_hearts", {"user_ids": hearted_owners})
+                return [{"post_id": post_id, "liked": results[post_id]} for post_id in post_ids]
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            self.put_connection(conn)
+
+    def unlike_posts(self, post_ids: list[int], user_id: int):
+        """Unlike many posts in one statement; returns [{post_id, unliked}] in request order
+        and {post_id: when the removed like was made (Unix time)}"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    DELETE FROM comment_post_likes pl USING comment_posts p
+                    WHERE pl.post_id = p.id AND pl.user_id = %s AND pl.post_id = ANY(%s::int[])
+                    RETURNING pl.post_id, p.user_id AS owner_id,
+                              EXTRACT(EPOCH FROM COALESCE(pl.created_at::timestamptz, now()))::float8 AS liked_at
+                    """,
+                    (user_id, post_ids)
+                )
+                rows = cur.fetchall()
+                liked_at = {row['post_id']: row['liked_at'] for row in rows}
+                if rows:
+                    self.apply_stats(cur, list(liked_at), like_delta=-1)
+                    self.bump_versions(cur, ["comment_posts"] + [f"profile:{row['owner_id']}" for row in rows], LIKE_CHANGED)
+                conn.commit()
+                return [{"post_id": post_id, "unliked": post_id in liked_at} for post_id in post_ids], liked_at
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            self.put_connection(conn)
+
+    def get_posts_by_ids(self, post_ids: list[int], user_id=None, use_primary: bool = False):
+        conn = self.get_read_connection(use_primary)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT p.*, 
+                           COUNT(pl.user_id) as likes_count,
+                           CASE WHEN %s IS NOT NULL AND EXISTS(
+                               SELECT 1 FROM comment_post_likes WHERE post_id = p.id AND user_id = %s
+                           ) THEN true ELSE false END as user_liked,
+                           CASE WHEN p.user_id = %s THEN true ELSE false END as is_owner
                     FROM comment_posts p
                     LEFT JOIN comment_post_likes pl ON p.id = pl.post_id
-                    WHERE p.user_id = %s
+                    WHERE p.id = ANY(%s::int[])
                     GROUP BY p.id
-                    ORDER BY p.created_at DESC
                     """,
-                    (user_id,)
+                    (user_id, user_id, user_id, post_ids)
                 )
                 return cur.fetchall()
         except Exception as e:
@@ -191,10 +426,57 @@ class PostService:
         finally:
             self.put_connection(conn)
 
+    def apply_stats(self, cur, post_ids: list[int], post_sign: int = 0, like_delta: int = 0):
+        """Adjust comment_post_stats inside the caller's write transaction"""
+        APPLY_STATS.execute(cur, (post_ids, post_sign, post_sign, like_delta))
+
+    def get_stats(self, dimensions=STATS_DIMENSIONS, limit: int = 100, use_primary: bool = False):
+        """{dimension: [{value, posts, likes}]} with the most posted values first"""
+        conn = self.get_read_connection(use_primary)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT dimension, value, posts, likes FROM (
+                        SELECT s.*, ROW_NUMBER() OVER (
+                            PARTITION BY dimension ORDER BY posts DESC, likes DESC, value
+                        ) AS rank
+                        FROM comment_post_stats s
+                        WHERE dimension = ANY(%s::varchar[]) AND posts > 0
+                    ) ranked
+                    WHERE rank <= %s
+                    ORDER BY dimension, rank
+                    """,
+                    (list(dimensions), limit)
+                )
+                stats = {dimension: [] for dimension in dimensions}
+                for row in cur.fetchall():
+                    stats[row['dimension']].append({"value": row['value'], "posts": row['posts'], "likes": row['likes']})
+                return stats
+        except Exception as e:
+            raise e
+        finally:
+            self.put_connection(conn)
+
+    def get_user_posts(self, user_id: int, use_primary: bool = False):
+        conn = self.get_read_connection(use_primary)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(USER_POSTS_QUERY, (user_id,))
+                return cur.fetchall()
+        except Exception as e:
+            raise e
+        finally:
+            self.put_connection(conn)
+
+    def iter_user_posts(self, user_id: int, batch_size: int = 500):
+        return self.stream_query(USER_POSTS_QUERY, (user_id,), batch_size)
+
     def init_db(self):
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
+                cur.execute(CONTENT_VERSIONS_DDL)
                 cur.execute("""
                     CREATE TABLE IF NOT EXISTS comment_posts (
                         id SERIAL PRIMARY KEY,
@@ -230,6 +512,11 @@ class PostService:
                         PRIMARY KEY (post_id, user_id)
                     )
                 """)
+                cur.execute("SELECT to_regclass('comment_post_stats') AS existing")
+                missing = cur.fetchone()['existing'] is None
+                cur.execute(STATS_DDL)
+                if missing:
+                    rebuild_stats(cur)
                 conn.commit()
         finally:
             self.put_connection(conn)
\ No newline at end of file
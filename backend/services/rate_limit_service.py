@@ -0,0 +1,43 @@
+from services.redis_client import create_redis
+
+# Refill and take cost tokens in a single round trip so concurrent workers never race.
+# Uses the Redis clock, so app hosts with skewed clocks share one consistent bucket.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * refill_rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = math.ceil((cost - tokens) / refill_rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill_rate) + 1)
+return {allowed, retry_after}
+"""
+
+class RateLimitService:
+    def __init__(self, redis_url: str = "redis://redis:6379"):
+        self.redis = create_redis(redis_url)
+        self.token_bucket = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def acquire(self, route: str, identity: str, capacity: int, period_seconds: int,
+                      cost: int = 1) -> tuple[bool, int]:
+        """Take cost tokens (at most capacity) from the bucket; returns (allowed, retry_after_seconds)"""
+        allowed, retry_after = await self.token_bucket(
+            keys=[f"rate_limit:{route}:{identity}"],
+            args=[capacity, capacity / period_seconds, cost],
+        )
+        return bool(allowed), int(retry_after)
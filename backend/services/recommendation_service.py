@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+GENDER_CODES = {"Male": 1, "Female": 2}
+
+# Score = gender match + age fit + recency + poster popularity. Recency is linear in the
+# post's absolute timestamp, so relative order never changes as time passes and cached
+# top-K lists stay exact when new posts are merged in.
+GENDER_MATCH_WEIGHT = 3.0
+GENDER_ANY_WEIGHT = 1.0
+AGE_FIT_WEIGHT = 2.0
+AGE_MISS_PENALTY = 0.5  # per year outside the wanted range
+RECENCY_WEIGHT_PER_DAY = 0.2
+RECENCY_EPOCH = 1_700_000_000  # fixed origin keeps scores small without changing their order
+HEARTS_WEIGHT = 0.5
+
+class RecommendationService:
+    """Ranks dating posts for a viewer from compact in-memory columns.
+
+    Candidate attributes live in parallel NumPy arrays so a request scores every
+    candidate with a handful of vector operations. Per-viewer top-K lists are cached (the
+    cache_size most recently used) and posts appended since a list was computed are merged
+    into it when it is next read, instead of recomputing from scratch.
+    """
+
+    def __init__(self, top_k: int = 50, cache_size: int = 10000):
+        self.top_k = top_k
+        self.cache_size = cache_size
+        self.post_ids = np.empty(0, dtype=np.int64)
+        self.user_ids = np.empty(0, dtype=np.int64)
+        self.genders = np.empty(0, dtype=np.int8)
+        self.age_min = np.empty(0, dtype=np.int16)
+        self.age_max = np.empty(0, dtype=np.int16)
+        self.created = np.empty(0, dtype=np.float64)
+        self.hearts = np.empty(0, dtype=np.float32)
+        self.hearts_by_user = {}
+        # (viewer_id, gender_code, age) -> (post_ids, scores best first, candidates scored), LRU order
+        self.cache = OrderedDict()
+
+    @staticmethod
+    def _columns(rows):
+        return (
+            np.fromiter((row['id'] for row in rows), dtype=np.int64, count=len(rows)),
+            np.fromiter((row['user_id'] for row in rows), dtype=np.int64, count=len(rows)),
+            np.fromiter((GENDER_CODES.get(row['target_gender'], 0) for row in rows), dtype=np.int8, count=len(rows)),
+            np.fromiter((row['target_age_min'] for row in rows), dtype=np.int16, count=len(rows)),
+            np.fromiter((row['target_age_max'] for row in rows), dtype=np.int16, count=len(rows)),
+            np.fromiter((row['created_at'].timestamp() for row in rows), dtype=np.float64, count=len(rows)),
+            np.fromiter((row.get('hearts') or 0 for row in rows), dtype=np.float32, count=len(rows)),
+        )
+
+    def _prepare(self, rows):
+        return self._columns(rows), {row['user_id']: row.get('hearts') or 0 for row in rows}
+
+    def _install(self, columns, hearts_by_user):
+        (self.post_ids, self.user_ids, self.genders, self.age_min,
+         self.age_max, self.created, self.hearts) = columns
+        self.hearts_by_user = hearts_by_user
+        self.cache = OrderedDict()
+
+    def load(self, rows):
+        """Replace all candidates, e.g. from DatingService.get_recommendation_candidates"""
+        self._install(*self._prepare(rows))
+
+    def add_post(self, post):
+        """Append a newly created post; cached lists pick it up when next read"""
+        post = dict(post, hearts=self.hearts_by_user.get(post['user_id'], 0))
+        self._append(self._columns([post]))
+
+    def _append(self, columns):
+        (self.post_ids, self.user_ids, self.genders, self.age_min,
+         self.age_max, self.created, self.hearts) = (
+            np.concatenate([current, new]) for current, new in zip(self._all_columns(), columns)
+        )
+
+    def _all_columns(self):
+        return (self.post_ids, self.user_ids, self.genders, self.age_min,
+                self.age_max, self.created, self.hearts)
+
+    def _score(self, columns, viewer_id: int, gender_code: int, age: int):
+        _, user_ids, genders, age_min, age_max, created, hearts = columns
+        score = np.where(genders == gender_code, GENDER_MATCH_WEIGHT, 0.0)
+        score += np.where(genders == 0, GENDER_ANY_WEIGHT, 0.0)
+        years_outside = np.maximum(age_min - age, 0) + np.maximum(age - age_max, 0)
+        score += np.where(years_outside == 0, AGE_FIT_WEIGHT, -AGE_MISS_PENALTY * years_outside)
+        score += RECENCY_WEIGHT_PER_DAY * (created - RECENCY_EPOCH) / 86400.0
+        score += HEARTS_WEIGHT * np.log1p(hearts)
+        # Never recommend the viewer's own posts
+        score[user_ids == viewer_id] = -np.inf
+        return score
+
+    def _top(self, post_ids, scores):
+        keep = np.isfinite(scores)
+        post_ids, scores = post_ids[keep], scores[keep]
+        if len(scores) > self.top_k:
+            candidates = np.argpartition(-scores, self.top_k)[:self.top_k]
+        else:
+            candidates = np.arange(len(scores))
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return post_ids[order], scores[order]
+
+    def recommend(self, viewer_id: int, gender: str | None, age: int, limit: int = 20):
+        gender_code = GENDER_CODES.get(gender, -1)
+        key = (viewer_id, gender_code, age)
+        cached = self.cache.get(key)
+        scored = len(self.post_ids)
+        if cached is None:
+            post_ids, scores = self._top(self.post_ids, self._score(self._all_columns(), viewer_id, gender_code, age))
+        else:
+            post_ids, scores, cached_upto = cached
+            if cached_upto < scored:
+                new_columns = tuple(column[cached_upto:] for column in self._all_columns())
+                post_ids, scores = self._top(
+                    np.concatenate([post_ids, new_columns[0]]),
+                    np.concatenate([scores, self._score(new_columns, viewer_id, gender_code, age)])
+                )
+        self.cache[key] = (post_ids, scores, scored)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return [
+            {"post_id": int(post_id), "score": round(float(score), 4)}
+            for post_id, score in zip(post_ids[:limit], scores[:limit])
+        ]
+
+    async def run_refresh_loop(self, dating_service, window_days: int, interval_seconds: int):
+        """Periodically reload candidates so poster hearts and posts from other workers are picked up.
+
+        The query and column building run in a thread; only the swap happens on the event loop.
+        """
+        while True:
+            try:
+                known = len(self.post_ids)
+                prepared = await asyncio.to_thread(
+                    lambda: self._prepare(dating_service.get_recommendation_candidates(window_days))
+                )
+                # Posts created here while the query ran may be missing from its snapshot
+                added = tuple(column[known:] for column in self._all_columns())
+                self._install(*prepared)
+                missing = ~np.isin(added[0], self.post_ids)
+                if missing.any():
+                    self._append(tuple(column[missing] for column in added))
+            except Exception as e:
+                logger.warning(f"Recommendation refresh failed: {e}")
+            await asyncio.sleep(interval_seconds)
@@ -0,0 +1,71 @@
+import asyncio
+import redis as sync_redis
+import redis.asyncio as redis
+from redis.exceptions import RedisError, ResponseError
+from utils.circuit_breaker import CircuitBreaker
+from utils.deadline import remaining_seconds
+from config import settings
+
+# Shared by every async Redis client in the worker: sessions, rate limits, trending, unread
+redis_breaker = CircuitBreaker("redis", settings.circuit_failure_threshold, settings.circuit_reset_seconds)
+
+class DeadlineRedis(redis.Redis):
+    """Redis client whose commands are bounded by the request deadline and the circuit breaker"""
+
+    operation_timeout: float = settings.redis_timeout_ms / 1000
+
+    async def execute_command(self, *args, **options):
+        redis_breaker.allow()
+        budget = remaining_seconds(self.operation_timeout)
+        try:
+            async with asyncio.timeout(budget):
+                result = await super().execute_command(*args, **options)
+        except ResponseError:
+            # Redis answered; the command or script was at fault
+            raise
+        except TimeoutError:
+            # Cut short by the request's own deadline, not by a slow Redis
+            if budget >= self.operation_timeout:
+                redis_breaker.record_failure()
+            raise
+        except RedisError:
+            redis_breaker.record_failure()
+            raise
+        redis_breaker.record_success()
+        return result
+
+class DeadlineSyncRedis(sync_redis.Redis):
+    """Blocking counterpart for callers on the event loop thread, like job enqueues.
+
+    The socket timeouts bound each command to REDIS_TIMEOUT_MS, and the command is not sent
+    at all once the request deadline has passed or while the breaker is open.
+    """
+
+    def execute_command(self, *args, **options):
+        redis_breaker.allow()
+        remaining_seconds()
+        try:
+            result = super().execute_command(*args, **options)
+        except ResponseError:
+            raise
+        except RedisError:
+            redis_breaker.record_failure()
+            raise
+        redis_breaker.record_success()
+        return result
+
+def create_redis(redis_url: str) -> DeadlineRedis:
+    return DeadlineRedis.from_url(
+        redis_url,
+        decode_responses=True,
+        socket_connect_timeout=settings.redis_timeout_ms / 1000,
+        socket_timeout=settings.redis_timeout_ms / 1000
+    )
+
+def create_sync_redis(redis_url: str) -> DeadlineSyncRedis:
+    return DeadlineSyncRedis.from_url(
+        redis_url,
+        decode_responses=True,
+        socket_connect_timeout=settings.redis_timeout_ms / 1000,
+        socket_timeout=settings.redis_timeout_ms / 1000
+    )
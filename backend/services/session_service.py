@@ -1,11 +1,14 @@
 import uuid
-import redis.asyncio as redis
+from services.redis_client import create_redis
 from datetime import timedelta
 
 class SessionService:
-    def __init__(self, redis_url: str = "redis://redis:6379", expire_minutes: int = 30):
-        self.redis = redis.from_url(redis_url, decode_responses=True)
+    def __init__(self, redis_url: str = "redis://redis:6379", expire_minutes: int = 30,
+                 read_your_writes_seconds: int = 5):
+        self.redis = create_redis(redis_url)
         self.expire_seconds = expire_minutes * 60
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self.cookie_max_age = 1440 * 60
 
     async def create_session(self, user_id: int) -> str:
         session_id = str(uuid.uuid4())
@@ -20,5 +23,16 @@ class SessionService:
             return int(user_id)
         return None
 
+    def refresh(self, session_id: str) -> str | None:
+        """A replacement cookie value when the session needs re-issuing; Redis sessions slide in get_user_id"""
+        return None
+
     async def delete_session(self, session_id: str):
         await self.redis.delete(f"session:{session_id}")
+
+    async def mark_write(self, session_id: str):
+        # Pin this session's reads to the primary until replicas have caught up
+        await self.redis.setex(f"session_write:{session_id}", self.read_your_writes_seconds, 1)
+
+    async def has_recent_write(self, session_id: str) -> bool:
+        return bool(await self.redis.exists(f"session_write:{session_id}"))
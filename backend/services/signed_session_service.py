@@ -0,0 +1,107 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+from services.session_service import SessionService
+
+logger = logging.getLogger(__name__)
+
+class SignedSessionService(SessionService):
+    """Stateless sessions: the cookie carries "user_id.session_id.expires.signature".
+
+    Tokens are verified with HMAC-SHA256 in-process, so authenticated requests need no
+    Redis read. They live for ttl_seconds and are re-issued once half of that has passed,
+    keeping the same session id. Logout adds the session id to a Redis sorted set scored by
+    the latest moment a token of that session could still be valid; every worker mirrors
+    the live entries into memory from run_revocation_sync_loop.
+    """
+
+    revoked_key = "revoked_sessions"
+
+    def __init__(self, secret: str, redis_url: str = "redis://redis:6379", ttl_seconds: int = 900,
+                 read_your_writes_seconds: int = 5):
+        if not secret:
+            raise ValueError("SESSION_SECRET is required for signed sessions")
+        super().__init__(redis_url, ttl_seconds // 60, read_your_writes_seconds)
+        self.secret = secret.encode()
+        self.ttl_seconds = ttl_seconds
+        self.cookie_max_age = ttl_seconds
+        self.revoked = set()
+
+    def _sign(self, payload: str) -> str:
+        digest = hmac.new(self.secret, payload.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+    def _issue(self, user_id: int, session_id: str) -> str:
+        payload = f"{user_id}.{session_id}.{int(time.time()) + self.ttl_seconds}"
+        return f"{payload}.{self._sign(payload)}"
+
+    def _parse(self, token: str) -> tuple[int, str, int] | None:
+        """(user_id, session_id, expires) of a correctly signed token, expired or not"""
+        try:
+            payload, signature = token.rsplit(".", 1)
+            user_id, session_id, expires = payload.split(".")
+            if not hmac.compare_digest(signature, self._sign(payload)):
+                return None
+            return int(user_id), session_id, int(expires)
+        except ValueError:
+            return None
+
+    def _verify(self, token: str) -> tuple[int, str, int] | None:
+        parsed = self._parse(token)
+        if parsed is None or parsed[2] <= time.time() or parsed[1] in self.revoked:
+            return None
+        return parsed
+
+    async def create_session(self, user_id: int) -> str:
+        return self._issue(user_id, secrets.token_urlsafe(12))
+
+    async def get_user_id(self, session_id: str) -> int | None:
+        verified = self._verify(session_id)
+        return verified[0] if verified else None
+
+    def refresh(self, session_id: str) -> str | None:
+        verified = self._verify(session_id)
+        if not verified:
+            return None
+        user_id, sid, expires = verified
+        if expires - time.time() > self.ttl_seconds / 2:
+            return None
+        return self._issue(user_id, sid)
+
+    async def delete_session(self, session_id: str):
+        parsed = self._parse(session_id)
+        if parsed is None:
+            return
+        sid = parsed[1]
+        self.revoked.add(sid)
+        now = time.time()
+        # A refresh just before logout can push validity out by at most one ttl
+        await self.redis.zadd(self.revoked_key, {sid: now + self.ttl_seconds})
+        await self.redis.zremrangebyscore(self.revoked_key, "-inf", now)
+
+    def _session_key(self, session_id: str) -> str:
+        # Key read-your-writes windows by session id so they survive token refreshes
+        parsed = self._parse(session_id)
+        return parsed[1] if parsed else session_id
+
+    async def mark_write(self, session_id: str):
+        await super().mark_write(self._session_key(session_id))
+
+    async def has_recent_write(self, session_id: str) -> bool:
+        return await super().has_recent_write(self._session_key(session_id))
+
+    async def sync_revocations(self):
+        self.revoked = set(await self.redis.zrangebyscore(self.revoked_key, time.time(), "+inf"))
+
+    async def run_revocation_sync_loop(self, interval_seconds: float):
+        while True:
+            try:
+                await self.sync_revocations()
+            except Exception as e:
+                # Keep enforcing the last known set until Redis is back
+                logger.warning(f"Revocation sync failed: {e}")
+            await asyncio.sleep(interval_seconds)
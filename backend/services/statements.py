@@ -0,0 +1,40 @@
+import itertools
+import re
+import psycopg2.extensions
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Connection that remembers which statements are already prepared in its session"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+        # Set while a transactional UnitOfWork owns the connection; it commits at the end instead
+        self.defer_commit = False
+
+    def commit(self):
+        if not self.defer_commit:
+            super().commit()
+
+class PreparedStatement:
+    """A fixed-shape query that is PREPAREd once per connection and then run with EXECUTE.
+
+    The SQL is written with %s placeholders like the rest of the services; they are turned
+    into $1..$n for PREPARE. Parameter types are explicit so expressions such as
+    `%s IS NOT NULL` still resolve when the statement is planned without values.
+    """
+
+    def __init__(self, name: str, param_types: list[str], sql: str):
+        counter = itertools.count(1)
+        self.name = name
+        self.sql = sql
+        self.prepare_sql = f"PREPARE {name} ({', '.join(param_types)}) AS " + re.sub(
+            r"%s", lambda _: f"${next(counter)}", sql
+        )
+        self.execute_sql = f"EXECUTE {name}" + (f" ({', '.join(['%s'] * len(param_types))})" if param_types else "")
+
+    def execute(self, cur, params=()):
+        conn = cur.connection
+        if self.name not in conn.prepared_statements:
+            cur.execute(self.prepare_sql)
+            conn.prepared_statements.add(self.name)
+        cur.execute(self.execute_sql, params)
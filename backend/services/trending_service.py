@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from services.redis_client import create_redis
+
+logger = logging.getLogger(__name__)
+
+# Forward decay: a like at time t adds 2^((t - epoch) / half_life), so newer likes weigh more
+# without ever rewriting old scores. Ranking is unaffected by the epoch; the decay task only
+# rebases scores (divides by the accrued factor) to keep them from growing without bound.
+# An unlike passes the time of the removed like (ARGV[4]) and takes back exactly what that
+# like added under the current epoch; scores never go below zero.
+RECORD_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local epoch = tonumber(redis.call('GET', KEYS[2]))
+if not epoch then
+    epoch = now
+    redis.call('SET', KEYS[2], tostring(now))
+end
+local at = math.min(tonumber(ARGV[4]) or now, now)
+local weight = tonumber(ARGV[2]) * math.pow(2, (at - epoch) / tonumber(ARGV[3]))
+local score = tonumber(redis.call('ZINCRBY', KEYS[1], weight, ARGV[1]))
+if score <= 0 then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    return '0'
+end
+return tostring(score)
+"""
+
+DECAY_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local epoch = tonumber(redis.call('GET', KEYS[2])) or now
+local factor = math.pow(2, (now - epoch) / tonumber(ARGV[1]))
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('ZUNIONSTORE', KEYS[1], 1, KEYS[1], 'WEIGHTS', 1 / factor)
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -(tonumber(ARGV[3]) + 1))
+end
+redis.call('SET', KEYS[2], tostring(now))
+return redis.call('ZCARD', KEYS[1])
+"""
+
+class TrendingService:
+    def __init__(self, redis_url: str = "redis://redis:6379", half_life_hours: float = 6,
+                 max_posts: int = 1000, min_score: float = 0.01):
+        self.redis = create_redis(redis_url)
+        self.key = "trending:comment_posts"
+        self.epoch_key = "trending:comment_posts:epoch"
+        self.half_life_seconds = half_life_hours * 3600
+        self.max_posts = max_posts
+        self.min_score = min_score
+        self.record_script = self.redis.register_script(RECORD_SCRIPT)
+        self.decay_script = self.redis.register_script(DECAY_SCRIPT)
+
+    async def record_like(self, post_id: int):
+        await self.record_script(keys=[self.key, self.epoch_key], args=[post_id, 1, self.half_life_seconds])
+
+    async def record_unlike(self, post_id: int, liked_at: float):
+        """Take back the weight of a like made at liked_at (Unix time)"""
+        await self.record_script(
+            keys=[self.key, self.epoch_key], args=[post_id, -1, self.half_life_seconds, liked_at]
+        )
+
+    async def get_trending(self, limit: int = 20):
+        """Top posts by decayed score; O(log n + limit) and never touches Postgres"""
+        entries = await self.redis.zrevrange(self.key, 0, limit - 1, withscores=True)
+        return [{"post_id": int(post_id), "score": round(score, 4)} for post_id, score in entries]
+
+    async def decay(self) -> int:
+        """Rebase scores to the current time and trim the set; returns the remaining size"""
+        return await self.decay_script(
+            keys=[self.key, self.epoch_key],
+            args=[self.half_life_seconds, self.min_score, self.max_posts],
+        )
+
+    async def run_decay_loop(self, interval_seconds: int):
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await self.decay()
+            except Exception as e:
+                logger.warning(f"Trending decay failed: {e}")
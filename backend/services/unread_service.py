@@ -0,0 +1,38 @@
+from services.redis_client import create_redis
+
+# Only bump counters that are already primed: a missing key means "unknown", and creating
+# it at 1 would hide messages that arrived while it was absent
+INCREMENT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCR', KEYS[1])
+end
+return false
+"""
+
+class UnreadService:
+    """Per-user unread message counters; dating_messages.read_at in Postgres is the source of truth.
+
+    Counters expire after ttl_seconds so any drift from a lost update heals on the next prime.
+    """
+
+    def __init__(self, redis_url: str = "redis://redis:6379", ttl_seconds: int = 86400):
+        self.redis = create_redis(redis_url)
+        self.ttl_seconds = ttl_seconds
+        self.increment_script = self.redis.register_script(INCREMENT_SCRIPT)
+
+    def key(self, user_id: int) -> str:
+        return f"unread:{user_id}"
+
+    async def get(self, user_id: int) -> int | None:
+        count = await self.redis.get(self.key(user_id))
+        return int(count) if count is not None else None
+
+    async def prime(self, user_id: int, count: int):
+        # NX: never overwrite a counter that was reset or incremented meanwhile
+        await self.redis.set(self.key(user_id), count, ex=self.ttl_seconds, nx=True)
+
+    async def increment(self, user_id: int):
+        await self.increment_script(keys=[self.key(user_id)])
+
+    async def reset(self, user_id: int, count: int = 0):
+        await self.redis.set(self.key(user_id), count, ex=self.ttl_seconds)
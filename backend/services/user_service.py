@@ -1,20 +1,16 @@
 import psycopg2
-from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
 from passlib.context import CryptContext
+from services.database import DatabaseService
+from services.invalidation import USER_UPDATED
+from services.statements import PreparedStatement
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-class UserService:
-    def __init__(self, dsn: str):
-        self.pool = psycopg2.pool.SimpleConnectionPool(1, 20, dsn, cursor_factory=RealDictCursor)
-    
-    def get_connection(self):
-        return self.pool.getconn()
-    
-    def put_connection(self, conn):
-        self.pool.putconn(conn)
+GET_USER_BY_ID = PreparedStatement(
+    "get_user_by_id", ["integer"], "SELECT id, username, email, hearts FROM users WHERE id = %s"
+)
 
+class UserService(DatabaseService):
     def create_user(self, username: str, email: str, password: str):
         hashed_pw = pwd_context.hash(password)
         conn = self.get_connection()
@@ -66,18 +62,40 @@ class UserService:
             self.put_connection(conn)
 
     def get_user_by_id(self, user_id: int):
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                GET_USER_BY_ID.execute(cur, (user_id,))
+                return cur.fetchone()
+        except Exception as e:
+            raise e
+        finally:
+            self.put_connection(conn)
+
+    def update_username(self, user_id: int, username: str):
+        """Rename a user; the copies on dating posts and messages follow via the propagate_username job"""
         conn = self.get_connection()
         try:
             with conn.cursor() as cur:
                 cur.execute(
-                    "SELECT id, username, email, hearts FROM users WHERE id = %s",
-                    (user_id,),
+                    "UPDATE users SET username = %s WHERE id = %s RETURNING id, username, email",
+                    (username, user_id)
                 )
-                return cur.fetchone()
+                user = cur.fetchone()
+                if not user:
+                    raise ValueError("User not found")
+                self.bump_versions(cur, [f"profile:{user_id}"], USER_UPDATED)
+                conn.commit()
+        except psycopg2.IntegrityError:
+            conn.rollback()
+            raise ValueError("Username already exists")
         except Exception as e:
+            conn.rollback()
             raise e
         finally:
             self.put_connection(conn)
+        self.enqueue("propagate_username", {"user_id": user_id})
+        return user
 
     def increment_hearts(self, user_id: int):
         conn = self.get_connection()
@@ -94,6 +112,30 @@ class UserService:
         finally:
             self.put_connection(conn)
 
+    def sync_hearts(self, user_ids: list[int]):
+        """Recompute hearts from heart_history; idempotent, so job retries cannot double count"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE users u SET hearts = (
+                        SELECT COUNT(*) FROM heart_history h
+                        JOIN comment_posts p ON p.id = h.post_id
+                        WHERE p.user_id = u.id
+                    )
+                    WHERE u.id = ANY(%s::int[])
+                    """,
+                    (user_ids,)
+                )
+                self.bump_versions(cur, [f"profile:{user_id}" for user_id in user_ids], USER_UPDATED)
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            self.put_connection(conn)
+
     def init_db(self):
         conn = self.get_connection()
         try:
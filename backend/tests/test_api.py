@@ -1,6 +1,11 @@
+import os
 import pytest
 import uuid
 from fastapi.testclient import TestClient
+
+# The default register bucket (5 per hour per IP) would fail repeated local runs
+os.environ.setdefault("RATE_LIMITS", "register=1000/60")
+
 from main import app
 
 
@@ -8,6 +13,39 @@ from main import app
 def client():
     return TestClient(app)
 
+def create_test_users(prefix: str, count: int) -> list[int]:
+    from dependencies import user_service
+    unique_id = uuid.uuid4().hex[:8]
+    conn = user_service.get_connection()
+    try:
+        with conn.cursor() as cur:
+            user_ids = []
+            for n in range(count):
+                cur.execute(
+                    "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, 'x') RETURNING id",
+                    (f"{prefix}{n}_{unique_id}", f"{prefix}{n}_{unique_id}@example.com")
+                )
+                user_ids.append(cur.fetchone()["id"])
+        conn.commit()
+        return user_ids
+    finally:
+        user_service.put_connection(conn)
+
+def delete_test_users(user_ids: list[int]):
+    from dependencies import user_service
+    conn = user_service.get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM dating_messages WHERE sender_id = ANY(%s) OR receiver_id = ANY(%s)", (user_ids, user_ids)
+            )
+            cur.execute("DELETE FROM dating_posts WHERE user_id = ANY(%s)", (user_ids,))
+            cur.execute("DELETE FROM comment_posts WHERE user_id = ANY(%s)", (user_ids,))
+            cur.execute("DELETE FROM users WHERE id = ANY(%s)", (user_ids,))
+        conn.commit()
+    finally:
+        user_service.put_connection(conn)
+
 def test_register_user(client):
     unique_id = str(uuid.uuid4())[:8]
     response = client.post("/auth/register", json={
@@ -227,3 +265,883 @@ def test_auth_endpoints_exist(client):
     })
     assert response.status_code in [200, 401, 500]  # Any response means endpoint exists
 
+def test_parse_rate_limits():
+    from config import parse_rate_limits
+
+    limits = parse_rate_limits("like=60/60, register=5/3600,")
+    assert limits == {"like": (60, 60), "register": (5, 3600)}
+
+def test_batch_likes_spend_one_token_per_post(monkeypatch):
+    import asyncio
+    from config import settings
+    from main import app
+    from dependencies import get_current_user
+    from services.rate_limit_service import RateLimitService
+
+    async def take_batches():
+        service = RateLimitService(settings.redis_url)
+        identity = f"test:{uuid.uuid4().hex}"
+        try:
+            first = await service.acquire("like", identity, 5, 60, cost=3)
+            second = await service.acquire("like", identity, 5, 60, cost=3)
+            return first, second
+        finally:
+            await service.redis.delete(f"rate_limit:like:{identity}")
+            await service.redis.aclose()
+    first, second = asyncio.run(take_batches())
+    assert first == (True, 0)
+    # 2 tokens left, 1 more refills every 12 seconds
+    assert second == (False, 12)
+
+    async def mock_get_current_user():
+        return 1
+    monkeypatch.setitem(settings.rate_limits, "like", (2, 60))
+    app.dependency_overrides[get_current_user] = mock_get_current_user
+    try:
+        response = TestClient(app).post("/comment_posts/batch/like", json={"post_ids": [1, 2, 3]})
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 422
+
+def test_batch_like_without_auth(client):
+    # Test batch liking without authentication should fail
+    response = client.post("/comment_posts/batch/like", json={"post_ids": [1, 2, 3]})
+    assert response.status_code == 401
+
+def test_batch_get_comment_posts(client):
+    # Batch lookup is public; unknown ids are reported rather than failing the batch
+    response = client.get("/comment_posts/batch?ids=1&ids=2")
+    assert response.status_code in [200, 500]
+    if response.status_code == 200:
+        assert "posts" in response.json()
+        assert "not_found" in response.json()
+
+def test_get_comment_posts_conditional(client):
+    from dependencies import get_current_user
+    # An unchanged feed answers a repeated poll with 304 and no body
+    response = client.get("/comment_posts")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    response = client.get("/comment_posts", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+    # A new post changes the tag, so the same poll gets the new feed
+    async def mock_get_current_user():
+        return 1
+    app.dependency_overrides[get_current_user] = mock_get_current_user
+    try:
+        response = client.post("/comment_posts", json={
+            "target_gender": "Female",
+            "target_job": "Engineer",
+            "target_birth_year": 1995,
+            "target_height": 165,
+            "target_app": "Tinder",
+            "comment": "Changes the feed ETag"
+        })
+        assert response.status_code == 200
+    finally:
+        app.dependency_overrides.clear()
+    response = client.get("/comment_posts", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+def compression_client(**options):
+    from starlette.responses import Response, StreamingResponse
+    from middleware.compression import CompressionMiddleware
+
+    async def app(scope, receive, send):
+        if scope["path"] == "/stream":
+            response = StreamingResponse(iter([b"a" * 2000, b"b" * 2000]), media_type="text/plain")
+        else:
+            size = int(scope["query_string"].decode().split("=")[1])
+            response = Response(b"x" * size, media_type="application/json")
+        await response(scope, receive, send)
+    return TestClient(CompressionMiddleware(app, paths=["/feed", "/stream"], minimum_size=1024, **options))
+
+def test_compression_gzip_and_minimum_size(monkeypatch):
+    import middleware.compression
+    # Without brotli installed, br falls back to gzip
+    monkeypatch.setattr(middleware.compression, "brotli", None)
+    client = compression_client()
+    response = client.get("/feed?size=5000", headers={"Accept-Encoding": "br, gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert int(response.headers["content-length"]) < 5000
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.content == b"x" * 5000
+    small = client.get("/feed?size=100", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers and small.headers["vary"] == "Accept-Encoding"
+    assert small.content == b"x" * 100
+    identity = client.get("/feed?size=5000", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers and identity.content == b"x" * 5000
+
+def test_compression_prefers_brotli():
+    pytest.importorskip("brotli")
+    response = compression_client().get("/feed?size=5000", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.content == b"x" * 5000
+
+def test_compression_honours_q_values(monkeypatch):
+    import middleware.compression
+    from middleware.compression import CompressionMiddleware
+    # choose_encoding only checks that brotli is importable
+    monkeypatch.setattr(middleware.compression, "brotli", object())
+    choose = CompressionMiddleware(None, paths=[]).choose_encoding
+    assert choose("gzip, br") == "br"
+    assert choose("br;q=0, gzip") == "gzip"
+    assert choose("br;q=0.5, gzip;q=0.8") == "gzip"
+    assert choose("gzip;q=0.8, br;q=0.8") == "br"
+    assert choose("gzip;q=0, br;q=0") is None
+    assert choose("*;q=0.5, br;q=0") == "gzip"
+    assert choose("identity, *;q=0") is None
+    assert choose("gzip;q=bogus") is None
+    monkeypatch.setattr(middleware.compression, "brotli", None)
+    assert choose("br;q=1.0, gzip;q=0.1") == "gzip"
+
+def test_compression_passes_streams_through():
+    response = compression_client().get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers and "vary" not in response.headers
+    assert response.content == b"a" * 2000 + b"b" * 2000
+
+def test_get_trending_comment_posts(client):
+    # Trending is served from Redis only
+    response = client.get("/comment_posts/trending?limit=10")
+    assert response.status_code in [200, 500]
+    if response.status_code == 200:
+        assert "trending" in response.json()
+
+def test_trending_unlike_takes_back_the_likes_own_weight():
+    import asyncio
+    import time
+    from config import settings
+    from services.trending_service import TrendingService
+
+    async def scenario():
+        service = TrendingService(settings.redis_url, half_life_hours=1)
+        service.key = f"trending:test:{uuid.uuid4().hex}"
+        service.epoch_key = f"{service.key}:epoch"
+        epoch = time.time() - 2 * 3600
+        try:
+            # Two likes made at the epoch weigh 1 each; a like made now would weigh 4
+            await service.redis.set(service.epoch_key, str(epoch))
+            await service.redis.zadd(service.key, {"1": 2})
+            await service.record_unlike(1, epoch)
+            assert await service.redis.zscore(service.key, "1") == pytest.approx(1, rel=1e-3)
+            await service.record_unlike(1, epoch)
+            assert await service.redis.zscore(service.key, "1") is None
+            await service.record_like(2)
+            await service.record_unlike(2, time.time())
+            assert await service.redis.zscore(service.key, "2") is None
+        finally:
+            await service.redis.delete(service.key, service.epoch_key)
+            await service.redis.aclose()
+    asyncio.run(scenario())
+
+def test_invalid_payload_rejected_before_auth(client):
+    # Malformed bodies fail validation before the session is even looked up
+    response = client.post("/dating", json={
+        "title": "Looking for love",
+        "description": "Test description",
+        "target_gender": "Female",
+        "target_age_min": 40,
+        "target_age_max": 25
+    })
+    assert response.status_code == 422
+
+    response = client.post("/dating/1/message", json={"content": ""})
+    assert response.status_code == 422
+
+    response = client.post("/messages/1/reply", json={"reply_content": ""})
+    assert response.status_code == 422
+
+def test_get_dating_posts_age_filter(client):
+    response = client.get("/dating?target_gender=female&age=30")
+    assert response.status_code in [200, 500]
+
+    # Ages outside the supported range are rejected before querying
+    response = client.get("/dating?age=7")
+    assert response.status_code == 422
+
+def test_recommendation_scores_and_top_k_merge():
+    from datetime import datetime, timedelta
+    from services.recommendation_service import RecommendationService
+    now = datetime(2026, 1, 1)
+
+    def post(post_id, user_id, gender, age_min, age_max, days_old=0, hearts=0):
+        return {"id": post_id, "user_id": user_id, "target_gender": gender, "target_age_min": age_min,
+                "target_age_max": age_max, "created_at": now - timedelta(days=days_old), "hearts": hearts}
+
+    rows = [
+        post(1, 10, "Female", 20, 30),
+        post(2, 11, "Male", 20, 30),
+        post(3, 12, "Female", 40, 50),
+        post(4, 13, "Female", 20, 30, days_old=10),
+        post(5, 99, "Female", 20, 30),  # the viewer's own post
+    ]
+    service = RecommendationService(top_k=3)
+    service.load(rows)
+    ranked = [item["post_id"] for item in service.recommend(99, "Female", 25)]
+    # Gender match and age fit beat recency; own posts never show up; only top_k are kept
+    assert ranked == [1, 4, 2]
+
+    # A new post is merged into the cached list, matching a full recompute
+    service.add_post(post(6, 14, "Female", 20, 30, days_old=-1))
+    merged = service.recommend(99, "Female", 25)
+    fresh = RecommendationService(top_k=3)
+    fresh.load(rows + [post(6, 14, "Female", 20, 30, days_old=-1)])
+    assert merged == fresh.recommend(99, "Female", 25)
+    assert [item["post_id"] for item in merged] == [6, 1, 4]
+
+    # Only the most recently used lists are kept
+    service.cache_size = 2
+    service.recommend(98, "Female", 25)
+    service.recommend(99, "Female", 25)
+    service.recommend(97, None, 40)
+    assert list(service.cache) == [(99, 2, 25), (97, -1, 40)]
+
+def test_recommendation_refresh_runs_off_the_event_loop():
+    import asyncio
+    import threading
+    from datetime import datetime
+    from services.recommendation_service import RecommendationService
+    loop_thread = threading.get_ident()
+    query_threads = []
+
+    class Candidates:
+        def get_recommendation_candidates(self, window_days):
+            query_threads.append(threading.get_ident())
+            return [{"id": 1, "user_id": 10, "target_gender": "Female", "target_age_min": 20,
+                     "target_age_max": 30, "created_at": datetime(2026, 1, 1), "hearts": 0}]
+
+    async def refresh_once(service):
+        task = asyncio.create_task(service.run_refresh_loop(Candidates(), 30, 60))
+        async with asyncio.timeout(5):
+            while not len(service.post_ids):
+                await asyncio.sleep(0.01)
+        task.cancel()
+
+    service = RecommendationService()
+    asyncio.run(refresh_once(service))
+    assert query_threads[0] != loop_thread
+    assert list(service.post_ids) == [1]
+
+def test_job_queue_dead_letters_unknown_jobs():
+    from services.job_queue import JobQueue
+    from config import settings
+    queue = JobQueue(redis_url=settings.redis_url, stream=f"test_jobs:{uuid.uuid4().hex[:8]}")
+    try:
+        queue.ensure_group()
+        queue.enqueue("missing_handler", {"value": 1})
+        entries = queue.redis.xreadgroup(queue.group, "test", {queue.stream: ">"}, count=1)
+        message_id, fields = entries[0][1][0]
+        queue.process(message_id, fields, attempts=1)
+        dead = queue.redis.xrange(queue.dead_letter_stream)
+        assert dead[0][1]["type"] == "missing_handler"
+        assert queue.redis.xpending(queue.stream, queue.group)["pending"] == 0
+    finally:
+        queue.redis.delete(queue.stream, queue.dead_letter_stream)
+
+def test_job_enqueue_is_bounded():
+    import time
+    from services.job_queue import JobQueue
+    from services.redis_client import redis_breaker
+    from utils.circuit_breaker import CircuitOpenError
+    from config import settings
+    queue = JobQueue(redis_url=settings.redis_url, stream=f"test_jobs:{uuid.uuid4().hex[:8]}")
+    assert queue.producer.connection_pool.connection_kwargs["socket_timeout"] == settings.redis_timeout_ms / 1000
+    redis_breaker.opened_at = time.monotonic()
+    try:
+        with pytest.raises(CircuitOpenError):
+            queue.enqueue("sync_hearts", {"user_ids": [1]})
+    finally:
+        redis_breaker.record_success()
+
+def test_unread_count_without_auth(client):
+    response = client.get("/messages/unread_count")
+    assert response.status_code == 401
+    response = client.post("/messages/read")
+    assert response.status_code == 401
+
+def test_unread_count_increments_and_resets_on_read(monkeypatch):
+    import redis
+    from config import settings
+    from dependencies import dating_service, job_queue, get_current_user, get_unread_service
+    from services.unread_service import UnreadService
+    monkeypatch.setattr(job_queue, "enqueue", lambda job_type, payload: None)
+    poster, sender = create_test_users("unread", 2)
+    unread_service = UnreadService(settings.redis_url)
+    counters = redis.Redis.from_url(settings.redis_url)
+    viewer = {"id": poster}
+
+    async def mock_get_current_user():
+        return viewer["id"]
+    app.dependency_overrides[get_current_user] = mock_get_current_user
+    app.dependency_overrides[get_unread_service] = lambda: unread_service
+    try:
+        post = dating_service.create_dating_post(poster, "Unread", "Counter test", "Female", 20, 30)
+        with TestClient(app) as client:
+            # The first read primes the counter from Postgres
+            assert client.get("/messages/unread_count").json()["unread"] == 0
+            viewer["id"] = sender
+            assert client.post(f"/dating/{post['id']}/message", json={"content": "hello"}).status_code == 200
+            viewer["id"] = poster
+            assert counters.get(unread_service.key(poster)) == b"1"
+            assert client.get("/messages/unread_count").json()["unread"] == 1
+            assert client.post("/messages/read").json()["marked"] == 1
+            assert counters.get(unread_service.key(poster)) == b"0"
+            assert client.get("/messages/unread_count").json()["unread"] == 0
+    finally:
+        app.dependency_overrides.clear()
+        counters.delete(unread_service.key(poster))
+        counters.close()
+        delete_test_users([poster, sender])
+
+def test_export_without_auth(client):
+    response = client.get("/users/export")
+    assert response.status_code == 401
+
+def test_export_streams_the_users_history_as_ndjson(monkeypatch):
+    import json
+    from config import settings
+    from dependencies import post_service, dating_service, job_queue, get_current_user
+    monkeypatch.setattr(job_queue, "enqueue", lambda job_type, payload: None)
+    # One row per cursor batch, so every section spans several fetches
+    monkeypatch.setattr(settings, "export_batch_size", 1)
+    owner, sender = create_test_users("export", 2)
+
+    async def mock_get_current_user():
+        return owner
+    app.dependency_overrides[get_current_user] = mock_get_current_user
+    try:
+        comment_posts = [
+            post_service.create_post(owner, "Female", "Engineer", 1990, 170, "app", str(n))["id"] for n in range(2)
+        ]
+        dating_post = dating_service.create_dating_post(owner, "Export", "History", "Female", 20, 30)["id"]
+        message = dating_service.send_message(sender, dating_post, "hello")["id"]
+        response = TestClient(app).get("/users/export")
+    finally:
+        app.dependency_overrides.clear()
+        delete_test_users([owner, sender])
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert f"o2gethem-export-{owner}.ndjson" in response.headers["content-disposition"]
+    assert response.text.endswith("\n")
+    records = [json.loads(line) for line in response.text.splitlines()]
+    # Sections in order, posts newest first
+    assert [(record["type"], record["data"]["id"]) for record in records] == [
+        ("comment_post", comment_posts[1]), ("comment_post", comment_posts[0]),
+        ("dating_post", dating_post), ("message", message)
+    ]
+    assert records[2]["data"]["message_count"] == 1
+    assert records[3]["data"]["content"] == "hello"
+
+def test_update_username_without_auth(client):
+    response = client.put("/users/username", json={"username": "renamed"})
+    assert response.status_code == 401
+
+def test_username_change_reaches_dating_posts_and_messages(monkeypatch):
+    import worker
+    from dependencies import dating_service, job_queue, get_current_user
+    jobs = []
+    monkeypatch.setattr(job_queue, "enqueue", lambda job_type, payload: jobs.append((job_type, payload)))
+    renamed, other = create_test_users("rename", 2)
+
+    class Handlers:
+        def __init__(self):
+            self.handlers = {}
+
+        def register(self, job_type, handler):
+            self.handlers[job_type] = handler
+    handlers = Handlers()
+    worker.register_jobs(handlers)
+
+    async def mock_get_current_user():
+        return renamed
+    app.dependency_overrides[get_current_user] = mock_get_current_user
+    new_name = f"renamed_{uuid.uuid4().hex[:8]}"
+    try:
+        post = dating_service.create_dating_post(renamed, "Rename", "Propagation", "Female", 20, 30)
+        other_post = dating_service.create_dating_post(other, "Other", "Propagation", "Male", 20, 30)
+        received = dating_service.send_message(other, post["id"], "to renamed")["id"]
+        sent = dating_service.send_message(renamed, other_post["id"], "from renamed")["id"]
+        jobs.clear()
+        response = TestClient(app).put("/users/username", json={"username": new_name})
+        assert response.status_code == 200 and response.json()["user"]["username"] == new_name
+        # The copies are rewritten by the worker, once the rename has committed
+        assert jobs == [("propagate_username", {"user_id": renamed})]
+        assert dating_service.get_dating_posts_by_ids([post["id"]])[0]["username"] != new_name
+        for job_type, payload in jobs:
+            handlers.handlers[job_type](payload)
+
+        assert dating_service.get_dating_posts_by_ids([post["id"]])[0]["username"] == new_name
+        assert dating_service.get_dating_posts_by_ids([other_post["id"]])[0]["username"] != new_name
+        messages = {message["id"]: message for message in dating_service.get_messages(other)}
+        assert messages[received]["receiver_username"] == new_name
+        assert messages[sent]["sender_username"] == new_name
+        assert messages[received]["sender_username"] != new_name
+    finally:
+        app.dependency_overrides.clear()
+        delete_test_users([renamed, other])
+
+def test_bulk_loader_reads_csv_and_ndjson(tmp_path):
+    from services.bulk_loader import read_records, chunked
+    csv_file = tmp_path / "users.csv"
+    csv_file.write_text("id,username,email\n1,alice,\n2,bob,bob@example.com\n")
+    ndjson_file = tmp_path / "posts.ndjson"
+    ndjson_file.write_text('{"id": 1, "comment": ""}\n\n{"id": 2, "comment": null}\n')
+
+    users = list(read_records(str(csv_file)))
+    assert users[0] == {"id": "1", "username": "alice", "email": None}
+    posts = list(read_records(str(ndjson_file)))
+    assert [post["comment"] for post in posts] == ["", None]
+    assert [len(chunk) for chunk in chunked(range(5), 2)] == [2, 2, 1]
+
+def test_bulk_loader_copies_messages_onto_their_shard(tmp_path):
+    import json
+    from config import settings
+    from services.bulk_loader import BulkLoader, read_records
+    from services.dating_service import DatingService
+    # The main database doubles as the only shard
+    service = DatingService(settings.database_dsn, message_shard_dsns=[settings.database_dsn])
+    loader = BulkLoader(settings.database_dsn, service)
+    unique_id = uuid.uuid4().hex[:8]
+    conn = loader.get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, 'x'), (%s, %s, 'x') RETURNING id",
+                (f"load_a_{unique_id}", f"load_a_{unique_id}@example.com", f"load_b_{unique_id}", f"load_b_{unique_id}@example.com")
+            )
+            sender, receiver = [row["id"] for row in cur.fetchall()]
+        conn.commit()
+        messages = tmp_path / "messages.ndjson"
+        messages.write_text(json.dumps({
+            "sender_id": sender, "receiver_id": receiver, "dating_post_id": 1,
+            "content": unique_id, "created_at": "2024-02-03T04:05:06"
+        }) + "\n")
+        assert loader.copy_table("dating_messages", read_records(str(messages)), None) == 1
+
+        shard = service.messages.shards[0]
+        assert shard is not service
+        with conn.cursor() as cur:
+            cur.execute("SELECT * FROM dating_messages WHERE content = %s", (unique_id,))
+            loaded = cur.fetchone()
+            assert (loaded["sender_username"], loaded["receiver_username"]) == (f"load_a_{unique_id}", f"load_b_{unique_id}")
+            # The id came from the main database's sequence
+            cur.execute("SELECT last_value FROM dating_messages_id_seq")
+            assert cur.fetchone()["last_value"] >= loaded["id"]
+            cur.execute("DELETE FROM dating_messages WHERE id = %s", (loaded["id"],))
+            cur.execute("DELETE FROM users WHERE id IN (%s, %s)", (sender, receiver))
+        conn.commit()
+    finally:
+        loader.put_connection(conn)
+        loader.pool.closeall()
+        service.pool.closeall()
+        service.messages.shards[0].pool.closeall()
+
+def test_prepared_statements_are_reused_across_calls():
+    from config import settings
+    from services.database import DatabaseService
+    from services.post_service import get_posts_statement
+    statement = get_posts_statement(())
+    service = DatabaseService(settings.database_dsn)
+    try:
+        conn = service.get_connection()
+        with conn.cursor() as cur:
+            for _ in range(3):
+                statement.execute(cur, (None, None, None, 1, 0))
+                cur.fetchall()
+            # Prepared once: a second PREPARE of the same name would have raised
+            cur.execute(
+                "SELECT generic_plans + custom_plans AS runs FROM pg_prepared_statements WHERE name = %s",
+                (statement.name,)
+            )
+            assert cur.fetchone()["runs"] == 3
+        conn.rollback()
+        service.put_connection(conn)
+        # The pool hands the same session back, still knowing the statement
+        again = service.get_connection()
+        assert again is conn and statement.name in again.prepared_statements
+        with again.cursor() as cur:
+            statement.execute(cur, (None, None, None, 1, 0))
+            cur.fetchall()
+        service.put_connection(again)
+    finally:
+        service.pool.closeall()
+
+def test_circuit_breaker_opens_and_half_opens():
+    from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_seconds=0.05)
+    breaker.record_failure()
+    breaker.allow()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    import time
+    time.sleep(0.06)
+    breaker.allow()  # half-open: one trial call goes through
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.opened_at is None
+    breaker.allow()
+    breaker.allow()
+
+def test_statement_timeouts_do_not_trip_the_breaker():
+    import psycopg2.errors
+    from dependencies import post_service
+    conn = post_service.get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL statement_timeout = '10ms'")  # a success resets the count
+            with pytest.raises(psycopg2.errors.QueryCanceled):
+                cur.execute("SELECT pg_sleep(1)")
+        assert conn.circuit_breaker.failures == 0
+    finally:
+        conn.rollback()
+        post_service.put_connection(conn)
+
+def test_message_shard_routing():
+    from services.message_shards import MessageShards, jump_hash, conversation_key
+    shards = MessageShards(["a", "b", "c"])
+    # Either participant can look the conversation up
+    assert shards.for_conversation(7, 1, 2) == shards.for_conversation(7, 2, 1)
+    assert shards.fan_out(lambda shard: shard.upper()) == ["A", "B", "C"]
+    keys = [conversation_key(post_id, 1, 2) for post_id in range(1000)]
+    # Adding a shard only moves conversations onto the new one
+    moved = [key for key in keys if jump_hash(key, 3) != jump_hash(key, 2)]
+    assert all(jump_hash(key, 3) == 2 for key in moved)
+    assert 200 < len(moved) < 470
+
+def test_local_cache_invalidation():
+    from services.invalidation import LocalCache, InvalidationListener, POST_CHANGED, encode_keys, decode_keys
+    cache = LocalCache(ttl_seconds=60)
+    listener = InvalidationListener("")
+    listener.attach(cache)
+    cache.set("comment_posts", 1, cache.generation)
+    assert cache.get("comment_posts") is None  # off until the listener is connected
+    listener.set_listening(True)
+    cache.set("comment_posts", 1, cache.generation)
+    cache.set("profile:1", 1, cache.generation)
+    assert cache.get("comment_posts") == 1
+    generation = cache.generation
+    listener.dispatch(POST_CHANGED, decode_keys(encode_keys(["comment_posts"])))
+    assert cache.get("comment_posts") is None and cache.get("profile:1") == 1
+    cache.set("comment_posts", 1, generation)  # read before the eviction: dropped
+    assert cache.get("comment_posts") is None
+    assert decode_keys(encode_keys([f"profile:{i}" for i in range(2000)])) is None
+
+def test_request_deadline_budget():
+    from utils.deadline import set_deadline, remaining_seconds, request_deadline, DeadlineExceeded
+    assert remaining_seconds(0.5) == 0.5
+    token = set_deadline(10)
+    try:
+        assert remaining_seconds(0.5) == 0.5
+        assert 9 < remaining_seconds() <= 10
+    finally:
+        request_deadline.reset(token)
+    token = set_deadline(-1)
+    try:
+        with pytest.raises(DeadlineExceeded):
+            remaining_seconds()
+    finally:
+        request_deadline.reset(token)
+
+def test_signed_session_tokens():
+    import asyncio
+    from services.signed_session_service import SignedSessionService
+    from config import settings
+    service = SignedSessionService("test-secret", redis_url=settings.redis_url, ttl_seconds=60)
+
+    async def run():
+        token = await service.create_session(42)
+        assert await service.get_user_id(token) == 42
+        assert service.refresh(token) is None  # still fresh
+        user_id, sid, expires = token.split(".")[:3]
+        forged = f"7.{sid}.{expires}.{token.rsplit('.', 1)[1]}"
+        assert await service.get_user_id(forged) is None
+        await service.delete_session(token)
+        assert await service.get_user_id(token) is None
+        service.revoked.clear()
+        await service.sync_revocations()
+        assert await service.get_user_id(token) is None
+        await service.redis.zrem(service.revoked_key, sid)
+
+    asyncio.run(run())
+
+def test_session_refresh_reaches_route_built_responses():
+    from starlette.requests import Request
+    from starlette.responses import Response
+    from dependencies import set_session_cookie
+    from middleware.session_refresh import SessionRefreshMiddleware
+
+    async def conditional_get(scope, receive, send):
+        # As get_current_user does on a half-used signed token, then a 304 built by the route
+        Request(scope).state.refreshed_session_id = "renewed-token"
+        await Response(status_code=304)(scope, receive, send)
+    response = TestClient(SessionRefreshMiddleware(conditional_get, set_session_cookie)).get("/messages")
+    assert response.status_code == 304
+    assert response.cookies["session_id"] == "renewed-token"
+    assert "httponly" in response.headers["set-cookie"].lower()
+
+def test_loop_lag_monitor_catches_blocking_call():
+    import asyncio
+    import time
+    from utils.profiling import LoopLagMonitor
+    monitor = LoopLagMonitor(interval=0.01, threshold=0.05)
+
+    async def run():
+        task = asyncio.create_task(monitor.run())
+        await asyncio.sleep(0.05)
+        time.sleep(0.2)  # blocks the loop, as a sync psycopg2 or bcrypt call would
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(run())
+    assert monitor.stalls == 1
+    assert "test_api.py" in monitor.recent_stalls[0]["stack"]
+    assert "event_loop_stalls_total 1" in monitor.metrics()
+
+def test_unit_of_work_lends_one_connection():
+    from services.database import UnitOfWork, current_unit_of_work
+    from dependencies import user_service, post_service
+    work = UnitOfWork(transaction=True)
+    token = current_unit_of_work.set(work)
+    try:
+        first = user_service.get_connection()
+        user_service.put_connection(first)
+        second = post_service.get_read_connection()
+        post_service.put_connection(second)
+        assert first is second and first.defer_commit
+    finally:
+        current_unit_of_work.reset(token)
+        work.close()
+    assert not work.held and not first.defer_commit
+
+def test_unit_of_work_release_commits_and_keeps_the_replica():
+    from services.database import DatabaseService, UnitOfWork, current_unit_of_work
+    from config import settings
+    # Two replicas (both the primary here) so the round robin would switch between reads
+    class RecordingQueue:
+        def __init__(self):
+            self.jobs = []
+
+        def enqueue(self, job_type, payload):
+            self.jobs.append((job_type, payload))
+
+    queue = RecordingQueue()
+    service = DatabaseService(settings.database_dsn, [settings.database_dsn, settings.database_dsn], queue)
+    work = UnitOfWork(transaction=True)
+    token = current_unit_of_work.set(work)
+    try:
+        conn = service.get_connection()
+        service.enqueue("noop", {"id": 1})
+        assert queue.jobs == []
+        work.release()
+        # The deferred job is sent although the unit is still current
+        assert queue.jobs == [("noop", {"id": 1})] and not work.after_commit
+        assert not work.held and id(conn) not in service.pool._rused
+        # The unit stays current; the next call checks out again
+        assert work.holds(service.get_connection())
+    finally:
+        current_unit_of_work.reset(token)
+        work.close()
+
+    work = UnitOfWork()
+    token = current_unit_of_work.set(work)
+    try:
+        first = service._borrowed[id(service.get_read_connection())]
+        work.release()
+        second = service._borrowed[id(service.get_read_connection())]
+        assert first is second
+    finally:
+        current_unit_of_work.reset(token)
+        work.close()
+        service.pool.closeall()
+        for replica_pool in service.replica_pools:
+            replica_pool.closeall()
+
+def test_dating_partition_takes_over_default_rows():
+    from datetime import datetime
+    from dependencies import dating_service
+    dating_service.ensure_partitions()
+    conn = dating_service.get_connection()
+    try:
+        with conn.cursor() as cur:
+            # A post dated past the partitions created ahead lands in the DEFAULT partition
+            cur.execute(
+                """
+                INSERT INTO dating_posts (title, description, target_gender, target_age_min, target_age_max, created_at)
+                VALUES ('Later', 'Later', 'Male', 20, 30, '2031-03-05') RETURNING tableoid::regclass::text AS part
+                """
+            )
+            assert cur.fetchone()["part"] == "dating_posts_default"
+            dating_service._create_month_partition(cur, "dating_posts", datetime(2031, 3, 1), datetime(2031, 4, 1))
+            cur.execute("SELECT tableoid::regclass::text AS part FROM dating_posts WHERE created_at = '2031-03-05'")
+            assert [row["part"] for row in cur.fetchall()] == ["dating_posts_p203103"]
+    finally:
+        conn.rollback()
+        dating_service.put_connection(conn)
+
+def test_reads_go_to_replicas_until_the_session_writes(monkeypatch):
+    import asyncio
+    from starlette.requests import Request
+    import dependencies
+    from config import settings
+    from services.database import DatabaseService
+    from services.session_service import SessionService
+    # The primary doubles as its own replica here; the pools are still separate
+    service = DatabaseService(settings.database_dsn, [settings.database_dsn])
+    try:
+        replica = service.get_read_connection()
+        assert service._borrowed[id(replica)] is service.replica_pools[0]
+        service.put_connection(replica)
+        primary = service.get_read_connection(use_primary=True)
+        assert id(primary) not in service._borrowed and id(primary) in service.pool._rused
+        service.put_connection(primary)
+        write = service.get_connection()
+        assert id(write) not in service._borrowed and id(write) in service.pool._rused
+        service.put_connection(write)
+    finally:
+        service.pool.closeall()
+        service.replica_pools[0].closeall()
+
+    session_id = uuid.uuid4().hex
+    request = Request({"type": "http", "headers": [(b"cookie", f"session_id={session_id}".encode())]})
+    session_service = SessionService(settings.redis_url, read_your_writes_seconds=5)
+    monkeypatch.setattr(dependencies, "session_service", session_service)
+    monkeypatch.setattr(settings, "database_replica_dsns", [settings.database_dsn])
+
+    async def pinned_before_and_after_write():
+        try:
+            before = await dependencies.use_primary_for_reads(request)
+            await dependencies.record_write(request)
+            return before, await dependencies.use_primary_for_reads(request)
+        finally:
+            await session_service.redis.delete(f"session_write:{session_id}")
+            await session_service.redis.aclose()
+    assert asyncio.run(pinned_before_and_after_write()) == (False, True)
+
+def test_versions_read_on_the_body_replica():
+    from services.database import DatabaseService, UnitOfWork, current_unit_of_work
+    from config import settings
+    # The primary doubles as its own replica here
+    service = DatabaseService(settings.database_dsn, [settings.database_dsn])
+    work = UnitOfWork()
+    token = current_unit_of_work.set(work)
+    try:
+        service.get_versions(["comment_posts"])
+        conn = service.get_read_connection()
+        service.put_connection(conn)
+        assert list(work.held) == [(service.dsn, False)] and work.holds(conn)
+    finally:
+        current_unit_of_work.reset(token)
+        work.close()
+        service.pool.closeall()
+        service.replica_pools[0].closeall()
+
+def test_get_posts_pages_in_sql_and_defers_feed_refresh(monkeypatch):
+    from dependencies import post_service
+    jobs = []
+    monkeypatch.setattr(post_service.job_queue, "enqueue", lambda job_type, payload: jobs.append((job_type, payload)))
+    unique_id = uuid.uuid4().hex[:8]
+    conn = post_service.get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, 'x') RETURNING id",
+                (f"page_{unique_id}", f"page_{unique_id}@example.com")
+            )
+            user_id = cur.fetchone()["id"]
+        conn.commit()
+    finally:
+        post_service.put_connection(conn)
+    try:
+        created = [
+            post_service.create_post(user_id, "Female", f"job_{unique_id}", 1990, 170, "app", str(n))["id"]
+            for n in range(3)
+        ]
+        # The materialized pages are rebuilt by the worker, not by the request
+        assert jobs == [("refresh_feed", {"feed": "comment_posts"})] * 3
+        filters = {"target_job": f"job_{unique_id}"}
+        newest_first = created[::-1]
+        assert [post["id"] for post in post_service.get_posts(filters)] == newest_first
+        assert [post["id"] for post in post_service.get_posts(filters, limit=1, offset=1)] == newest_first[1:2]
+        assert [post["id"] for post in post_service.get_posts(filters, offset=2)] == newest_first[2:]
+    finally:
+        conn = post_service.get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM comment_posts WHERE user_id = %s", (user_id,))
+                cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
+            conn.commit()
+        finally:
+            post_service.put_connection(conn)
+
+def test_feed_materializer_variants():
+    from services.feed_materializer import FeedMaterializer
+    from config import settings
+    materializer = FeedMaterializer(settings.redis_url, page_size=10)
+    materializer.register("comment_posts", lambda limit, **variant: (0, []), lambda: [{}, {"target_gender": "Female"}])
+    assert materializer.key("comment_posts", {}) == "feed:comment_posts:all"
+    assert materializer.key("comment_posts", {"target_gender": "Female"}) == "feed:comment_posts:target_gender=Female"
+    assert materializer.is_materialized("comment_posts", {"target_gender": "Female"})
+    assert not materializer.is_materialized("comment_posts", {"target_job": "eng"})
+    assert not materializer.is_materialized("dating_posts", {})
+
+def test_comment_post_stats_endpoint(client):
+    response = client.get("/comment_posts/stats?dimension=target_app&limit=5")
+    assert response.status_code == 200
+    assert list(response.json()["stats"]) == ["target_app"]
+    assert client.get("/comment_posts/stats?dimension=comment").status_code == 422
+
+def test_idempotency_middleware_replays_first_response():
+    import asyncio
+    from fastapi.responses import JSONResponse
+    from config import settings
+    from middleware.idempotency import IdempotencyMiddleware
+    from services.idempotency_service import IdempotencyService
+    calls = []
+
+    async def create(scope, receive, send):
+        message = await receive()
+        calls.append(message["body"])
+        await JSONResponse({"post": {"id": len(calls)}})(scope, receive, send)
+
+    async def identify(session_id):
+        return 1
+
+    async def post(app, key, body):
+        sent = []
+        scope = {
+            "type": "http", "method": "POST", "path": "/comment_posts", "query_string": b"",
+            "headers": [(b"idempotency-key", key.encode()), (b"cookie", b"session_id=abc")],
+        }
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+        await app(scope, receive, send)
+        return sent[0]["status"], dict(sent[0]["headers"]), sent[1]["body"]
+
+    async def run():
+        service = IdempotencyService(settings.redis_url, ttl_seconds=60, lock_seconds=1)
+        app = IdempotencyMiddleware(create, service, identify, paths=[r"/comment_posts"])
+        key = str(uuid.uuid4())
+        return await asyncio.gather(post(app, key, b"{}"), post(app, key, b"{}")), await post(app, key, b"[]")
+
+    (first, retry), other = asyncio.run(run())
+    assert len(calls) == 1
+    assert first[0] == retry[0] == 200 and retry[2] == first[2]
+    # Either duplicate may win the lock; the other one is the replay
+    assert sorted(b"idempotent-replayed" in headers for _, headers, _ in (first, retry)) == [False, True]
+    assert other[0] == 422
@@ -0,0 +1,59 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} circuit is open; retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Fails calls fast after failure_threshold consecutive backend failures.
+
+    While open, allow() raises CircuitOpenError without touching the backend. After
+    reset_seconds one trial call is let through (half-open) while the rest keep failing
+    fast: a success closes the circuit, a failure re-opens it for a further reset_seconds.
+    A trial that reports neither (its error was the caller's own) is replaced by another
+    after reset_seconds.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 10):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+        # Shard fan-outs report from worker threads
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            now = time.monotonic()
+            elapsed = now - self.opened_at
+            if elapsed < self.reset_seconds:
+                raise CircuitOpenError(self.name, self.reset_seconds - elapsed)
+            if self.probe_started_at is not None and now - self.probe_started_at < self.reset_seconds:
+                raise CircuitOpenError(self.name, self.reset_seconds - (now - self.probe_started_at))
+            self.probe_started_at = now
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info(f"{self.name} circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"{self.name} circuit opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+                self.probe_started_at = None
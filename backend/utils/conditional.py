@@ -0,0 +1,18 @@
+import hashlib
+from fastapi import Request, Response
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+def not_modified(request: Request, etag: str) -> Response | None:
+    """Return a 304 response when the client's If-None-Match already matches etag"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    # Clients may keep the body but must revalidate on every poll
+    response.headers["Cache-Control"] = "no-cache"
@@ -0,0 +1,25 @@
+import time
+from contextvars import ContextVar
+
+# Absolute time.monotonic() by which the current request must finish; None outside requests
+request_deadline: ContextVar[float | None] = ContextVar("request_deadline", default=None)
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before a backend call could start"""
+
+def set_deadline(timeout_seconds: float):
+    return request_deadline.set(time.monotonic() + timeout_seconds)
+
+def remaining_seconds(cap: float | None = None) -> float | None:
+    """Time left in the current request's budget, capped at cap; cap alone outside requests.
+
+    Raises DeadlineExceeded once the budget is spent, so callers never start work that
+    the client has already given up on.
+    """
+    deadline = request_deadline.get()
+    if deadline is None:
+        return cap
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return remaining if cap is None else min(remaining, cap)
@@ -0,0 +1,123 @@
+import asyncio
+import faulthandler
+import logging
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+def collapse_stack(frame) -> str:
+    """Root-first "file:function;file:function" line, the input format of flame graph tools"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class StackSampler:
+    """Samples one thread's Python stack every interval seconds from a helper thread.
+
+    Unlike cProfile it also sees time spent inside C calls (bcrypt, libpq) as the Python
+    line that made them, and it costs the sampled thread nothing.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[collapse_stack(frame)] += 1
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a timer, and captures who blocked it.
+
+    A heartbeat coroutine sleeps interval seconds at a time and records how late each
+    wake-up was. Before each sleep it arms faulthandler to dump every thread's stack if the
+    wake-up is more than threshold late. faulthandler's timer is a C thread that does not
+    need the GIL, so the dump shows the blocking call even inside C code that holds the GIL
+    (bcrypt), where no Python watchdog thread could run. faulthandler has one such timer per
+    process, so nothing else may use dump_traceback_later alongside the monitor.
+    """
+
+    # Upper bounds (seconds) of the lag histogram buckets
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, interval: float = 0.05, threshold: float = 0.1, history: int = 20):
+        self.interval = interval
+        self.threshold = threshold
+        self.bucket_counts = [0] * len(self.buckets)
+        self.lag_count = 0
+        self.lag_sum = 0.0
+        self.stalls = 0
+        self.last_lag = 0.0
+        # Most recent stalls with their stacks, newest last
+        self.recent_stalls = deque(maxlen=history)
+
+    def record_lag(self, lag: float):
+        self.last_lag = lag
+        self.lag_count += 1
+        self.lag_sum += lag
+        for index, bound in enumerate(self.buckets):
+            if lag <= bound:
+                self.bucket_counts[index] += 1
+                break
+
+    async def run(self):
+        # faulthandler writes straight to a file descriptor, so stacks go through a temp file
+        with tempfile.TemporaryFile() as dump:
+            try:
+                while True:
+                    beat_at = time.monotonic()
+                    faulthandler.dump_traceback_later(self.interval + self.threshold, file=dump)
+                    await asyncio.sleep(self.interval)
+                    faulthandler.cancel_dump_traceback_later()
+                    lag = max(0.0, time.monotonic() - beat_at - self.interval)
+                    self.record_lag(lag)
+                    if lag > self.threshold:
+                        dump.seek(0)
+                        stack = dump.read().decode(errors="replace") or "(not captured)\n"
+                        self.stalls += 1
+                        self.recent_stalls.append({"at": time.time(), "lag_seconds": round(lag, 3), "stack": stack})
+                        logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms in:\n{stack}")
+                    dump.seek(0)
+                    dump.truncate()
+            finally:
+                faulthandler.cancel_dump_traceback_later()
+
+    def metrics(self) -> str:
+        """Prometheus text exposition of the lag histogram and stall counter"""
+        lines = [
+            "# HELP event_loop_lag_seconds How late the event loop ran a timer callback",
+            "# TYPE event_loop_lag_seconds histogram",
+        ]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            cumulative += count
+            lines.append(f'event_loop_lag_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines += [
+            f'event_loop_lag_seconds_bucket{{le="+Inf"}} {self.lag_count}',
+            f"event_loop_lag_seconds_sum {self.lag_sum:.6f}",
+            f"event_loop_lag_seconds_count {self.lag_count}",
+            "# HELP event_loop_stalls_total Times the event loop was blocked for longer than the threshold",
+            "# TYPE event_loop_stalls_total counter",
+            f"event_loop_stalls_total {self.stalls}",
+        ]
+        return "\n".join(lines) + "\n"
@@ -1,3 +1,6 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
 from typing import Any, Optional
 
 def success_response(data: Any = None, message: str = "Success") -> dict:
@@ -10,4 +13,19 @@ def success_response(data: Any = None, message: str = "Success") -> dict:
     return response
 
 def error_response(message: str, status: str = "error") -> dict:
-    return {"status": status, "message": message}
\ No newline at end of file
+    return {"status": status, "message": message}
+
+def _json_default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def to_json(value: Any) -> str:
+    """JSON text of service rows; dates and timestamps become ISO strings as in API responses"""
+    return json.dumps(value, default=_json_default, ensure_ascii=False)
+
+def ndjson_line(record_type: str, record: dict) -> bytes:
+    """One newline-terminated JSON object for NDJSON streams"""
+    return (to_json({"type": record_type, "data": record}) + "\n").encode()
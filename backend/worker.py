@@ -0,0 +1,49 @@
+import argparse
+import asyncio
+import logging
+import threading
+import time
+from dependencies import dating_service, feed_materializer, job_queue, user_service
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+def register_jobs(queue):
+    queue.register("sync_hearts", lambda payload: user_service.sync_hearts(payload["user_ids"]))
+    queue.register("propagate_username", lambda payload: dating_service.propagate_username(payload["user_id"]))
+    # The materializer's Redis client is async; one loop for the worker's lifetime keeps its connections
+    feed_loop = asyncio.new_event_loop()
+    queue.register(
+        "refresh_feed", lambda payload: feed_loop.run_until_complete(feed_materializer.refresh(payload["feed"]))
+    )
+
+def maintain_partitions():
+    dating_service.maintain_partitions(settings.dating_retention_months, settings.dating_retention_mode)
+
+def run_partition_maintenance_loop(interval_seconds: int):
+    while True:
+        try:
+            maintain_partitions()
+        except Exception as e:
+            logger.warning(f"Partition maintenance failed: {e}")
+        time.sleep(interval_seconds)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a background job worker")
+    parser.add_argument("--consumer", help="Consumer name within the group (default: hostname-pid)")
+    parser.add_argument("--count", type=int, default=10, help="Jobs read per XREADGROUP call")
+    parser.add_argument("--maintain-partitions", action="store_true",
+                        help="Create upcoming dating partitions and apply retention once, then exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.maintain_partitions:
+        maintain_partitions()
+    else:
+        threading.Thread(
+            target=run_partition_maintenance_loop,
+            args=(settings.partition_maintenance_interval_seconds,),
+            daemon=True
+        ).start()
+        register_jobs(job_queue)
+        job_queue.run_worker(args.consumer, args.count)